@@ -9,14 +9,27 @@ import warnings
 import datetime
 import tempfile
 import zipfile
+import itertools
 import io
+import openpyxl
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import re
+import time
+import json
+import hashlib
+import shutil
+import threading
+import tracemalloc
+import functools
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from matplotlib.font_manager import FontProperties
 import seaborn as sns
 from scipy.optimize import curve_fit
+from scipy.special import erfc, betaln
 
 
 # ==================== 基础配置 ====================
@@ -358,41 +371,678 @@ def create_reverse_mapping(channel_mapping):
             reverse_mapping[str(pid)] = channel_name
     return reverse_mapping
 
+# ==================== pid字典编码 ====================
+class PidDictionary:
+    """pid规整字符串 ↔ 紧凑整数编码（int32）
+
+    编码只增不减，在字典的生命周期内保持稳定。渠道映射与ARPU聚合都在编码上计算，
+    字符串只在展示与落盘时还原（落盘文件仍存字符串，编码不跨进程）。
+    进程级共享的字典只登记管理员存储的pid（见get_pid_dictionary），用户上传的数据使用各自的字典，随数据一起释放。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._pids = []
+        self._pid_array = np.empty(0, dtype=object)
+        self._sort_ranks = np.empty(0, dtype=np.int64)
+        self._sorted_codes = np.empty(0, dtype=np.int64)
+        self._sorted_pids = np.empty(0, dtype=object)
+        self._channel_slots = {}
+
+    def __len__(self):
+        return len(self._pids)
+
+    @staticmethod
+    def normalize(pid_values):
+        """pid按原实现规整为字符串（去掉'.0'），只对去重后的原始值做一次；缺失的pid记为'nan'
+
+        返回 (行编码, 去重后原始值对应的规整pid，可能有重复)
+        """
+        if not isinstance(pid_values, pd.Series):
+            pid_values = np.asarray(pid_values, dtype=object)
+        raw_codes, raw_pids = pd.factorize(pid_values, use_na_sentinel=False)
+        normalized_pids = pd.Series(raw_pids, dtype=object).map(str).str.replace('.0', '', regex=False)
+        return raw_codes, normalized_pids.to_numpy(dtype=object)
+
+    def _lookup(self, unique_pids):
+        """规整pid → 编码，新pid追加到字典末尾"""
+        codes = np.empty(len(unique_pids), dtype=np.int32)
+        with self._lock:
+            for position, pid in enumerate(unique_pids):
+                code = self._codes.get(pid)
+                if code is None:
+                    code = len(self._pids)
+                    self._codes[pid] = code
+                    self._pids.append(pid)
+                codes[position] = code
+        return codes
+
+    def encode(self, pid_values):
+        """原始pid（数值或字符串）→ 每行的编码"""
+        raw_codes, normalized_pids = self.normalize(pid_values)
+        return self._lookup(normalized_pids)[raw_codes]
+
+    def encode_strings(self, pids):
+        """已规整的pid字符串（如索引文件中保存的pid）→ 编码，不再做'.0'规整"""
+        local_codes, unique_pids = pd.factorize(np.asarray(pids, dtype=object))
+        return self._lookup(unique_pids)[local_codes]
+
+    def decode(self, codes):
+        """编码 → pid字符串数组"""
+        return self.pid_array()[np.asarray(codes, dtype=np.int64)]
+
+    @staticmethod
+    def canonical(pid_series):
+        """规整后的pid列（不登记到字典），用于仍需字符串列的读取、展示与落盘路径"""
+        raw_codes, normalized_pids = PidDictionary.normalize(pid_series)
+        return pd.Series(normalized_pids[raw_codes], index=pid_series.index, dtype=object)
+
+    def pid_array(self):
+        """全部pid字符串（下标即编码）"""
+        with self._lock:
+            if len(self._pid_array) != len(self._pids):
+                self._pid_array = np.array(self._pids, dtype=object)
+            return self._pid_array
+
+    def sort_ranks(self):
+        """每个编码在全部pid按字符串排序后的名次，用于复现原实现按pid字符串排序的渠道顺序
+
+        字典增长后只对新增pid排序，再按位置并入已排好的顺序（pid互不重复，不存在并列）。
+        """
+        pids = self.pid_array()
+        with self._lock:
+            known = len(self._sorted_codes)
+            if known != len(pids):
+                new_codes = np.arange(known, len(pids))
+                new_codes = new_codes[np.argsort(pids[known:], kind='stable')]
+                positions = np.searchsorted(self._sorted_pids, pids[new_codes])
+                self._sorted_codes = np.insert(self._sorted_codes, positions, new_codes)
+                self._sorted_pids = np.insert(self._sorted_pids, positions, pids[new_codes])
+                ranks = np.empty(len(pids), dtype=np.int64)
+                ranks[self._sorted_codes] = np.arange(len(pids))
+                self._sort_ranks = ranks
+            return self._sort_ranks
+
+    def channel_slots(self, channel_mapping):
+        """每个编码对应的渠道槽位（未映射为-1）及槽位对应的渠道名
+
+        结果按渠道映射内容缓存；字典新增pid后只补算新增部分。
+        """
+        key = tuple((channel, tuple(str(pid) for pid in pids or ())) for channel, pids in channel_mapping.items())
+        pids = self.pid_array()
+        with self._lock:
+            cached = self._channel_slots.get(key)
+        if cached is not None and len(cached[0]) >= len(pids):
+            return cached
+
+        reverse_mapping = create_reverse_mapping(channel_mapping)
+        slot_names = list(dict.fromkeys(reverse_mapping.values()))
+        slot_of = {channel: slot for slot, channel in enumerate(slot_names)}
+        start = 0 if cached is None else len(cached[0])
+        new_slots = np.fromiter((slot_of.get(reverse_mapping.get(pid), -1) for pid in pids[start:]),
+                                dtype=np.int64, count=len(pids) - start)
+        cached = (new_slots if cached is None else np.concatenate([cached[0], new_slots]), slot_names)
+        with self._lock:
+            if len(self._channel_slots) >= 16:
+                self._channel_slots.clear()
+            self._channel_slots[key] = cached
+        return cached
+
+@st.cache_resource
+def get_pid_dictionary():
+    """管理员存储共用的pid字典（所有用户、会话与重跑共用），管理员数据变化时随arpu-store命名空间一起重建，
+    大小以当前存储中的pid为界；已构建的索引持有各自的字典引用，重建不影响它们"""
+    return PidDictionary()
+
+# ==================== 性能埋点 ====================
+class PipelineTimer:
+    """记录每个流水线阶段与缓存函数的耗时、缓存命中、处理行数与内存峰值
+
+    每次脚本重跑都会重新创建实例，因此records只包含本次运行的记录。
+    track_memory为True时最外层阶段用tracemalloc统计内存峰值（有额外开销，默认关闭）。
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name, rows=None, cache=None):
+        """计时上下文；可在with块内修改返回记录的rows/cache字段"""
+        depth = getattr(self._local, 'depth', 0)
+        record = {
+            'stage': name,
+            'depth': depth,
+            'rows': rows,
+            'cache': cache,
+            'thread': threading.current_thread().name,
+            'elapsed_ms': None,
+            'peak_mb': None
+        }
+        trace_memory = self.track_memory and depth == 0 and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['elapsed_ms'] = (time.perf_counter() - start) * 1000
+            self._local.depth = depth
+            if trace_memory:
+                record['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+            with self._lock:
+                self.records.append(record)
+
+    def bind(self, func):
+        """把当前线程的嵌套深度带给提交到线程池的函数：工作线程中记录的阶段以提交处的深度为起点，
+        这样它们会作为外层阶段的子阶段出现，而不是在深度0重复计入"""
+        parent_depth = getattr(self._local, 'depth', 0)
+
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            saved_depth = getattr(self._local, 'depth', 0)
+            self._local.depth = parent_depth
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.depth = saved_depth
+        return run
+
+    def to_dataframe(self):
+        """按记录顺序返回原始计时表"""
+        with self._lock:
+            records = list(self.records)
+        return pd.DataFrame(records, columns=['stage', 'depth', 'rows', 'cache', 'thread', 'elapsed_ms', 'peak_mb'])
+
+pipeline_timer = PipelineTimer()
+
+# ==================== 缓存命名空间 ====================
+CACHE_NAMESPACES = {
+    'ingestion': "上传文件读取与整合",
+    'mapping': "渠道映射解析",
+    'arpu-store': "默认ARPU数据及其派生结果",
+    'fits': "LT拟合结果"
+}
+
+class CacheRegistry:
+    """按命名空间管理缓存：每个命名空间有独立的版本号、清理函数与命中统计
+
+    缓存函数把所属命名空间的版本号作为缓存键的一部分，invalidate只递增该命名空间的版本并清理其中的函数，
+    其他命名空间（以及其他用户的缓存）不受影响。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {namespace: 0 for namespace in CACHE_NAMESPACES}
+        self._clearers = {namespace: {} for namespace in CACHE_NAMESPACES}
+        self._stats_providers = {namespace: {} for namespace in CACHE_NAMESPACES}
+        self._counters = {namespace: {'hits': 0, 'misses': 0, 'writes': 0} for namespace in CACHE_NAMESPACES}
+
+    def version(self, namespace):
+        with self._lock:
+            return self._versions[namespace]
+
+    def register(self, namespace, name, clear, stats=None):
+        """登记命名空间内的一个缓存；stats为可选的统计函数（返回含hits/misses的字典，misses在清理时归零），
+        用于自带计数的缓存"""
+        with self._lock:
+            self._clearers[namespace][name] = clear
+            if stats is not None:
+                self._stats_providers[namespace][name] = stats
+
+    def record(self, namespace, hit):
+        """记录一次命中或未命中；未命中会写入一个新条目，计入自上次失效以来的写入次数"""
+        with self._lock:
+            counters = self._counters[namespace]
+            counters['hits' if hit else 'misses'] += 1
+            if not hit:
+                counters['writes'] += 1
+
+    def invalidate(self, namespace):
+        """使命名空间内的全部缓存失效，返回新的版本号"""
+        with self._lock:
+            self._versions[namespace] += 1
+            self._counters[namespace]['writes'] = 0
+            clearers = list(self._clearers[namespace].values())
+            version = self._versions[namespace]
+        for clear in clearers:
+            clear()
+        return version
+
+    def stats(self):
+        """各命名空间的版本、写入次数与命中率
+
+        writes是本进程自上次失效以来的写入（未命中）次数，不是当前条目数：st.cache_data按自身策略淘汰的条目不会扣除，
+        其他进程的缓存也不计入。
+        """
+        rows = []
+        with self._lock:
+            snapshot = {namespace: (self._versions[namespace], dict(self._counters[namespace]),
+                                    list(self._stats_providers[namespace].values()))
+                        for namespace in CACHE_NAMESPACES}
+        for namespace, (version, counters, providers) in snapshot.items():
+            for provider in providers:
+                provided = provider()
+                counters['hits'] += provided['hits']
+                counters['misses'] += provided['misses']
+                # 自带计数的缓存在清理（失效）时归零，其未命中次数即自上次失效以来的写入次数
+                counters['writes'] += provided['misses']
+            total = counters['hits'] + counters['misses']
+            rows.append({
+                'namespace': namespace,
+                'description': CACHE_NAMESPACES[namespace],
+                'version': version,
+                'writes': counters['writes'],
+                'hits': counters['hits'],
+                'misses': counters['misses'],
+                'hit_rate': counters['hits'] / total if total > 0 else 0.0
+            })
+        return pd.DataFrame(rows)
+
+@st.cache_resource
+def get_cache_registry():
+    """进程级共享的缓存命名空间登记表"""
+    return CacheRegistry()
+
+cache_registry = get_cache_registry()
+cache_registry.register('arpu-store', "管理员pid字典", get_pid_dictionary.clear)
+
+def instrumented_cache_data(stage_name, namespace):
+    """st.cache_data的埋点版本：记录每次调用的耗时以及缓存命中/未命中，并登记到缓存命名空间
+
+    被装饰函数只在未命中时真正执行，借此用线程局部标记区分命中与未命中；
+    命名空间的版本号以关键字参数cache_version参与缓存键，invalidate后旧条目不会再被命中。
+    返回的包装函数保留.clear()与__wrapped__（指向原函数，基准测试可借此绕过缓存）。
+    """
+    def decorator(func):
+        state = threading.local()
+
+        @functools.wraps(func)
+        def compute(*args, cache_version, **kwargs):
+            state.hit = False
+            return func(*args, **kwargs)
+
+        cached = st.cache_data(compute)
+        cache_registry.register(namespace, stage_name, cached.clear)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            state.hit = True
+            with pipeline_timer.stage(stage_name) as record:
+                result = cached(*args, cache_version=cache_registry.version(namespace), **kwargs)
+                record['cache'] = 'hit' if state.hit else 'miss'
+                if isinstance(result, pd.DataFrame):
+                    record['rows'] = len(result)
+            cache_registry.record(namespace, state.hit)
+            return result
+
+        wrapper.clear = cached.clear
+        return wrapper
+    return decorator
+
 # ==================== 永久数据存储管理 ====================
-ADMIN_DATA_FILE = "admin_default_arpu_data.csv"
+ADMIN_DATA_FILE = "admin_default_arpu_data.csv"  # 旧版单文件存储，首次读取时自动迁移
+ADMIN_DATA_STORE_DIR = "admin_arpu_store"
+FIT_PARAMS_FILE = "lt_fit_params_store.csv"  # 各渠道各月份的LT拟合参数（热启动用），与管理员数据放在同一目录
+ADMIN_STORE_MANIFEST = "manifest.json"
+ADMIN_STORE_PARTS = "parts"
+
+def normalize_month_label(value):
+    """月份标准化为YYYY-MM，与ARPU页面的月份_std口径一致"""
+    value = str(value)
+    return value[:7] if len(value) >= 7 else value
+
+def _file_identity(path):
+    """文件身份 (inode, 修改时间ns, 大小)，不存在时为None；文件被原子替换或改写后身份随之变化"""
+    try:
+        return _stat_identity(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+def _stat_identity(stat_result):
+    return (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+def _atomic_write(path, write):
+    """先写入同目录下的临时文件并落盘，再os.replace到目标路径；读取方只会看到旧文件或完整的新文件
+
+    write接收以二进制模式打开的临时文件对象。目标文件已存在时沿用其权限，否则与普通open创建的文件一致（0o666按umask屏蔽），
+    不会因临时文件而变成仅属主可读的0600。
+    """
+    tmp_path = os.path.join(os.path.dirname(path) or '.', f".tmp-{os.urandom(8).hex()}")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _admin_csv_source():
+    """旧版CSV当前的文件身份（写入清单用，JSON中为列表），不存在时为None"""
+    csv_identity = _file_identity(ADMIN_DATA_FILE)
+    return list(csv_identity) if csv_identity is not None else None
+
+def read_admin_store_snapshot(store_dir=ADMIN_DATA_STORE_DIR):
+    """读取列式存储的清单及清单文件的身份，不存在或损坏时返回 (None, None)
+
+    身份取自实际读取的那个文件（fstat），清单在读取期间被替换也不会把新身份配上旧内容。
+    """
+    try:
+        with open(os.path.join(store_dir, ADMIN_STORE_MANIFEST), 'rb') as f:
+            identity = _stat_identity(os.fstat(f.fileno()))
+            return json.loads(f.read().decode('utf-8')), identity
+    except (OSError, ValueError):
+        return None, None
+
+def read_admin_store_manifest(store_dir=ADMIN_DATA_STORE_DIR):
+    """读取列式存储的清单，不存在或损坏时返回None"""
+    return read_admin_store_snapshot(store_dir)[0]
+
+def _store_column_arrays(df, kinds=None):
+    """把DataFrame各列转为存储数组；kinds可按列名强制类型（增量写入时与已有存储保持一致）
+
+    数值列保留原类型，日期列存为datetime64，其余列存为定长字符串（空值存为空串，读取时还原为NaN，与CSV口径一致）。
+    返回 (列信息列表, {列名: 数组})
+    """
+    columns = []
+    arrays = {}
+    for column in df.columns:
+        series = df[column]
+        kind = (kinds or {}).get(str(column))
+        if kind is None:
+            if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+                kind = 'numeric'
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                kind = 'datetime'
+            else:
+                kind = 'string'
+        if kind == 'numeric':
+            values = pd.to_numeric(series, errors='coerce').to_numpy()
+        elif kind == 'datetime':
+            values = pd.to_datetime(series, errors='coerce').to_numpy(dtype='datetime64[ns]')
+        else:
+            values = series.fillna('').astype(str).to_numpy(dtype=str)
+        arrays[str(column)] = values
+        columns.append({'name': str(column), 'kind': kind, 'dtype': values.dtype.str})
+    return columns, arrays
+
+def _store_month_labels(df):
+    """分区用的月份标签（无月份列时全部为空串）"""
+    if '月份' not in df.columns:
+        return np.full(len(df), '', dtype=object)
+    return df['月份'].astype(str).map(normalize_month_label).to_numpy()
+
+def _write_store_partition(store_dir, partition_path, column_values):
+    os.makedirs(os.path.join(store_dir, partition_path), exist_ok=True)
+    for index, values in enumerate(column_values):
+        np.save(os.path.join(store_dir, partition_path, f"c{index}.npy"), values)
+
+def _load_store_partition(store_dir, partition, n_columns):
+    """以内存映射方式打开一个分区的全部列"""
+    return [np.load(os.path.join(store_dir, partition['path'], f"c{index}.npy"), mmap_mode='r')
+            for index in range(n_columns)]
+
+def _partition_pids(pid_values):
+    """分区内出现的pid（空值不计），用于在清单中统计渠道号数量"""
+    pids = pd.Series(pid_values, dtype=object)
+    return sorted(str(pid) for pid in pids[pids.notna() & (pids != '')].unique())
+
+def _commit_store_manifest(store_dir, manifest):
+    """原子替换清单，随后删除不再被引用的分区目录与索引文件
+
+    上一版清单引用的文件保留到下一次提交：其他进程可能刚读到旧清单、尚未打开对应分区。
+    """
+    previous = read_admin_store_manifest(store_dir)
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+    _atomic_write(os.path.join(store_dir, ADMIN_STORE_MANIFEST), lambda f: f.write(manifest_bytes))
+
+    retained = [manifest] + ([previous] if previous is not None else [])
+    referenced = {os.path.normpath(partition['path']) for kept in retained for partition in kept['partitions']}
+    referenced_roots = {path.split(os.sep)[0] for path in referenced}
+    referenced_indexes = {kept.get('index') for kept in retained}
+    parts_dir = os.path.join(store_dir, ADMIN_STORE_PARTS)
+    for entry in os.listdir(parts_dir) if os.path.isdir(parts_dir) else []:
+        if os.path.normpath(os.path.join(ADMIN_STORE_PARTS, entry)) not in referenced:
+            shutil.rmtree(os.path.join(parts_dir, entry), ignore_errors=True)
+    for entry in os.listdir(store_dir):
+        entry_path = os.path.join(store_dir, entry)
+        if entry.startswith('index-') and entry not in referenced_indexes:
+            os.remove(entry_path)
+        elif entry.startswith('g') and os.path.isdir(entry_path) and entry not in referenced_roots:
+            # 早期版本按整代目录存放分区
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+def write_admin_arpu_store(df, store_dir=ADMIN_DATA_STORE_DIR):
+    """把ARPU数据按月份分区写成列式存储：每个分区每列一个.npy文件，清单记录列类型与分区信息
+
+    分区与ARPU前缀索引都写入带版本号的新文件，清单最后原子替换，读取方不会看到写了一半的数据。
+    清单同时记录写入时旧版CSV的文件身份，用于判断CSV之后是否被外部改写。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    columns, arrays = _store_column_arrays(df)
+    month_codes, months = pd.factorize(_store_month_labels(df), sort=True)
+
+    generation = f"g{time.time_ns()}"
+    partitions = []
+    order = np.argsort(month_codes, kind='stable')
+    bounds = np.searchsorted(month_codes[order], np.arange(len(months) + 1))
+    for code, month in enumerate(months):
+        rows = order[bounds[code]:bounds[code + 1]]
+        partition_path = os.path.join(ADMIN_STORE_PARTS, f"{generation}-{code:05d}")
+        _write_store_partition(store_dir, partition_path, [arrays[column['name']][rows] for column in columns])
+        partitions.append({'month': str(month), 'path': partition_path, 'rows': int(len(rows)),
+                           'pids': _partition_pids(arrays['pid'][rows]) if 'pid' in arrays else []})
+
+    # 预先计算ARPU前缀索引，任意月份区间的ARPU无需再读取逐行数据
+    index_file = f"index-{generation}.npz"
+    ArpuPrefixIndex.from_frame(df).save(os.path.join(store_dir, index_file))
+
+    manifest = {
+        'format': 2,
+        'generation': generation,
+        'columns': columns,
+        'partitions': partitions,
+        'index': index_file,
+        'total_rows': int(len(df)),
+        'pid_count': int(df['pid'].nunique()) if 'pid' in df.columns else 0,
+        'source': _admin_csv_source()
+    }
+    _commit_store_manifest(store_dir, manifest)
+    return manifest
+
+def upsert_admin_arpu_store(new_df, store_dir=ADMIN_DATA_STORE_DIR):
+    """按 (月份, pid) 组增量更新列式存储：新数据中出现的每个组整体替换旧数据，其余行保持不变
+
+    只重写新数据涉及的月份分区，ARPU前缀索引也只替换对应的 (月份, pid) 单元，
+    成本与新数据及受影响月份的行数成正比。存储不存在时等同于全量写入。
+    返回 (清单, 重写的月份列表)
+    """
+    manifest = read_admin_store_manifest(store_dir)
+    if manifest is None:
+        manifest = write_admin_arpu_store(new_df, store_dir)
+        return manifest, [partition['month'] for partition in manifest['partitions']]
+
+    columns = manifest['columns']
+    new_df = new_df.copy()
+    if 'pid' in new_df.columns:
+        new_df['pid'] = PidDictionary.canonical(new_df['pid'])
+    if '月份' in new_df.columns:
+        new_df['月份'] = new_df['月份'].astype(str)
+    # 按已有存储的列对齐：缺少的列补空值，多出的列忽略
+    conformed = pd.DataFrame({
+        column['name']: new_df[column['name']] if column['name'] in new_df.columns else pd.Series(np.nan, index=new_df.index)
+        for column in columns
+    })
+    _, arrays = _store_column_arrays(conformed, kinds={column['name']: column['kind'] for column in columns})
+    month_labels = _store_month_labels(conformed)
+    pid_position = next((index for index, column in enumerate(columns) if column['name'] == 'pid'), None)
+
+    generation = f"g{time.time_ns()}"
+    partitions = {partition['month']: partition for partition in manifest['partitions']}
+    affected_months = sorted(set(month_labels))
+    for code, month in enumerate(affected_months):
+        rows = np.flatnonzero(month_labels == month)
+        new_values = [arrays[column['name']][rows] for column in columns]
+        if month in partitions:
+            old_values = _load_store_partition(store_dir, partitions[month], len(columns))
+            keep = np.ones(partitions[month]['rows'], dtype=bool)
+            if pid_position is not None:
+                keep = ~np.isin(old_values[pid_position], np.unique(new_values[pid_position]))
+            new_values = [np.concatenate([old[keep], values]) for old, values in zip(old_values, new_values)]
+        partition_path = os.path.join(ADMIN_STORE_PARTS, f"{generation}-{code:05d}")
+        _write_store_partition(store_dir, partition_path, new_values)
+        partitions[month] = {'month': month, 'path': partition_path, 'rows': int(len(new_values[0])),
+                             'pids': _partition_pids(new_values[pid_position]) if pid_position is not None else []}
+        for column, values in zip(columns, new_values):
+            column['dtype'] = np.result_type(np.dtype(column['dtype']), values.dtype).str
+
+    index = load_store_arpu_index(store_dir, manifest).upsert_frame(conformed)
+    index_file = f"index-{generation}.npz"
+    index.save(os.path.join(store_dir, index_file))
+
+    ordered = [partitions[month] for month in sorted(partitions)]
+    for partition in ordered:
+        if 'pids' not in partition and pid_position is not None:
+            partition['pids'] = _partition_pids(_load_store_partition(store_dir, partition, len(columns))[pid_position])
+    manifest = {
+        'format': 2,
+        'generation': generation,
+        'columns': columns,
+        'partitions': ordered,
+        'index': index_file,
+        'total_rows': int(sum(partition['rows'] for partition in ordered)),
+        'pid_count': len(set().union(*[partition.get('pids', []) for partition in ordered])),
+        'source': _admin_csv_source()
+    }
+    _commit_store_manifest(store_dir, manifest)
+    return manifest, affected_months
+
+def read_admin_arpu_store(start_month=None, end_month=None, store_dir=ADMIN_DATA_STORE_DIR, manifest=None):
+    """按月份区间读取列式存储：只打开区间内的分区，并以内存映射方式加载各列
 
-@st.cache_data
-def load_admin_data_from_file():
-    """从本地文件加载管理员上传的ARPU数据"""
+    start_month/end_month为YYYY-MM（含端点），None表示不限；manifest为已读取的清单（不传时现读）。
+    存储不存在时返回None。
+    """
+    if manifest is None:
+        manifest = read_admin_store_manifest(store_dir)
+    if manifest is None:
+        return None
+
+    selected = [
+        partition for partition in manifest['partitions']
+        if (start_month is None or partition['month'] >= normalize_month_label(start_month))
+        and (end_month is None or partition['month'] <= normalize_month_label(end_month))
+    ]
+    loaded = [_load_store_partition(store_dir, partition, len(manifest['columns'])) for partition in selected]
+
+    data = {}
+    for index, column in enumerate(manifest['columns']):
+        parts = [partition_values[index] for partition_values in loaded]
+        values = np.concatenate(parts) if parts else np.empty(0, dtype=np.dtype(column['dtype']))
+        if column['kind'] == 'string':
+            series = pd.Series(values.astype(object), dtype=object)
+            empty = values == ''
+            if empty.any():
+                series[empty] = np.nan
+            data[column['name']] = series
+        else:
+            data[column['name']] = values
+    return pd.DataFrame(data, columns=[column['name'] for column in manifest['columns']])
+
+def load_store_arpu_index(store_dir, manifest):
+    """读取存储对应的ARPU前缀索引（使用管理员共享的pid字典）；早于索引功能写入的存储从全量数据补建"""
+    index_file = manifest.get('index')
+    if index_file and os.path.exists(os.path.join(store_dir, index_file)):
+        return ArpuPrefixIndex.load(os.path.join(store_dir, index_file), pid_dictionary=get_pid_dictionary())
+    return ArpuPrefixIndex.from_frame(read_admin_arpu_store(store_dir=store_dir), pid_dictionary=get_pid_dictionary())
+
+def migrate_admin_csv_to_store():
+    """旧版CSV存在且列式存储不存在、或CSV比存储更新（被外部任务刷新）时，把CSV迁移为列式存储"""
+    csv_identity = _file_identity(ADMIN_DATA_FILE)
+    if csv_identity is None:
+        return
+    manifest, store_identity = read_admin_store_snapshot()
+    if manifest is None:
+        stale = True
+    elif 'source' in manifest:
+        # 清单记录了写入时CSV的身份，CSV之后被改写才需要重新迁移
+        stale = manifest['source'] != list(csv_identity)
+    else:
+        stale = csv_identity[1] > store_identity[1]
+    if stale:
+        legacy_df = pd.read_csv(ADMIN_DATA_FILE)
+        if 'pid' in legacy_df.columns:
+            legacy_df['pid'] = PidDictionary.canonical(legacy_df['pid'])
+        if '月份' in legacy_df.columns:
+            legacy_df['月份'] = legacy_df['月份'].astype(str)
+        write_admin_arpu_store(legacy_df)
+
+@instrumented_cache_data("管理员ARPU数据读取", 'arpu-store')
+def read_admin_arpu_store_cached(start_month, end_month, store_identity, _manifest):
+    """read_admin_arpu_store的缓存版本；以清单文件身份为缓存键（_manifest不参与哈希），
+    任何进程替换存储后，各进程下次访问即读到新数据"""
+    return read_admin_arpu_store(start_month, end_month, manifest=_manifest)
+
+def load_admin_data_from_file(start_month=None, end_month=None):
+    """从本地列式存储加载管理员上传的ARPU数据，指定月份区间时只读取对应分区"""
     try:
-        if os.path.exists(ADMIN_DATA_FILE):
-            df = pd.read_csv(ADMIN_DATA_FILE)
-            return df
+        migrate_admin_csv_to_store()
+        manifest, identity = read_admin_store_snapshot()
+        if manifest is not None:
+            return read_admin_arpu_store_cached(start_month, end_month, identity, manifest)
     except Exception as e:
         st.error(f"加载管理员数据文件失败：{str(e)}")
     return None
 
 def save_admin_data_to_file(df):
-    """保存管理员上传的ARPU数据到本地文件"""
+    """保存管理员上传的ARPU数据到本地列式存储"""
     try:
-        df.to_csv(ADMIN_DATA_FILE, index=False, encoding='utf-8-sig')
+        write_admin_arpu_store(df)
         return True
     except Exception as e:
         st.error(f"保存管理员数据文件失败：{str(e)}")
         return False
 
-@st.cache_data
-def get_builtin_arpu_data():
-    """获取内置的ARPU基础数据 - 优先使用管理员上传的数据"""
-    # 尝试从文件读取管理员数据
-    admin_data = load_admin_data_from_file()
+def clear_admin_data_store():
+    """删除管理员数据（列式存储与旧版CSV）；存储目录先整体改名再删除，读取方不会看到删了一半的存储"""
+    if os.path.isdir(ADMIN_DATA_STORE_DIR):
+        removed_dir = f"{ADMIN_DATA_STORE_DIR}.removed-{time.time_ns()}"
+        os.replace(ADMIN_DATA_STORE_DIR, removed_dir)
+        shutil.rmtree(removed_dir, ignore_errors=True)
+    if os.path.exists(ADMIN_DATA_FILE):
+        os.remove(ADMIN_DATA_FILE)
+
+def get_builtin_arpu_data(start_month=None, end_month=None):
+    """获取内置的ARPU基础数据 - 优先使用管理员上传的数据，可按月份区间读取"""
+    # 尝试从存储读取管理员数据（缓存返回的本身就是副本，无需再复制）
+    admin_data = load_admin_data_from_file(start_month, end_month)
     if admin_data is not None:
-        return admin_data.copy()
+        return admin_data
     
     # 如果没有管理员数据，返回示例数据
-    return get_sample_arpu_data()
-
-@st.cache_data
+    sample_data = get_sample_arpu_data()
+    if start_month is None and end_month is None:
+        return sample_data
+    month_labels = sample_data['月份'].astype(str).map(normalize_month_label)
+    in_window = pd.Series(True, index=sample_data.index)
+    if start_month is not None:
+        in_window &= month_labels >= normalize_month_label(start_month)
+    if end_month is not None:
+        in_window &= month_labels <= normalize_month_label(end_month)
+    return sample_data[in_window].reset_index(drop=True)
+
+@instrumented_cache_data("示例ARPU数据", 'arpu-store')
 def get_sample_arpu_data():
     """生成示例ARPU数据（当没有管理员上传数据时使用）"""
     # 生成2024年1月到2025年4月的所有月份
@@ -459,38 +1109,40 @@ def load_admin_default_arpu_data():
     </div>
     """, unsafe_allow_html=True)
     
-    # 显示当前默认数据状态
-    current_data = load_admin_data_from_file()
-    if current_data is not None:
+    # 显示当前默认数据状态（统计信息直接取自存储清单，不读取全部数据）
+    migrate_admin_csv_to_store()
+    store_manifest = read_admin_store_manifest()
+    if store_manifest is not None:
         st.success("已加载管理员上传的默认数据")
         
+        months = [partition['month'] for partition in store_manifest['partitions']]
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("总记录数", f"{len(current_data):,}")
+            st.metric("总记录数", f"{store_manifest['total_rows']:,}")
         with col2:
-            st.metric("渠道数量", current_data['pid'].nunique())
+            st.metric("渠道数量", store_manifest['pid_count'])
         with col3:
-            st.metric("月份数量", current_data['月份'].nunique())
+            st.metric("月份数量", len(months))
         with col4:
             # 计算数据时间范围
-            months = sorted(current_data['月份'].unique())
             if months:
                 time_range = f"{months[0]} 至 {months[-1]}"
                 st.metric("时间范围", time_range)
         
-        # 显示数据预览
+        # 显示数据预览（只读取最早一个月份分区）
         with st.expander("查看当前默认数据预览", expanded=False):
-            preview_data = optimize_dataframe_for_preview(current_data, max_rows=10)
-            st.dataframe(preview_data, use_container_width=True)
+            preview_source = load_admin_data_from_file(months[0], months[0]) if months else None
+            if preview_source is not None:
+                preview_data = optimize_dataframe_for_preview(preview_source, max_rows=10)
+                st.dataframe(preview_data, use_container_width=True)
             
         # 提供清除选项
         if st.button("清除管理员数据（恢复示例数据）", help="清除后将使用系统示例数据"):
-            # 删除本地文件
+            # 删除本地存储
             try:
-                if os.path.exists(ADMIN_DATA_FILE):
-                    os.remove(ADMIN_DATA_FILE)
-                # 清除缓存
-                st.cache_data.clear()
+                clear_admin_data_store()
+                # 只清除依赖默认ARPU数据的缓存
+                cache_registry.invalidate('arpu-store')
             except:
                 pass
             st.success("已清除管理员数据，恢复为系统示例数据")
@@ -527,7 +1179,7 @@ def load_admin_default_arpu_data():
                     return None
                 
                 # 数据清理和格式化
-                uploaded_df['pid'] = uploaded_df['pid'].astype(str).str.replace('.0', '', regex=False)
+                uploaded_df['pid'] = PidDictionary.canonical(uploaded_df['pid'])
                 uploaded_df['月份'] = uploaded_df['月份'].astype(str)
                 
                 # 基本数据验证
@@ -592,14 +1244,14 @@ def load_admin_default_arpu_data():
                 
                 # 确认上传按钮
                 st.markdown("---")
-                col1, col2 = st.columns([1, 1])
+                col1, col2, col3 = st.columns([1, 1, 1])
                 
                 with col1:
                     if st.button("确认设置为默认数据", type="primary", use_container_width=True):
                         # 永久保存到本地文件
                         if save_admin_data_to_file(uploaded_df):
-                            # 清除缓存
-                            st.cache_data.clear()
+                            # 只清除依赖默认ARPU数据的缓存
+                            cache_registry.invalidate('arpu-store')
                             st.success("默认ARPU数据已永久保存！")
                             st.info("该数据现在将作为系统默认数据使用，所有用户都可以访问，且服务重启后仍然有效")
                         else:
@@ -607,6 +1259,16 @@ def load_admin_default_arpu_data():
                         st.rerun()
                 
                 with col2:
+                    if st.button("增量更新默认数据", use_container_width=True,
+                                 help="按 (月份, pid) 覆盖已有数据中的对应记录，只重写涉及的月份分区"):
+                        try:
+                            _, updated_months = upsert_admin_arpu_store(uploaded_df)
+                            cache_registry.invalidate('arpu-store')
+                            st.success(f"已增量更新 {len(updated_months)} 个月份：{', '.join(updated_months)}")
+                        except Exception as e:
+                            st.error(f"增量更新失败：{str(e)}")
+                
+                with col3:
                     # 提供下载清理后数据的选项
                     cleaned_csv = uploaded_df.to_csv(index=False, encoding='utf-8-sig')
                     st.download_button(
@@ -744,7 +1406,7 @@ def get_file_channel_suggestions(uploaded_files, channel_mapping):
     
     return suggestions
 
-@st.cache_data
+@instrumented_cache_data("渠道映射解析", 'mapping')
 def parse_channel_mapping_from_excel(channel_file_content):
     """从上传的Excel文件解析渠道映射"""
     try:
@@ -946,7 +1608,7 @@ def merge_ocpx_data(retention_data, new_users_data, target_month):
         return None
 
 # ==================== 文件整合核心函数 - 支持OCPX新格式 - 优化版本 ====================
-@st.cache_data
+@instrumented_cache_data("文件整合（缓存）", 'ingestion')
 def integrate_excel_files_cached_with_mapping(file_names, file_contents, target_month, channel_mapping, confirmed_mappings):
     """缓存版本的文件整合函数 - 支持OCPX新格式和智能映射 - 优化版本"""
     all_data = pd.DataFrame()
@@ -1184,6 +1846,28 @@ def integrate_excel_files_streamlit(uploaded_files, target_month=None, channel_m
         # 兼容旧版本返回值
         return result[0], result[1], result[2], 0, 0
 
+def integrate_excel_files_for_months(uploaded_files, months, channel_mapping=None, confirmed_mappings=None):
+    """按多个月份整合同一批上传文件，文件内容只读取一次，每个月份的解析结果由st.cache_data缓存复用
+
+    返回:
+        {月份: 整合后的DataFrame}，无数据的月份不包含在内
+    """
+    if channel_mapping is None:
+        channel_mapping = DEFAULT_CHANNEL_MAPPING
+    if confirmed_mappings is None:
+        confirmed_mappings = {}
+    file_names = [f.name for f in uploaded_files]
+    file_contents = [f.getvalue() for f in uploaded_files]
+
+    month_data = {}
+    for month in months:
+        merged_data = integrate_excel_files_cached_with_mapping(
+            file_names, file_contents, month, channel_mapping, confirmed_mappings
+        )[0]
+        if merged_data is not None and not merged_data.empty:
+            month_data[month] = merged_data
+    return month_data
+
 # ==================== 留存率计算函数 - 确保使用数字列名 ====================
 def calculate_retention_rates_new_method(df):
     """OCPX格式留存率计算：各天留存列（1、2、3...）平均值÷回传新增数平均值"""
@@ -1256,20 +1940,257 @@ def exponential_function(x, c, d):
     """指数函数：y = c * exp(d * x)"""
     return c * np.exp(d * x)
 
-# 计算指定天数的累积LT值
-def calculate_cumulative_lt(days_array, rates_array, target_days):
-    """计算指定天数的累积LT值"""
-    result = {}
-    for day in target_days:
-        idx = np.searchsorted(days_array, day, side='right')
-        if idx > 0:
-            # 计算到指定天数的累积LT值（包括第0天的1.0）
-            cumulative_lt = 1.0 + np.sum(rates_array[:idx])
-            result[day] = cumulative_lt
-    return result
+# 解析雅可比：最后一维为参数，既可用于curve_fit（返回 (点数, 参数数)），也可用于批量求解器
+def power_jacobian(x, a, b):
+    """幂函数雅可比：∂y/∂a = x^b，∂y/∂b = a * x^b * ln(x)"""
+    x_pow = np.power(x, b)
+    return np.stack(np.broadcast_arrays(x_pow, a * x_pow * np.log(x)), axis=-1)
+
+def exponential_jacobian(x, c, d):
+    """指数函数雅可比：∂y/∂c = exp(d*x)，∂y/∂d = c * x * exp(d*x)"""
+    exp_dx = np.exp(d * x)
+    return np.stack(np.broadcast_arrays(exp_dx, c * x * exp_dx), axis=-1)
+
+# 求解器配置：tol 同时作用于 ftol/xtol/gtol，max_nfev 为函数评估次数上限；None 表示使用scipy默认值
+SOLVER_PROFILES = {
+    "default": {"tol": None, "max_nfev": None},
+    "fast": {"tol": 1e-6, "max_nfev": 200},
+    "accurate": {"tol": 1e-12, "max_nfev": 5000}
+}
+
+def solver_kwargs(profile, bounded):
+    """把求解器配置转换为curve_fit参数（无约束用leastsq的maxfev，有约束用least_squares的max_nfev）"""
+    settings = SOLVER_PROFILES[profile]
+    kwargs = {}
+    if settings["tol"] is not None:
+        kwargs.update(ftol=settings["tol"], xtol=settings["tol"], gtol=settings["tol"])
+    if settings["max_nfev"] is not None:
+        kwargs["max_nfev" if bounded else "maxfev"] = settings["max_nfev"]
+    return kwargs
+
+# 渠道规则
+CHANNEL_RULES = {
+    "华为": {"stage_2": [30, 120], "stage_3_base": [120, 220]},
+    "小米": {"stage_2": [30, 190], "stage_3_base": [190, 290]},
+    "oppo": {"stage_2": [30, 160], "stage_3_base": [160, 260]},
+    "vivo": {"stage_2": [30, 150], "stage_3_base": [150, 250]},
+    "iphone": {"stage_2": [30, 150], "stage_3_base": [150, 250], "stage_2_func": "log"},
+    "其他": {"stage_2": [30, 100], "stage_3_base": [100, 200]}
+}
+
+# 模型版本号：拟合逻辑变化时递增，使旧的缓存结果失效
+LT_MODEL_VERSION = "three-stage-v6"
+
+def resolve_channel_rule(channel_name):
+    """根据渠道名称确定渠道规则，返回 (规则名称, 规则字典)"""
+    if re.search(r'\d+月华为$', channel_name) or '华为' in channel_name:
+        rule_name = "华为"
+    elif re.search(r'\d+月小米$', channel_name) or '小米' in channel_name:
+        rule_name = "小米"
+    elif re.search(r'\d+月oppo$', channel_name) or re.search(r'\d+月OPPO$', channel_name) or 'oppo' in channel_name.lower():
+        rule_name = "oppo"
+    elif re.search(r'\d+月vivo$', channel_name) or 'vivo' in channel_name:
+        rule_name = "vivo"
+    elif re.search(r'\d+月[iI][pP]hone$', channel_name) or 'iphone' in channel_name.lower():
+        rule_name = "iphone"
+    else:
+        rule_name = "其他"
+    return rule_name, CHANNEL_RULES[rule_name]
+
+def exponential_sum(c, d, start_day, end_day):
+    """指数函数在 [start_day, end_day] 整数天上的累加值（等比数列求和，无需生成逐日数组，支持数组参数）"""
+    c = np.asarray(c, dtype=float)
+    d = np.asarray(d, dtype=float)
+    n_days = np.maximum(np.asarray(end_day) - np.asarray(start_day) + 1, 0)
+    safe_d = np.where(d == 0, 1.0, d)
+    geometric = c * np.exp(d * start_day) * np.expm1(safe_d * n_days) / np.expm1(safe_d)
+    total = np.where(d == 0, c * n_days, geometric)
+    return float(total) if total.ndim == 0 else total
+
+# ==================== 惰性拟合曲线 ====================
+class LTCurve:
+    """三阶段拟合曲线的惰性表示：只保存拟合参数与阶段划分，按需计算任意天数区间的留存率
+
+    累积LT沿用三阶段求和口径：第30天同时计入第一、二阶段，第二阶段终点同时计入第二、三阶段。
+    """
+
+    def __init__(self, stage_1_params, exp_params, stage_2, stage_3_base, max_days, stage_1_success=True,
+                 stage_1_model="power"):
+        self.stage_1_model = stage_1_model
+        self.stage_1_params = tuple(stage_1_params)
+        self.exp_params = tuple(exp_params) if exp_params is not None else None
+        self.stage_2_start, self.stage_2_end = stage_2
+        self.stage_3_start = stage_3_base[0]
+        self.max_days = max_days
+        self.stage_1_success = stage_1_success
+
+    def _stage_1(self, days):
+        return STAGE1_MODELS[self.stage_1_model]["func"](days, *self.stage_1_params)
+
+    def _head(self, days):
+        # 第一阶段拟合失败时，1-30天按0计
+        if not self.stage_1_success:
+            return np.zeros(len(days))
+        return self._stage_1(days)
+
+    def _body(self, days):
+        return self._stage_1(days)
+
+    def _tail(self, days):
+        if self.exp_params is None:
+            return self._stage_1(days)
+        return exponential_function(days, *self.exp_params)
+
+    def rates(self, days):
+        """计算给定天数（可为数组）的拟合留存率"""
+        days = np.asarray(days, dtype=float)
+        result = np.empty(days.shape)
+        head_mask = days <= 30
+        tail_mask = days > self.stage_2_end
+        body_mask = ~head_mask & ~tail_mask
+        result[head_mask] = self._head(days[head_mask])
+        result[body_mask] = self._body(days[body_mask])
+        result[tail_mask] = self._tail(days[tail_mask])
+        return result
+
+    def window(self, start_day=1, end_day=100):
+        """返回 [start_day, end_day] 区间（不超过曲线年限）的逐日天数与留存率，用于绘图"""
+        end_day = min(end_day, self.max_days)
+        days = np.arange(max(start_day, 1), end_day + 1)
+        return days, self.rates(days)
+
+    def cumulative_at(self, target_days):
+        """批量计算累积LT值（包括第0天的1.0）：天数不足整天向下取整，超出年限按年限封顶
+
+        第一、二阶段只在第1天到第二阶段终点上做前缀和，第三阶段指数尾部用等比数列求和，
+        成本与查询天数及第二阶段长度有关，与LT年限无关。
+        """
+        days = np.clip(np.floor(np.asarray(target_days, dtype=float)), 1, self.max_days).astype(int)
+        stage_1_prefix = np.zeros(max(30, self.stage_2_end) + 1)
+        stage_1_prefix[1:] = np.cumsum(self._stage_1(np.arange(1, len(stage_1_prefix), dtype=float)))
+
+        head = stage_1_prefix[np.minimum(days, 30)] if self.stage_1_success else np.zeros(len(days))
+        body = np.where(days >= self.stage_2_start,
+                        stage_1_prefix[np.clip(days, self.stage_2_start - 1, self.stage_2_end)]
+                        - stage_1_prefix[self.stage_2_start - 1], 0.0)
+        in_tail = days >= self.stage_3_start
+        tail = np.zeros(len(days))
+        if in_tail.any():
+            if self.exp_params is not None:
+                tail[in_tail] = exponential_sum(*self.exp_params, self.stage_3_start, days[in_tail])
+            else:
+                # 指数拟合失败时尾部沿用第一阶段模型，只累加到最大查询天数
+                tail_days = np.arange(self.stage_3_start, days.max() + 1, dtype=float)
+                tail_prefix = np.concatenate([[0.0], np.cumsum(self._stage_1(tail_days))])
+                tail[in_tail] = tail_prefix[days[in_tail] - self.stage_3_start + 1]
+        return 1.0 + head + body + tail
+
+    def cumulative(self, target_days):
+        """计算指定天数的累积LT值（包括第0天的1.0），天数小于1的不返回"""
+        target_days = [day for day in target_days if day >= 1]
+        values = self.cumulative_at(target_days) if target_days else []
+        return dict(zip(target_days, values))
+
+def cumulative_lt_matrix(curves, target_days):
+    """渠道 × 天数的累积LT矩阵：各曲线按闭式求和一次算出全部查询天数
+
+    参数:
+        curves: {渠道名称: LTCurve}
+        target_days: 查询天数列表（小于1的天数会被忽略）
+    返回:
+        DataFrame，行为渠道，列为天数
+    """
+    target_days = sorted({int(day) for day in target_days if day >= 1})
+    channels = list(curves.keys())
+    if not channels or not target_days:
+        return pd.DataFrame(index=channels, columns=target_days, dtype=float)
+
+    # 超出各曲线年限的天数按年限封顶
+    values = np.vstack([curves[channel].cumulative_at(target_days) for channel in channels])
+    return pd.DataFrame(values, index=channels, columns=target_days)
+
+# ==================== 拟合追踪 ====================
+class FitTrace:
+    """单渠道单次LT拟合的结构化追踪记录（替代print调试输出）"""
+
+    def __init__(self, channel_name, lt_years):
+        self.channel_name = channel_name
+        self.lt_years = lt_years
+        self.stages = []
+        self.lt_value = None
+        self.success = None
+        self.model_used = None
+
+    def record(self, stage, elapsed, nfev=None, residual=None, r2=None, fallback=None, **extra):
+        """记录一个拟合阶段：耗时(秒)、求解器评估次数、残差平方和、R²、回退原因"""
+        entry = {
+            'stage': stage,
+            'elapsed': float(elapsed),
+            'nfev': int(nfev) if nfev is not None else None,
+            'residual': float(residual) if residual is not None else None,
+            'r2': float(r2) if r2 is not None else None,
+            'fallback': fallback
+        }
+        entry.update(extra)
+        self.stages.append(entry)
+
+    def finish(self, lt_value, success, model_used):
+        self.lt_value = float(lt_value)
+        self.success = success
+        self.model_used = model_used
+
+    @property
+    def total_time(self):
+        return sum(stage['elapsed'] for stage in self.stages)
+
+    @property
+    def total_nfev(self):
+        return sum(stage['nfev'] or 0 for stage in self.stages)
+
+    @property
+    def fallbacks(self):
+        return [f"{stage['stage']}: {stage['fallback']}" for stage in self.stages if stage['fallback']]
+
+    def to_dict(self):
+        return {
+            'channel': self.channel_name,
+            'lt_years': self.lt_years,
+            'lt_value': self.lt_value,
+            'success': self.success,
+            'model_used': self.model_used,
+            'total_time': self.total_time,
+            'total_nfev': self.total_nfev,
+            'stages': self.stages
+        }
+
+def fit_traces_to_jsonl(traces):
+    """将追踪记录导出为JSON Lines文本（每行一次拟合）"""
+    return "\n".join(json.dumps(trace.to_dict(), ensure_ascii=False, default=float) for trace in traces)
+
+def summarize_fit_traces(traces, slow_threshold=0.05, only_problems=True):
+    """汇总追踪记录，默认只保留耗时超过阈值(秒)或发生回退的拟合"""
+    rows = []
+    for trace in traces:
+        is_slow = trace.total_time >= slow_threshold
+        if only_problems and not is_slow and not trace.fallbacks:
+            continue
+        stage_times = {f"{stage['stage']}耗时(ms)": round(stage['elapsed'] * 1000, 2) for stage in trace.stages}
+        row = {
+            '渠道名称': trace.channel_name,
+            '年数': trace.lt_years,
+            'LT': round(trace.lt_value, 4) if trace.lt_value is not None else None,
+            '模型': trace.model_used,
+            '总耗时(ms)': round(trace.total_time * 1000, 2),
+            '求解器评估次数': trace.total_nfev,
+            '回退原因': "; ".join(trace.fallbacks)
+        }
+        row.update(stage_times)
+        rows.append(row)
+    return pd.DataFrame(rows)
 
 # 计算 LT 的核心逻辑 - 修正版本
-def calculate_lt(data, channel_name, lt_years=5, return_curve_data=False, key_days=None):
+def calculate_lt(data, channel_name, lt_years=5, return_curve_data=False, key_days=None, trace=None,
+                 warm_start=None, solver_profile="default", stage1_fit=None):
     """
     按渠道规则计算 LT，允许 1-30 天数据不连续。
     参数:
@@ -1278,32 +2199,18 @@ def calculate_lt(data, channel_name, lt_years=5, return_curve_data=False, key_da
         lt_years: 计算几年的LT，默认5年
         return_curve_data: 是否返回曲线数据用于可视化
         key_days: 关键时间点列表，用于计算这些时间点的累积LT值
+        trace: 可选的FitTrace对象，传入时记录各阶段耗时、评估次数、残差与回退原因
+        warm_start: 可选的热启动参数 {'power': (a, b), 'exponential': (c, d)}，用作求解器初值
+        solver_profile: 求解器配置名称（见SOLVER_PROFILES），决定容差与评估次数上限
+        stage1_fit: 可选的第一阶段模型选择结果 {'model', 'params'}（见select_stage1_models），
+                    非幂函数模型时直接采用其参数完成第一、二阶段及第三阶段基准
     返回:
-        字典格式，包含lt_value, success, fit_params等字段
+        字典格式，包含lt_value, success, fit_params, nfev等字段；
+        fit_params['stage1'] 为第一阶段采用的模型 {'model', 'params'}，fit_params['exponential'] 只表示第三阶段指数拟合，
+        power_r2 只在第一阶段为幂函数时有值（否则为NaN），第一阶段实际模型的R²见stage1_r2
     """
-    # 渠道规则
-    CHANNEL_RULES = {
-        "华为": {"stage_2": [30, 120], "stage_3_base": [120, 220]},
-        "小米": {"stage_2": [30, 190], "stage_3_base": [190, 290]},
-        "oppo": {"stage_2": [30, 160], "stage_3_base": [160, 260]},
-        "vivo": {"stage_2": [30, 150], "stage_3_base": [150, 250]},
-        "iphone": {"stage_2": [30, 150], "stage_3_base": [150, 250], "stage_2_func": "log"},
-        "其他": {"stage_2": [30, 100], "stage_3_base": [100, 200]}
-    }
-
     # 确定渠道规则
-    if re.search(r'\d+月华为$', channel_name) or '华为' in channel_name:
-        rules = CHANNEL_RULES["华为"]
-    elif re.search(r'\d+月小米$', channel_name) or '小米' in channel_name:
-        rules = CHANNEL_RULES["小米"]
-    elif re.search(r'\d+月oppo$', channel_name) or re.search(r'\d+月OPPO$', channel_name) or 'oppo' in channel_name.lower():
-        rules = CHANNEL_RULES["oppo"]
-    elif re.search(r'\d+月vivo$', channel_name) or 'vivo' in channel_name:
-        rules = CHANNEL_RULES["vivo"]
-    elif re.search(r'\d+月[iI][pP]hone$', channel_name) or 'iphone' in channel_name.lower():
-        rules = CHANNEL_RULES["iphone"]
-    else:
-        rules = CHANNEL_RULES["其他"]
+    _, rules = resolve_channel_rule(channel_name)
     
     stage_2_start, stage_2_end = rules["stage_2"]
     stage_3_base_start, stage_3_base_end = rules["stage_3_base"]
@@ -1320,83 +2227,136 @@ def calculate_lt(data, channel_name, lt_years=5, return_curve_data=False, key_da
     fit_success = True
     model_used = "power+exponential"
     power_r2 = 0.0
+    stage1_r2 = 0.0
+    nfev = {"power": None, "exponential": None}
+    warm_start = warm_start or {}
+    stage_1_model = "power"
+    if stage1_fit is not None and stage1_fit.get('model', "power") != "power":
+        stage_1_model = stage1_fit['model']
+        stage_1_params = tuple(stage1_fit['params'])
+        model_used = f"{stage_1_model}+exponential"
 
     # ----- 第一阶段 -----
-    try:
-        # 用已有数据对 1-30 天的留存率进行拟合
-        print(f"[DEBUG] {channel_name} 第一阶段：拟合真实留存率（非连续天数支持）...")
-        popt_power, _ = curve_fit(power_function, days, rates)
-        a, b = popt_power
-        fit_params["power"] = {"a": a, "b": b}
-        print(f"[DEBUG] {channel_name} 第一阶段幂函数拟合参数：a = {a:.6e}, b = {b:.6f}")
-
-        # 计算R²值
-        predicted_rates = power_function(days, a, b)
+    stage_start = time.perf_counter()
+    if stage_1_model != "power":
+        spec = STAGE1_MODELS[stage_1_model]
+        # 第一阶段模型单独存放，避免与第三阶段的指数拟合参数同名覆盖
+        fit_params["stage1"] = {"model": stage_1_model, "params": dict(zip(spec["params"], stage_1_params))}
+        predicted_rates = spec["func"](days, *stage_1_params)
         ss_res = np.sum((rates - predicted_rates) ** 2)
         ss_tot = np.sum((rates - np.mean(rates)) ** 2)
-        power_r2 = 1 - (ss_res / ss_tot) if ss_tot != 0 else 0.0
-        print(f"[DEBUG] {channel_name} 第一阶段R²值：{power_r2:.4f}")
-
-        # 用拟合函数生成完整的 1-30 天留存率
-        days_full = np.arange(1, 31)  # 连续的 1-30 天
-        rates_full = power_function(days_full, a, b)
-
-        # 第一阶段的 LT 累加值
-        lt1_to_30 = np.sum(rates_full)
-        print(f"[DEBUG] {channel_name} 第一阶段（1-30 天实际 + 填充数据）：LT = {lt1_to_30:.4f}")
-    except Exception as e:
-        print(f"[ERROR] {channel_name} 第一阶段拟合失败：{e}")
-        fit_success = False
-        model_used = "failed"
-        lt1_to_30 = 0.0
-        a, b = 1.0, -1.0  # 默认参数
+        power_r2 = np.nan
+        stage1_r2 = 1 - (ss_res / ss_tot) if ss_tot != 0 else 0.0
         days_full = np.arange(1, 31)
-        rates_full = np.zeros(30)
+        rates_full = spec["func"](days_full, *stage_1_params)
+        lt1_to_30 = np.sum(rates_full)
+        if trace is not None:
+            trace.record("stage_1", time.perf_counter() - stage_start, residual=ss_res, r2=stage1_r2,
+                         lt=lt1_to_30, n_points=len(days), model=stage_1_model)
+    else:
+        try:
+            # 用已有数据对 1-30 天的留存率进行拟合（非连续天数支持），有历史参数时以其为初值
+            popt_power, _, power_info, _, _ = curve_fit(power_function, days, rates, p0=warm_start.get("power"),
+                                                         jac=power_jacobian, full_output=True,
+                                                         **solver_kwargs(solver_profile, bounded=False))
+            a, b = popt_power
+            nfev["power"] = int(power_info['nfev'])
+            fit_params["power"] = {"a": a, "b": b}
+            fit_params["stage1"] = {"model": "power", "params": {"a": a, "b": b}}
+
+            # 计算R²值
+            predicted_rates = power_function(days, a, b)
+            ss_res = np.sum((rates - predicted_rates) ** 2)
+            ss_tot = np.sum((rates - np.mean(rates)) ** 2)
+            power_r2 = 1 - (ss_res / ss_tot) if ss_tot != 0 else 0.0
+            stage1_r2 = power_r2
+
+            # 用拟合函数生成完整的 1-30 天留存率
+            days_full = np.arange(1, 31)  # 连续的 1-30 天
+            rates_full = power_function(days_full, a, b)
+
+            # 第一阶段的 LT 累加值
+            lt1_to_30 = np.sum(rates_full)
+            stage_1_params = (a, b)
+            if trace is not None:
+                trace.record("stage_1", time.perf_counter() - stage_start, nfev=nfev["power"],
+                             njev=power_info.get('njev'), residual=ss_res, r2=power_r2, lt=lt1_to_30,
+                             n_points=len(days), warm_start="power" in warm_start)
+        except Exception as e:
+            fit_success = False
+            model_used = "failed"
+            lt1_to_30 = 0.0
+            a, b = 1.0, -1.0  # 默认参数
+            stage_1_params = (a, b)
+            days_full = np.arange(1, 31)
+            rates_full = np.zeros(30)
+            if trace is not None:
+                trace.record("stage_1", time.perf_counter() - stage_start, fallback=f"幂函数拟合失败，使用默认参数：{e}")
+
+    stage_1_func = STAGE1_MODELS[stage_1_model]["func"]
 
     # ----- 第二阶段 -----
+    stage_start = time.perf_counter()
     try:
         days_stage_2 = np.arange(stage_2_start, stage_2_end + 1)
-        rates_stage_2 = power_function(days_stage_2, a, b)
+        rates_stage_2 = stage_1_func(days_stage_2, *stage_1_params)
         lt_stage_2 = np.sum(rates_stage_2)
-        print(f"[DEBUG] {channel_name} 第二阶段（{stage_2_start}-{stage_2_end} 天）：LT = {lt_stage_2:.4f}")
+        if trace is not None:
+            trace.record("stage_2", time.perf_counter() - stage_start, lt=lt_stage_2,
+                         window=[stage_2_start, stage_2_end])
     except Exception as e:
-        print(f"[ERROR] {channel_name} 第二阶段预测失败：{e}")
         lt_stage_2 = 0.0
         days_stage_2 = np.arange(stage_2_start, stage_2_end + 1)
         rates_stage_2 = np.zeros(len(days_stage_2))
+        if trace is not None:
+            trace.record("stage_2", time.perf_counter() - stage_start, fallback=f"第二阶段预测失败，计为0：{e}")
 
     # ----- 第三阶段 -----
+    stage_start = time.perf_counter()
     try:
         days_stage_3_base = np.arange(stage_3_base_start, stage_3_base_end + 1)
-        rates_stage_3_base = power_function(days_stage_3_base, a, b)
+        rates_stage_3_base = stage_1_func(days_stage_3_base, *stage_1_params)
 
-        # 指数拟合
-        initial_c = rates_stage_3_base[0] if len(rates_stage_3_base) > 0 else 0.001
-        initial_d = -0.001
-        popt_exp, _ = curve_fit(
+        # 指数拟合：有历史参数时以其为初值（投影到约束范围内）
+        if warm_start.get("exponential") is not None:
+            initial_c = max(warm_start["exponential"][0], 0.0)
+            initial_d = min(warm_start["exponential"][1], 0.0)
+        else:
+            initial_c = rates_stage_3_base[0] if len(rates_stage_3_base) > 0 else 0.001
+            initial_d = -0.001
+        popt_exp, _, exp_info, _, _ = curve_fit(
             exponential_function,
             days_stage_3_base,
             rates_stage_3_base,
             p0=[initial_c, initial_d],
-            bounds=([0, -np.inf], [np.inf, 0])  # 限制 d < 0
+            bounds=([0, -np.inf], [np.inf, 0]),  # 限制 d < 0
+            jac=exponential_jacobian,
+            full_output=True,
+            **solver_kwargs(solver_profile, bounded=True)
         )
         c, d = popt_exp
+        nfev["exponential"] = int(exp_info['nfev'])
         fit_params["exponential"] = {"c": c, "d": d}
-        days_stage_3 = np.arange(stage_3_base_start, max_days + 1)  # 使用可变的最大天数
-        rates_stage_3 = exponential_function(days_stage_3, c, d)
-        lt_stage_3 = np.sum(rates_stage_3)
-        print(f"[DEBUG] {channel_name} 第三阶段指数拟合：c = {c:.6e}, d = {d:.6f}")
-        print(f"[DEBUG] {channel_name} 第三阶段 LT = {lt_stage_3:.4f}")
+        lt_stage_3 = exponential_sum(c, d, stage_3_base_start, max_days)  # 使用可变的最大天数
+        if trace is not None:
+            trace.record("stage_3", time.perf_counter() - stage_start, nfev=nfev["exponential"],
+                         njev=exp_info.get('njev'), residual=np.sum(exp_info['fvec'] ** 2), lt=lt_stage_3,
+                         window=[stage_3_base_start, stage_3_base_end],
+                         warm_start="exponential" in warm_start)
     except Exception as e:
-        print(f"[ERROR] {channel_name} 第三阶段预测失败：{e}. 使用幂函数预测。")
-        model_used = "power_only"
+        model_used = "power_only" if stage_1_model == "power" else f"{stage_1_model}_only"
+        c = d = None
         days_stage_3 = np.arange(stage_3_base_start, max_days + 1)  # 使用可变的最大天数
-        rates_stage_3 = power_function(days_stage_3, a, b)
+        rates_stage_3 = stage_1_func(days_stage_3, *stage_1_params)
         lt_stage_3 = np.sum(rates_stage_3)
+        if trace is not None:
+            trace.record("stage_3", time.perf_counter() - stage_start, lt=lt_stage_3,
+                         fallback=f"指数拟合失败，使用第一阶段模型预测：{e}")
 
     # ----- 总 LT 计算 -----
     total_lt = 1.0 + lt1_to_30 + lt_stage_2 + lt_stage_3
-    print(f"[RESULT] {channel_name} {lt_years}年总 LT = {total_lt:.4f}")
+    if trace is not None:
+        trace.finish(total_lt, fit_success, model_used)
 
     # 准备返回值
     result = {
@@ -1404,46 +2364,966 @@ def calculate_lt(data, channel_name, lt_years=5, return_curve_data=False, key_da
         'success': fit_success,
         'fit_params': fit_params,
         'power_r2': power_r2,
-        'model_used': model_used
+        'stage1_r2': stage1_r2,
+        'model_used': model_used,
+        'nfev': nfev
     }
 
     if return_curve_data:
-        # 返回不包含第0天的曲线数据用于可视化
-        all_days = np.concatenate([
-            days_full,      # 第1-30天
-            days_stage_2,   # 第二阶段
-            days_stage_3    # 第三阶段
-        ])
-        all_rates = np.concatenate([
-            rates_full,     # 第1-30天
-            rates_stage_2,  # 第二阶段
-            rates_stage_3   # 第三阶段
-        ])
-
-        # 按天数排序
-        sort_idx = np.argsort(all_days)
-        all_days = all_days[sort_idx]
-        all_rates = all_rates[sort_idx]
-
-        # 只返回到指定年数的数据
-        max_idx = np.searchsorted(all_days, lt_years * 365, side='right')
-        all_days = all_days[:max_idx]
-        all_rates = all_rates[:max_idx]
+        # 返回惰性曲线对象，按需计算留存率，不再物化整条多年曲线
+        curve = LTCurve(
+            stage_1_params, (c, d) if c is not None else None,
+            (stage_2_start, stage_2_end), (stage_3_base_start, stage_3_base_end),
+            max_days, stage_1_success=fit_success, stage_1_model=stage_1_model
+        )
 
         # 计算关键时间点的累积LT值
         key_days_lt = {}
         if key_days:
-            key_days_lt = calculate_cumulative_lt(all_days, all_rates, key_days)
+            key_days_lt = curve.cumulative(key_days)
 
-        # 添加曲线数据到返回值
         result.update({
-            'curve_days': all_days,
-            'curve_rates': all_rates,
+            'curve': curve,
             'key_days_lt': key_days_lt
         })
 
     return result
 
+# ==================== LT拟合结果缓存 ====================
+class LTFitCache:
+    """LT拟合结果的LRU缓存，按留存数据指纹+渠道规则+模型版本索引，跨会话共享"""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(data, channel_name, lt_years, **options):
+        """计算缓存键：天数与留存率数组的哈希、解析后的渠道规则、模型版本及计算选项"""
+        rule_name, rules = resolve_channel_rule(channel_name)
+        hasher = hashlib.sha256()
+        hasher.update(np.ascontiguousarray(data["days"], dtype=np.float64).tobytes())
+        hasher.update(b"|")
+        hasher.update(np.ascontiguousarray(data["rates"], dtype=np.float64).tobytes())
+        hasher.update(json.dumps({
+            'rule': rule_name,
+            'rules': rules,
+            'version': LT_MODEL_VERSION,
+            'lt_years': lt_years,
+            'options': options
+        }, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else 0.0
+            }
+
+@st.cache_resource
+def get_lt_fit_cache():
+    """进程级共享的LT拟合缓存（所有用户、会话与重跑共用）"""
+    return LTFitCache(maxsize=512)
+
+cache_registry.register('fits', "LT拟合缓存", get_lt_fit_cache().clear, stats=get_lt_fit_cache().stats)
+
+def calculate_lt_cached(data, channel_name, lt_years=5, return_curve_data=False, key_days=None, trace=None,
+                        warm_start=None, solver_profile="default", stage1_fit=None, cache=None):
+    """带缓存的calculate_lt：相同留存输入直接返回已存储的拟合参数与LT值
+
+    返回结果中的cache_hit标记本次是否命中缓存（命中时nfev为当初拟合的评估次数，本次并未执行求解）。
+    """
+    if cache is None:
+        cache = get_lt_fit_cache()
+    lookup_start = time.perf_counter()
+    key = cache.make_key(data, channel_name, lt_years,
+                         return_curve_data=return_curve_data,
+                         key_days=list(key_days) if key_days else None,
+                         warm_start=warm_start,
+                         solver_profile=solver_profile,
+                         stage1_fit=stage1_fit)
+    with pipeline_timer.stage(f"LT拟合缓存 {lt_years}年", rows=1) as record:
+        cached_result = cache.get(key)
+        if cached_result is not None:
+            record['cache'] = 'hit'
+            if trace is not None:
+                trace.record("cache", time.perf_counter() - lookup_start, cache_hit=True)
+                trace.finish(cached_result['lt_value'], cached_result['success'], cached_result['model_used'])
+            return dict(cached_result, cache_hit=True)
+
+        record['cache'] = 'miss'
+        result = calculate_lt(data, channel_name, lt_years, return_curve_data=return_curve_data,
+                              key_days=key_days, trace=trace, warm_start=warm_start, solver_profile=solver_profile,
+                              stage1_fit=stage1_fit)
+        cache.put(key, result)
+    return dict(result, cache_hit=False)
+
+# ==================== 求解器配置基准 ====================
+def benchmark_solver_profiles(retention_data, profiles=None, lt_years=5, repeats=3):
+    """对比各求解器配置在所有渠道规则下的评估次数与耗时（直接调用calculate_lt，不经过拟合缓存）
+
+    每个渠道的留存数据都会按每条渠道规则各拟合一次，因此即使数据中缺少某类渠道也能覆盖全部规则。
+    返回:
+        (明细DataFrame, 按配置×规则汇总的DataFrame)
+    """
+    profiles = profiles or list(SOLVER_PROFILES)
+    rows = []
+    for profile in profiles:
+        for rule_name in CHANNEL_RULES:
+            for retention_result in retention_data:
+                elapsed = []
+                for _ in range(repeats):
+                    trace = FitTrace(rule_name, lt_years)
+                    start = time.perf_counter()
+                    result = calculate_lt(retention_result, rule_name, lt_years, trace=trace, solver_profile=profile)
+                    elapsed.append(time.perf_counter() - start)
+                rows.append({
+                    'profile': profile,
+                    'rule': rule_name,
+                    'data_source': retention_result['data_source'],
+                    'nfev': trace.total_nfev,
+                    'njev': sum(stage.get('njev') or 0 for stage in trace.stages),
+                    'elapsed': min(elapsed),
+                    'lt_value': result['lt_value'],
+                    'success': result['success'] and result['model_used'] == "power+exponential"
+                })
+
+    detail_df = pd.DataFrame(rows)
+    if detail_df.empty:
+        return detail_df, detail_df
+
+    # 以最严格配置的LT值为参照，衡量其他配置的精度损失
+    reference_profile = "accurate" if "accurate" in profiles else profiles[0]
+    reference = detail_df[detail_df['profile'] == reference_profile].set_index(['rule', 'data_source'])['lt_value']
+    detail_df['lt_deviation'] = (
+        detail_df['lt_value'] / reference.reindex(pd.MultiIndex.from_frame(detail_df[['rule', 'data_source']])).values - 1
+    ).abs()
+
+    summary_df = detail_df.groupby(['profile', 'rule'], sort=False).agg(
+        拟合次数=('data_source', 'count'),
+        函数评估=('nfev', 'sum'),
+        雅可比评估=('njev', 'sum'),
+        平均耗时_ms=('elapsed', lambda x: x.mean() * 1000),
+        失败或回退=('success', lambda x: int((~x).sum())),
+        最大LT偏差=('lt_deviation', 'max')
+    ).reset_index().rename(columns={'profile': '求解器配置', 'rule': '渠道规则', '平均耗时_ms': '平均耗时(ms)'})
+    return detail_df, summary_df
+
+# ==================== 拟合参数存储（热启动） ====================
+FIT_PARAMS_COLUMNS = ['channel', 'month', 'stage1_model', 'a', 'b', 'c', 'd', 'power_nfev', 'exp_nfev', 'cold_nfev',
+                      'warm_start']
+
+def load_fit_params_store():
+    """从本地文件加载各渠道各月份的拟合参数"""
+    try:
+        if os.path.exists(FIT_PARAMS_FILE):
+            return pd.read_csv(FIT_PARAMS_FILE, dtype={'channel': str, 'month': str})
+    except Exception as e:
+        st.warning(f"加载拟合参数存储失败：{str(e)}")
+    return pd.DataFrame(columns=FIT_PARAMS_COLUMNS)
+
+def find_warm_start(store_df, channel_name, month):
+    """查找渠道在目标月份之前最近一个月的幂函数拟合参数（第一阶段为其他模型的记录不参与热启动）
+
+    返回:
+        {'month': 参数所属月份, 'params': 传给calculate_lt的warm_start, 'cold_nfev': 冷启动参考评估次数}，无记录时返回None
+    """
+    if store_df.empty:
+        return None
+    prior = store_df[(store_df['channel'] == channel_name) & (store_df['month'] < month)]
+    if 'stage1_model' in prior.columns:
+        # 旧版存储没有该列，均为幂函数拟合
+        prior = prior[prior['stage1_model'].fillna("power") == "power"]
+    if prior.empty:
+        return None
+    row = prior.sort_values('month').iloc[-1]
+
+    params = {}
+    if pd.notna(row['a']) and pd.notna(row['b']):
+        params['power'] = (float(row['a']), float(row['b']))
+    if pd.notna(row['c']) and pd.notna(row['d']):
+        params['exponential'] = (float(row['c']), float(row['d']))
+    if not params:
+        return None
+
+    prior_nfev = sum(int(row[col]) for col in ['power_nfev', 'exp_nfev'] if pd.notna(row[col]))
+    cold_nfev = int(row['cold_nfev']) if pd.notna(row['cold_nfev']) else prior_nfev
+    return {'month': row['month'], 'params': params, 'cold_nfev': cold_nfev}
+
+def build_fit_params_record(channel_name, month, lt_result, warm_info=None):
+    """由LT拟合结果生成一条参数存储记录，冷启动参考评估次数沿用最近一次冷启动的值
+
+    第一阶段采用模型库其他模型的渠道没有幂函数参数，a、b为空并在stage1_model中注明所用模型。
+    """
+    power = lt_result['fit_params'].get('power', {})
+    exponential = lt_result['fit_params'].get('exponential', {})
+    stage1_model = lt_result['fit_params'].get('stage1', {}).get('model', "power")
+    nfev = lt_result.get('nfev', {})
+    total_nfev = sum(n for n in nfev.values() if n)
+    return {
+        'channel': channel_name,
+        'month': month,
+        'stage1_model': stage1_model,
+        'a': power.get('a'),
+        'b': power.get('b'),
+        'c': exponential.get('c'),
+        'd': exponential.get('d'),
+        'power_nfev': nfev.get('power'),
+        'exp_nfev': nfev.get('exponential'),
+        'cold_nfev': warm_info['cold_nfev'] if warm_info else total_nfev,
+        'warm_start': warm_info is not None
+    }
+
+@st.cache_resource
+def get_fit_params_lock():
+    """进程内串行化参数存储的读-改-写，避免并发会话互相覆盖对方刚写入的记录"""
+    return threading.Lock()
+
+def save_fit_params(records, month):
+    """保存本月各渠道拟合参数到本地文件（同渠道同月份的旧记录被覆盖）
+
+    经_atomic_write先写临时文件再替换，中断或并发写入不会留下截断的文件。
+    """
+    try:
+        new_df = pd.DataFrame(records, columns=FIT_PARAMS_COLUMNS)
+        with get_fit_params_lock():
+            store_df = load_fit_params_store()
+            if not store_df.empty:
+                store_df = store_df[~((store_df['month'] == month) & store_df['channel'].isin(new_df['channel']))]
+                new_df = pd.concat([store_df, new_df], ignore_index=True)
+            new_df = new_df.sort_values(['channel', 'month'])
+            _atomic_write(FIT_PARAMS_FILE, lambda f: f.write(new_df.to_csv(index=False).encode('utf-8-sig')))
+        return True
+    except Exception as e:
+        st.warning(f"保存拟合参数失败：{str(e)}")
+        return False
+
+# ==================== 批量拟合求解器 ====================
+def batch_curve_fit(func, x, y, p0, mask=None, jac=None, bounds=None, max_iter=200, tol=1.49e-8):
+    """对大量相互独立的小型最小二乘问题做向量化Levenberg-Marquardt拟合
+
+    参数:
+        func: 模型函数 func(x, *params)，params 以 (n_problems, 1) 列向量传入并与 x 广播
+        x, y: (n_problems, n_points) 数组，天数不同的问题用 mask 对齐
+        p0: (n_problems, n_params) 初始参数
+        mask: (n_problems, n_points) 布尔数组，False 的点不参与拟合
+        jac: 可选解析雅可比 jac(x, *params)，返回 (n_problems, n_points, n_params)；缺省时用前向差分
+        bounds: 可选 (lower, upper)，每个长度为 n_params，超出的参数会被投影回边界
+    返回:
+        (params, sse, nfev, converged)：拟合参数、残差平方和、总函数评估次数、各问题是否收敛
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    params = np.array(p0, dtype=float, copy=True)
+    n_problems, n_params = params.shape
+    mask = np.ones(y.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    y = np.where(mask, y, 0.0)
+    if bounds is not None:
+        lower = np.broadcast_to(np.asarray(bounds[0], dtype=float), (n_params,))
+        upper = np.broadcast_to(np.asarray(bounds[1], dtype=float), (n_params,))
+        params = np.clip(params, lower, upper)
+
+    def residuals(p):
+        with np.errstate(all='ignore'):
+            r = func(x, *[p[:, [k]] for k in range(n_params)]) - y
+        return np.where(mask, r, 0.0)
+
+    def jacobian(p, r):
+        if jac is not None:
+            with np.errstate(all='ignore'):
+                J = jac(x, *[p[:, [k]] for k in range(n_params)])
+            return np.where(mask[..., None], J, 0.0), 0
+        J = np.empty(r.shape + (n_params,))
+        for k in range(n_params):
+            step = 1.49e-8 * np.maximum(np.abs(p[:, k]), 1e-8)
+            shifted = p.copy()
+            shifted[:, k] += step
+            J[..., k] = (residuals(shifted) - r) / step[:, None]
+        return J, n_params
+
+    r = residuals(params)
+    sse = np.sum(r ** 2, axis=1)
+    nfev = 1
+    damping = np.full(n_problems, 1e-3)
+    converged = np.zeros(n_problems, dtype=bool)
+    active = np.isfinite(sse)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        J, jac_evals = jacobian(params, r)
+        nfev += jac_evals
+        Jt = np.swapaxes(J, 1, 2)
+        JtJ = Jt @ J
+        Jtr = (Jt @ r[..., None])[..., 0]
+        diag = np.maximum(np.einsum('nii->ni', JtJ), 1e-12)
+        system = JtJ + damping[:, None, None] * (diag[:, :, None] * np.eye(n_params))
+        step = np.linalg.solve(system, -Jtr[..., None])[..., 0]
+        step = np.where(active[:, None] & np.isfinite(step), step, 0.0)
+
+        trial = params + step
+        if bounds is not None:
+            trial = np.clip(trial, lower, upper)
+        trial_r = residuals(trial)
+        trial_sse = np.sum(trial_r ** 2, axis=1)
+        nfev += 1
+
+        improved = active & np.isfinite(trial_sse) & (trial_sse <= sse)
+        relative_gain = np.where(improved, (sse - trial_sse) / np.maximum(sse, 1e-300), 0.0)
+        step_size = np.max(np.abs(trial - params), axis=1)
+        params = np.where(improved[:, None], trial, params)
+        r = np.where(improved[:, None], trial_r, r)
+        sse = np.where(improved, trial_sse, sse)
+        damping = np.where(improved, np.maximum(damping / 10, 1e-12), np.minimum(damping * 10, 1e12))
+
+        finished = (improved & (relative_gain < tol)) | (step_size <= tol * (np.max(np.abs(params), axis=1) + tol))
+        finished |= damping >= 1e12
+        converged |= active & finished
+        active &= ~finished
+
+    return params, sse, nfev, converged
+
+def loglinear_regression(x, y, mask=None):
+    """按行对 ln(y) = intercept + slope * x 做最小二乘（闭式解，y<=0或被掩码的点不参与）
+
+    返回:
+        (intercept, slope)，有效点不足两个的行为NaN
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    mask = np.ones(y.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    log_mask = mask & (y > 0)
+    with np.errstate(all='ignore'):
+        log_y = np.where(log_mask, np.log(np.where(log_mask, y, 1.0)), 0.0)
+        n_points = log_mask.sum(axis=1)
+        mean_x = np.where(log_mask, x, 0.0).sum(axis=1) / n_points
+        mean_y = log_y.sum(axis=1) / n_points
+        centered_x = np.where(log_mask, x - mean_x[:, None], 0.0)
+        slope = (centered_x * (log_y - mean_y[:, None])).sum(axis=1) / (centered_x ** 2).sum(axis=1)
+    return mean_y - slope * mean_x, slope
+
+def batch_fit_exponential(days, rates, mask=None):
+    """批量指数拟合 y = c * exp(d * x)，约束 c >= 0、d <= 0（对应第三阶段的curve_fit边界）
+
+    初值取对数线性回归的闭式解，再用批量LM细化。
+    """
+    intercept, slope = loglinear_regression(days, rates, mask)
+    slope = np.where(np.isfinite(slope), np.minimum(slope, 0.0), -0.001)
+    intercept = np.where(np.isfinite(intercept), np.exp(intercept), 0.001)
+    p0 = np.column_stack([intercept, slope])
+    return batch_curve_fit(
+        exponential_function, days, rates, p0, mask=mask, jac=exponential_jacobian,
+        bounds=([0, -np.inf], [np.inf, 0])
+    )
+
+def power_prefix_sums(a, b, max_day):
+    """各组幂函数参数在第1..max_day天的前缀和，prefix[:, D] = Σ_{x=1..D} a*x^b"""
+    all_days = np.arange(1, max_day + 1, dtype=float)
+    a = np.asarray(a, dtype=float)[:, None]
+    b = np.asarray(b, dtype=float)[:, None]
+    prefix = np.zeros((a.shape[0], max_day + 1))
+    prefix[:, 1:] = np.cumsum(a * np.power(all_days[None, :], b), axis=1)
+    return prefix
+
+# ==================== 第一阶段模型库 ====================
+def weibull_function(x, a, lam, k):
+    """Weibull衰减：y = a * exp(-(x/λ)^k)"""
+    return a * np.exp(-np.power(x / lam, k))
+
+def lognormal_decay_function(x, a, mu, sigma):
+    """对数正态衰减（对数正态生存函数）：y = a * (1 - Φ((ln x - μ) / σ))"""
+    return a * 0.5 * erfc((np.log(x) - mu) / (sigma * np.sqrt(2)))
+
+def sbg_function(x, a, alpha, beta):
+    """移位Beta几何(sBG)留存：y = a * B(α, β + x) / B(α, β)"""
+    return a * np.exp(betaln(alpha, beta + x) - betaln(alpha, beta))
+
+def _power_model_init(days, rates, mask):
+    intercept, slope = loglinear_regression(np.log(days), rates, mask)
+    a = np.where(np.isfinite(intercept), np.exp(intercept), 0.3)
+    b = np.where(np.isfinite(slope), slope, -0.5)
+    return a, b
+
+def _exponential_model_init(days, rates, mask):
+    intercept, slope = loglinear_regression(days, rates, mask)
+    return (np.where(np.isfinite(intercept), np.exp(intercept), 0.3),
+            np.where(np.isfinite(slope), np.minimum(slope, 0.0), -0.05))
+
+# 第一阶段候选模型：init 由幂函数对数回归给出量级合适的初值，bounds 通过投影保证参数有效
+STAGE1_MODELS = {
+    "power": {
+        "func": power_function, "jac": power_jacobian, "params": ["a", "b"],
+        "init": lambda days, rates, mask: np.column_stack(_power_model_init(days, rates, mask)),
+        "bounds": ([-np.inf, -np.inf], [np.inf, np.inf])
+    },
+    "exponential": {
+        "func": exponential_function, "jac": exponential_jacobian, "params": ["c", "d"],
+        "init": lambda days, rates, mask: np.column_stack(_exponential_model_init(days, rates, mask)),
+        "bounds": ([0, -np.inf], [np.inf, 0])
+    },
+    "weibull": {
+        "func": weibull_function, "jac": None, "params": ["a", "lam", "k"],
+        "init": lambda days, rates, mask: np.column_stack([
+            _power_model_init(days, rates, mask)[0] * np.e, np.ones(len(days)), np.full(len(days), 0.3)
+        ]),
+        "bounds": ([0, 1e-6, 1e-3], [np.inf, np.inf, 10])
+    },
+    "lognormal": {
+        "func": lognormal_decay_function, "jac": None, "params": ["a", "mu", "sigma"],
+        "init": lambda days, rates, mask: np.column_stack([
+            _power_model_init(days, rates, mask)[0] * 2, np.zeros(len(days)), np.full(len(days), 2.0)
+        ]),
+        "bounds": ([0, -np.inf, 1e-3], [np.inf, np.inf, 50])
+    },
+    "sbg": {
+        "func": sbg_function, "jac": None, "params": ["a", "alpha", "beta"],
+        "init": lambda days, rates, mask: (lambda a, b: np.column_stack([
+            a * (np.clip(-b, 0.05, 10) + 1.0), np.clip(-b, 0.05, 10), np.ones(len(days))
+        ]))(*_power_model_init(days, rates, mask)),
+        "bounds": ([0, 1e-4, 1e-4], [np.inf, 1e3, 1e4])
+    }
+}
+
+def stage1_prefix_sums(model, params, max_day):
+    """各组第一阶段模型参数在第1..max_day天的前缀和，prefix[:, D] = Σ_{x=1..D} f(x)
+
+    params 为 (n, 参数个数) 数组，参数顺序与STAGE1_MODELS[model]["params"]一致；幂函数沿用power_prefix_sums。
+    """
+    params = np.asarray(params, dtype=float).reshape(-1, len(STAGE1_MODELS[model]["params"]))
+    if model == "power":
+        return power_prefix_sums(params[:, 0], params[:, 1], max_day)
+    all_days = np.arange(1, max_day + 1, dtype=float)
+    prefix = np.zeros((params.shape[0], max_day + 1))
+    with np.errstate(all='ignore'):
+        prefix[:, 1:] = np.cumsum(STAGE1_MODELS[model]["func"](all_days[None, :], *params.T[:, :, None]), axis=1)
+    return prefix
+
+def pad_retention_results(retention_data, max_day=30):
+    """把各渠道不连续的1-30天留存率对齐为 (渠道, 天) 矩阵，缺失天数由mask标记"""
+    days = np.tile(np.arange(1, max_day + 1, dtype=float), (len(retention_data), 1))
+    rates = np.zeros(days.shape)
+    mask = np.zeros(days.shape, dtype=bool)
+    for row, retention_result in enumerate(retention_data):
+        observed_days = np.asarray(retention_result['days'], dtype=int)
+        in_range = (observed_days >= 1) & (observed_days <= max_day)
+        rates[row, observed_days[in_range] - 1] = np.asarray(retention_result['rates'], dtype=float)[in_range]
+        mask[row, observed_days[in_range] - 1] = True
+    return days, rates, mask
+
+def select_stage1_models(retention_data, models=None, criterion="aic"):
+    """模型库批量选择：每个候选模型对所有渠道做一次批量拟合，再一次性向量化计算AIC/BIC并选出各渠道最优模型
+
+    返回:
+        (选择结果 {渠道名称: {'model', 'params', 'r2'}}, 各渠道各模型评分DataFrame)
+    """
+    models = models or list(STAGE1_MODELS)
+    channels = [r['data_source'] for r in retention_data]
+    days, rates, mask = pad_retention_results(retention_data)
+    n_points = mask.sum(axis=1).astype(float)
+
+    fitted_params = {}
+    sse = np.full((len(channels), len(models)), np.inf)
+    n_params = np.array([len(STAGE1_MODELS[name]["params"]) for name in models], dtype=float)
+    for j, name in enumerate(models):
+        spec = STAGE1_MODELS[name]
+        params, model_sse, _, converged = batch_curve_fit(
+            spec["func"], days, rates, spec["init"](days, rates, mask),
+            mask=mask, jac=spec["jac"], bounds=spec["bounds"]
+        )
+        fitted_params[name] = params
+        valid = np.isfinite(model_sse) & np.all(np.isfinite(params), axis=1)
+        sse[:, j] = np.where(valid, model_sse, np.inf)
+
+    # 信息准则：n ln(SSE/n) + 惩罚项，参数不少于数据点的模型视为不可用
+    with np.errstate(all='ignore'):
+        log_likelihood_term = n_points[:, None] * np.log(np.maximum(sse, 1e-300) / n_points[:, None])
+        aic = log_likelihood_term + 2 * n_params[None, :]
+        bic = log_likelihood_term + n_params[None, :] * np.log(n_points)[:, None]
+    identifiable = n_points[:, None] > n_params[None, :]
+    aic = np.where(identifiable & np.isfinite(sse), aic, np.inf)
+    bic = np.where(identifiable & np.isfinite(sse), bic, np.inf)
+    scores = aic if criterion == "aic" else bic
+    winners = np.argmin(scores, axis=1)
+
+    observed_mean = np.where(mask, rates, 0.0).sum(axis=1) / np.maximum(n_points, 1)
+    ss_tot = np.where(mask, (rates - observed_mean[:, None]) ** 2, 0.0).sum(axis=1)
+
+    selection = {}
+    score_rows = []
+    for i, channel in enumerate(channels):
+        if not np.isfinite(scores[i, winners[i]]):
+            continue
+        winner = models[winners[i]]
+        selection[channel] = {
+            'model': winner,
+            'params': tuple(float(v) for v in fitted_params[winner][i]),
+            'r2': 1 - sse[i, winners[i]] / ss_tot[i] if ss_tot[i] != 0 else 0.0
+        }
+        row = {'渠道名称': channel, '最优模型': winner}
+        for j, name in enumerate(models):
+            row[f'{name} {criterion.upper()}'] = scores[i, j]
+        score_rows.append(row)
+    return selection, pd.DataFrame(score_rows)
+
+# ==================== 阶段划分敏感性分析 ====================
+def compute_stage_sensitivity_cube(stage1_params, stage_2_ends, base_windows, horizons=(2, 5)):
+    """在阶段划分网格上批量计算各渠道LT，复用已有的第一阶段拟合（按各渠道采用的模型分组求值）
+
+    网格单元 (第二阶段终点E, 基准窗口长度W) 对应规则 stage_2 = [30, E]、stage_3_base = [E, E + W]，
+    所有渠道 × E × W 的第三阶段指数拟合在一次批量求解中完成。
+    参数:
+        stage1_params: {渠道名称: (第一阶段模型, 参数元组)}，模型见STAGE1_MODELS
+        stage_2_ends: 第二阶段终点列表
+        base_windows: 第三阶段基准窗口长度列表
+        horizons: LT年限列表
+    返回:
+        字典，'lt' 为 (渠道, E, W, 年限) 四维数组，其余键为各轴标签
+    """
+    channels = list(stage1_params.keys())
+    stage_2_ends = sorted(int(e) for e in stage_2_ends)
+    base_windows = sorted(int(w) for w in base_windows)
+    horizons = list(horizons)
+
+    n_ch, n_e, n_w = len(channels), len(stage_2_ends), len(base_windows)
+    ends = np.array(stage_2_ends)
+    windows = np.array(base_windows)
+
+    # 每个网格单元的第三阶段基准点：[E, E + W]，长度不同的窗口用mask对齐
+    offsets = np.arange(windows.max() + 1)
+    base_days = ends[None, :, None, None] + offsets[None, None, None, :]
+    base_days = np.broadcast_to(base_days, (n_ch, n_e, n_w, len(offsets)))
+    base_mask = np.broadcast_to(offsets[None, None, None, :] <= windows[None, None, :, None], base_days.shape)
+
+    # 第一阶段模型在基准点上的留存率及逐日前缀和，同一模型的渠道一次求值
+    max_day = max(ends.max() + windows.max(), max(horizons) * 365)
+    base_rates = np.empty(base_days.shape)
+    prefix = np.empty((n_ch, max_day + 1))
+    for model in dict.fromkeys(model for model, _ in stage1_params.values()):
+        rows = [i for i, ch in enumerate(channels) if stage1_params[ch][0] == model]
+        params = np.array([stage1_params[channels[i]][1] for i in rows], dtype=float)
+        with np.errstate(all='ignore'):
+            base_rates[rows] = STAGE1_MODELS[model]["func"](base_days[rows].astype(float),
+                                                            *params.T[:, :, None, None, None])
+        prefix[rows] = stage1_prefix_sums(model, params, max_day)
+
+    flat_shape = (n_ch * n_e * n_w, len(offsets))
+    exp_params, _, _, converged = batch_fit_exponential(
+        base_days.reshape(flat_shape), base_rates.reshape(flat_shape), base_mask.reshape(flat_shape)
+    )
+    c = exp_params[:, 0].reshape(n_ch, n_e, n_w)
+    d = exp_params[:, 1].reshape(n_ch, n_e, n_w)
+    exp_ok = (converged & np.all(np.isfinite(exp_params), axis=1)).reshape(n_ch, n_e, n_w)
+
+    # 第一、二阶段：第一阶段模型前缀和，第30天和E天按三阶段口径重复计入
+    lt_head = prefix[:, 30]
+    lt_body = prefix[:, ends] - prefix[:, [29]]
+
+    lt_cube = np.empty((n_ch, n_e, n_w, len(horizons)))
+    for h, lt_years in enumerate(horizons):
+        max_days = lt_years * 365
+        start = np.broadcast_to(ends[None, :, None], (n_ch, n_e, n_w))
+        lt_tail_exp = exponential_sum(c, d, start, max_days)
+        lt_tail_power = (prefix[:, [max_days]] - prefix[:, ends - 1])[:, :, None]
+        lt_tail = np.where(exp_ok, lt_tail_exp, lt_tail_power)
+        lt_cube[..., h] = 1.0 + lt_head[:, None, None] + lt_body[:, :, None] + lt_tail
+
+    return {
+        'lt': lt_cube,
+        'channels': channels,
+        'stage_2_ends': stage_2_ends,
+        'base_windows': base_windows,
+        'horizons': horizons,
+        'exp_ok': exp_ok
+    }
+
+# ==================== 自助法置信区间 ====================
+def _numeric_column(series):
+    """与safe_convert_to_numeric同口径的整列数值转换：空串及'nan'/'null'/'none'记为0，无法解析的值为NaN"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float)
+    text = series.astype(str).str.strip()
+    blank = series.notna() & text.str.lower().isin(['', 'nan', 'null', 'none'])
+    values = pd.to_numeric(text.where(~blank, '0'), errors='coerce').to_numpy(dtype=float)
+    return np.where(series.isna().to_numpy(), np.nan, values)
+
+def retention_count_arrays(source_data, max_day=30):
+    """把单个数据来源的逐日记录转为矩阵形式，口径与calculate_retention_rates_new_method一致
+
+    返回:
+        (新增数向量, 新增数有效标记, (行, 天) 留存数矩阵, 留存数有效标记)
+    """
+    n_rows = len(source_data)
+    if '回传新增数' in source_data.columns:
+        new_users = np.nan_to_num(_numeric_column(source_data['回传新增数']), nan=0.0)
+    else:
+        new_users = np.zeros(n_rows)
+    retain = np.zeros((n_rows, max_day))
+    retain_valid = np.zeros((n_rows, max_day), dtype=bool)
+    for day in range(1, max_day + 1):
+        day_col = str(day)
+        if day_col not in source_data.columns:
+            continue
+        values = _numeric_column(source_data[day_col])
+        valid = np.isfinite(values) & (values >= 0)
+        retain[:, day - 1] = np.where(valid, values, 0.0)
+        retain_valid[:, day - 1] = valid
+    return new_users, new_users > 0, retain, retain_valid
+
+def bootstrap_retention_rates(source_data, n_resamples, rng, max_day=30):
+    """对单个数据来源的逐日记录做有放回重抽样，所有重抽样的留存率由一次矩阵乘法得到
+
+    每次重抽样表示为各行被抽中次数的权重向量，平均新增数与各天平均留存数即为加权均值。
+    返回:
+        (rates, mask)：(重抽样, 天) 留存率矩阵及有效标记（与原方法一样只保留 0-1 之间的留存率）
+    """
+    new_users, users_valid, retain, retain_valid = retention_count_arrays(source_data, max_day)
+    n_rows = len(new_users)
+    weights = rng.multinomial(n_rows, np.full(n_rows, 1.0 / n_rows), size=n_resamples).astype(float)
+    with np.errstate(all='ignore'):
+        avg_new_users = (weights @ np.where(users_valid, new_users, 0.0)) / (weights @ users_valid)
+        avg_retain = (weights @ retain) / (weights @ retain_valid)
+        rates = avg_retain / avg_new_users[:, None]
+    mask = np.isfinite(rates) & (rates >= 0) & (rates <= 1.0)
+    return np.where(mask, rates, 0.0), mask
+
+def calculate_retention_rates_vectorized(df):
+    """calculate_retention_rates_new_method的矩阵版本，结果结构与口径相同，用于需要反复计算留存率的批量场景"""
+    retention_results = []
+    for source in df['数据来源'].unique():
+        source_data = df[df['数据来源'] == source]
+        new_users, users_valid, retain, retain_valid = retention_count_arrays(source_data)
+        if not users_valid.any():
+            continue
+        avg_new_users = new_users[users_valid].mean()
+        with np.errstate(all='ignore'):
+            rates = retain.sum(axis=0) / retain_valid.sum(axis=0) / avg_new_users
+        keep = np.isfinite(rates) & (rates >= 0) & (rates <= 1.0)
+        if keep.any():
+            retention_results.append({
+                'data_source': source,
+                'days': np.flatnonzero(keep) + 1,
+                'rates': rates[keep],
+                'avg_new_users': avg_new_users
+            })
+    return retention_results
+
+def batch_three_stage_lt(params, rules, horizons=(2, 5), refine_exponential=True, model="power"):
+    """同一渠道规则下多组第一阶段模型参数的三阶段LT，口径与calculate_lt一致，第三阶段指数拟合批量完成
+
+    params 为 (n, 参数个数) 数组，model 为STAGE1_MODELS中的模型名称（默认幂函数）。
+    refine_exponential=False 时第三阶段只取对数线性回归的闭式解，不做迭代细化（用于快速近似）。
+    返回:
+        (n, len(horizons)) 的LT数组
+    """
+    params = np.asarray(params, dtype=float).reshape(-1, len(STAGE1_MODELS[model]["params"]))
+    stage_2_start, stage_2_end = rules["stage_2"]
+    base_start, base_end = rules["stage_3_base"]
+    prefix = stage1_prefix_sums(model, params, max(base_end, 30))
+
+    base_days = np.broadcast_to(np.arange(base_start, base_end + 1, dtype=float), (len(params), base_end - base_start + 1))
+    base_rates = prefix[:, base_start:base_end + 1] - prefix[:, base_start - 1:base_end]
+    if refine_exponential:
+        exp_params, _, _, converged = batch_fit_exponential(base_days, base_rates)
+    else:
+        intercept, slope = loglinear_regression(base_days, base_rates)
+        exp_params = np.column_stack([np.exp(intercept), slope])
+        converged = slope <= 0
+    exp_ok = converged & np.all(np.isfinite(exp_params), axis=1)
+
+    lt_head = prefix[:, 30]
+    lt_body = prefix[:, stage_2_end] - prefix[:, stage_2_start - 1]
+    lt = np.empty((len(params), len(horizons)))
+    for h, lt_years in enumerate(horizons):
+        max_days = lt_years * 365
+        lt_tail = exponential_sum(exp_params[:, 0], exp_params[:, 1], base_start, max_days)
+        if not exp_ok.all():
+            # 指数拟合失败的组按第一阶段模型延续到最大天数，仅对这些组逐日求和
+            fallback = ~exp_ok
+            tail_days = np.arange(base_start, max_days + 1, dtype=float)
+            lt_tail = np.where(fallback, 0.0, lt_tail)
+            with np.errstate(all='ignore'):
+                lt_tail[fallback] = np.sum(STAGE1_MODELS[model]["func"](tail_days[None, :], *params[fallback].T[:, :, None]),
+                                           axis=1)
+        lt[:, h] = 1.0 + lt_head + lt_body + lt_tail
+    return lt
+
+def batch_power_lt(rates, mask, rule_names, horizons=(2, 5), model="power"):
+    """批量第一阶段拟合（默认幂函数，model 可取STAGE1_MODELS中的其他模型），再按各行的渠道规则分组计算三阶段LT
+
+    参数:
+        rates, mask: (n, 30) 留存率矩阵及有效标记
+        rule_names: 长度为 n 的渠道规则名称数组（见resolve_channel_rule）
+    返回:
+        (power_params, r2, lt)：(n, 参数个数) 第一阶段参数、(n,) R²、(n, len(horizons)) LT，
+        有效点少于参数个数或拟合失败的行为NaN
+    """
+    spec = STAGE1_MODELS[model]
+    rule_names = np.asarray(rule_names)
+    days = np.broadcast_to(np.arange(1, rates.shape[1] + 1, dtype=float), rates.shape)
+    power_params, sse, _, _ = batch_curve_fit(spec["func"], days, rates, spec["init"](days, rates, mask),
+                                              mask=mask, jac=spec["jac"], bounds=spec["bounds"])
+    n_points = mask.sum(axis=1)
+    ok = np.all(np.isfinite(power_params), axis=1) & np.isfinite(sse) & (n_points >= len(spec["params"]))
+
+    observed_mean = np.where(mask, rates, 0.0).sum(axis=1) / np.maximum(n_points, 1)
+    ss_tot = np.where(mask, (rates - observed_mean[:, None]) ** 2, 0.0).sum(axis=1)
+    with np.errstate(all='ignore'):
+        r2 = np.where(ss_tot != 0, 1 - sse / ss_tot, 0.0)
+
+    lt = np.full((len(rates), len(horizons)), np.nan)
+    for rule_name in np.unique(rule_names[ok]):
+        rows = np.flatnonzero(ok & (rule_names == rule_name))
+        lt[rows] = batch_three_stage_lt(power_params[rows], CHANNEL_RULES[rule_name], horizons, model=model)
+    power_params[~ok] = np.nan
+    r2[~ok] = np.nan
+    return power_params, r2, lt
+
+def parallel_batch_power_lt(rates, mask, rule_names, horizons=(2, 5), chunk_size=2000, max_workers=None, model="power"):
+    """把大批量行切块后在线程池中并行执行batch_power_lt（numpy的大数组运算会释放GIL）"""
+    if len(rates) <= chunk_size:
+        return batch_power_lt(rates, mask, rule_names, horizons, model=model)
+    rule_names = np.asarray(rule_names)
+    starts = range(0, len(rates), chunk_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        parts = list(pool.map(
+            lambda start: batch_power_lt(rates[start:start + chunk_size], mask[start:start + chunk_size],
+                                         rule_names[start:start + chunk_size], horizons, model=model),
+            starts
+        ))
+    return tuple(np.concatenate([part[k] for part in parts]) for k in range(3))
+
+def bootstrap_lt_intervals(working_data, retention_data, arpu_values, n_resamples=1000, confidence=0.95, seed=0,
+                           stage1_models=None):
+    """自助法估计各渠道LT与LTV的百分位置信区间
+
+    每个数据来源的逐日记录重抽样 n_resamples 次，全部渠道 × 重抽样的拟合按第一阶段模型分组，
+    切块后由parallel_batch_power_lt批量完成。
+    参数:
+        working_data: 参与留存计算的逐日数据（含'数据来源'、'回传新增数'及1-30天留存列）
+        retention_data: 留存率计算结果，决定参与的渠道
+        arpu_values: {渠道名称: ARPU}
+        stage1_models: 可选的 {渠道名称: 第一阶段模型}，重抽样按该渠道点估计所用的模型拟合，缺省为幂函数
+    返回:
+        (区间汇总DataFrame, 各渠道重抽样结果 {渠道名称: {'lt_2y', 'lt_5y'}})
+    """
+    rng = np.random.default_rng(seed)
+    channels = [r['data_source'] for r in retention_data]
+    rates_blocks, mask_blocks = [], []
+    for channel in channels:
+        rates, mask = bootstrap_retention_rates(working_data[working_data['数据来源'] == channel], n_resamples, rng)
+        rates_blocks.append(rates)
+        mask_blocks.append(mask)
+    rule_names = np.repeat([resolve_channel_rule(channel)[0] for channel in channels], n_resamples)
+    models = [(stage1_models or {}).get(channel, "power") for channel in channels]
+    row_models = np.repeat(models, n_resamples)
+    all_rates, all_mask = np.vstack(rates_blocks), np.vstack(mask_blocks)
+    lt = np.full((len(row_models), 2), np.nan)
+    for model in dict.fromkeys(models):
+        rows = np.flatnonzero(row_models == model)
+        _, _, lt[rows] = parallel_batch_power_lt(all_rates[rows], all_mask[rows], rule_names[rows], model=model)
+    lt_samples = lt.reshape(len(channels), n_resamples, 2)
+
+    lower_q, upper_q = 50 * (1 - confidence), 50 * (1 + confidence)
+    summary_rows = []
+    samples = {}
+    for i, channel in enumerate(channels):
+        lt_2y = lt_samples[i, :, 0][np.isfinite(lt_samples[i, :, 0])]
+        lt_5y = lt_samples[i, :, 1][np.isfinite(lt_samples[i, :, 1])]
+        samples[channel] = {'lt_2y': lt_2y, 'lt_5y': lt_5y}
+        if len(lt_5y) == 0:
+            continue
+        arpu = arpu_values.get(channel, 0)
+        lt_2y_low, lt_2y_high = np.percentile(lt_2y, [lower_q, upper_q])
+        lt_5y_low, lt_5y_high = np.percentile(lt_5y, [lower_q, upper_q])
+        summary_rows.append({
+            '渠道名称': channel,
+            '5年LT下限': lt_5y_low, '5年LT上限': lt_5y_high,
+            '5年LTV下限': lt_5y_low * arpu, '5年LTV上限': lt_5y_high * arpu,
+            '2年LT下限': lt_2y_low, '2年LT上限': lt_2y_high,
+            '2年LTV下限': lt_2y_low * arpu, '2年LTV上限': lt_2y_high * arpu,
+            '有效重抽样数': len(lt_5y)
+        })
+    return pd.DataFrame(summary_rows), samples
+
+# ==================== 按安装日期分组拟合 ====================
+def cohort_retention_matrix(working_data, max_day=30):
+    """按 (数据来源, 日期) 分组的留存率矩阵，同组多行时口径与calculate_retention_rates_new_method一致
+
+    返回:
+        (cohorts, rates, mask)：队列键DataFrame（数据来源、日期）、(队列, 天) 留存率矩阵及有效标记
+    """
+    keys = working_data[['数据来源', 'date']].astype(str)
+    codes, cohort_index = pd.MultiIndex.from_frame(keys).factorize()
+    n_cohorts = len(cohort_index)
+    new_users, users_valid, retain, retain_valid = retention_count_arrays(working_data, max_day)
+
+    user_sum = np.bincount(codes, weights=np.where(users_valid, new_users, 0.0), minlength=n_cohorts)
+    user_count = np.bincount(codes, weights=users_valid.astype(float), minlength=n_cohorts)
+    retain_sum = np.zeros((n_cohorts, max_day))
+    retain_count = np.zeros((n_cohorts, max_day))
+    np.add.at(retain_sum, codes, retain)
+    np.add.at(retain_count, codes, retain_valid.astype(float))
+    with np.errstate(all='ignore'):
+        rates = (retain_sum / retain_count) / (user_sum / user_count)[:, None]
+    mask = np.isfinite(rates) & (rates >= 0) & (rates <= 1.0)
+    cohorts = pd.DataFrame(list(cohort_index), columns=['数据来源', '日期'])
+    return cohorts, np.where(mask, rates, 0.0), mask
+
+def fit_cohort_lt(working_data, chunk_size=2000, max_workers=None):
+    """对每个 (数据来源, 安装日期) 队列单独拟合留存曲线并计算2年/5年LT
+
+    返回:
+        (各队列结果DataFrame, 各渠道LT分布汇总DataFrame)
+    """
+    cohorts, rates, mask = cohort_retention_matrix(working_data)
+    rule_by_source = {source: resolve_channel_rule(source)[0] for source in cohorts['数据来源'].unique()}
+    rule_names = cohorts['数据来源'].map(rule_by_source).to_numpy()
+    power_params, r2, lt = parallel_batch_power_lt(rates, mask, rule_names,
+                                                   chunk_size=chunk_size, max_workers=max_workers)
+
+    cohort_df = cohorts.assign(**{
+        '有效天数': mask.sum(axis=1),
+        'a': power_params[:, 0],
+        'b': power_params[:, 1],
+        'R²': r2,
+        '2年LT': lt[:, 0],
+        '5年LT': lt[:, 1]
+    })
+    fitted = cohort_df.dropna(subset=['5年LT'])
+    distribution_df = fitted.groupby('数据来源', sort=False)['5年LT'].agg(
+        队列数='count', 均值='mean', 标准差='std',
+        P10=lambda values: values.quantile(0.1), 中位数='median', P90=lambda values: values.quantile(0.9),
+        最小值='min', 最大值='max'
+    ).reset_index()
+    return cohort_df, distribution_df
+
+# ==================== 多月份回测 ====================
+def backtest_months(month_data, fit_days=14, lt_years=5, max_workers=None, cache=None):
+    """多月份回测：各月各渠道只用前 fit_days 天留存拟合，再与之后实际观测到的留存对比
+
+    所有月份 × 渠道的拟合在线程池中一次提交，经calculate_lt_cached复用拟合缓存。
+    累积LT只在实际观测到的天数上对比：实际值 1 + Σ观测留存率，预测值 1 + Σ同一批天数的拟合留存率。
+    参数:
+        month_data: {月份: 整合后的逐日DataFrame}
+        fit_days: 训练窗口天数，之后的观测天数作为评估窗口
+    返回:
+        (各月各渠道明细DataFrame, 按渠道规则汇总的误差DataFrame)
+    """
+    if cache is None:
+        cache = get_lt_fit_cache()
+    tasks = []
+    for month, merged_data in month_data.items():
+        for retention_result in calculate_retention_rates_vectorized(merged_data):
+            days = np.asarray(retention_result['days'])
+            rates = np.asarray(retention_result['rates'])
+            train = days <= fit_days
+            if train.sum() < 3 or (~train).sum() == 0:
+                continue
+            tasks.append((month, retention_result['data_source'], days, rates,
+                          {'days': days[train], 'rates': rates[train]}))
+
+    def fit_task(task):
+        _, channel_name, _, _, train_data = task
+        return calculate_lt_cached(train_data, channel_name, lt_years, return_curve_data=True, cache=cache)
+
+    with pipeline_timer.stage("多月份回测拟合", rows=len(tasks)), ThreadPoolExecutor(max_workers=max_workers) as pool:
+        fit_results = list(pool.map(pipeline_timer.bind(fit_task), tasks))
+
+    rows = []
+    for (month, channel_name, days, rates, _), lt_result in zip(tasks, fit_results):
+        actual_cumulative = 1.0 + np.cumsum(rates)
+        predicted_cumulative = 1.0 + np.cumsum(lt_result['curve'].rates(days))
+        evaluate = days > fit_days
+        relative_error = predicted_cumulative[evaluate] / actual_cumulative[evaluate] - 1
+        rows.append({
+            '月份': month,
+            '渠道名称': channel_name,
+            '渠道规则': resolve_channel_rule(channel_name)[0],
+            '评估天数': int(evaluate.sum()),
+            '末日': int(days[-1]),
+            '预测累积LT': predicted_cumulative[-1],
+            '实际累积LT': actual_cumulative[-1],
+            '末日误差': relative_error[-1],
+            'MAPE': np.mean(np.abs(relative_error)),
+            f'{lt_years}年LT': lt_result['lt_value'],
+            '拟合成功': lt_result['success']
+        })
+
+    detail_df = pd.DataFrame(rows)
+    if detail_df.empty:
+        return detail_df, detail_df
+    rule_df = detail_df.groupby('渠道规则', sort=False).agg(
+        样本数=('渠道名称', 'count'),
+        月份数=('月份', 'nunique'),
+        平均MAPE=('MAPE', 'mean'),
+        末日误差中位数=('末日误差', 'median'),
+        末日平均偏差=('末日误差', 'mean'),
+        末日最大绝对误差=('末日误差', lambda x: x.abs().max())
+    ).reset_index()
+    return detail_df, rule_df
+
+# ==================== 渐进式近似LT ====================
+def approximate_lt(retention_data, horizons=(2, 5), stage1_selection=None):
+    """闭式近似LT：第一阶段用双对数回归代替curve_fit，第三阶段用对数线性回归加等比数列求和，不做迭代求解
+
+    stage1_selection 为可选的模型库选择结果（见select_stage1_models），最优模型不是幂函数的渠道直接采用其已拟合参数。
+    返回:
+        {渠道名称: {年限: 近似LT}}，回归失败的渠道不包含在内
+    """
+    stage1_selection = stage1_selection or {}
+    days, rates, mask = pad_retention_results(retention_data)
+    intercept, slope = loglinear_regression(np.log(days), rates, mask)
+    ok = np.isfinite(intercept) & np.isfinite(slope)
+    channels = [r['data_source'] for r in retention_data]
+    rule_names = [resolve_channel_rule(channel)[0] for channel in channels]
+
+    # 按 (第一阶段模型, 渠道规则) 分组，每组一次批量计算
+    groups = {}
+    for row, channel in enumerate(channels):
+        selected = stage1_selection.get(channel)
+        if selected is not None and selected['model'] != "power":
+            groups.setdefault((selected['model'], rule_names[row]), []).append((row, selected['params']))
+        elif ok[row]:
+            groups.setdefault(("power", rule_names[row]), []).append((row, (np.exp(intercept[row]), slope[row])))
+
+    approximations = {}
+    for (model, rule_name), members in groups.items():
+        lt = batch_three_stage_lt([params for _, params in members], CHANNEL_RULES[rule_name], horizons,
+                                  refine_exponential=False, model=model)
+        for (row, _), values in zip(members, lt):
+            approximations[channels[row]] = dict(zip(horizons, values))
+    return approximations
+
 # ==================== 单渠道图表生成函数 - 避免中文标题 ====================
 def create_individual_channel_chart(channel_name, curve_data, original_data, max_days=100, lt_2y=None, lt_5y=None):
     """创建单个渠道的100天LT拟合图表 - 避免中文标题显示问题，添加2年5年LT显示"""
@@ -1466,14 +3346,8 @@ def create_individual_channel_chart(channel_name, curve_data, original_data, max
             zorder=3
         )
     
-    # 限制拟合曲线到100天
-    curve_days = curve_data["days"]
-    curve_rates = curve_data["rates"]
-    
-    # 筛选100天内的数据
-    mask = curve_days <= max_days
-    curve_days_filtered = curve_days[mask]
-    curve_rates_filtered = curve_rates[mask]
+    # 拟合曲线只按需计算前100天
+    curve_days_filtered, curve_rates_filtered = curve_data["curve"].window(1, max_days)
     
     # 绘制拟合曲线
     ax.plot(
@@ -1507,9 +3381,9 @@ def create_individual_channel_chart(channel_name, curve_data, original_data, max
     return fig
 
 # ==================== 【修复】加载5月后ARPU数据函数 ====================
-@st.cache_data
-def load_user_arpu_data_after_april(uploaded_file_content, builtin_df):
-    """【修复版】加载用户上传的5月及之后的ARPU数据，并与内置数据合并"""
+@instrumented_cache_data("用户ARPU数据合并", 'ingestion')
+def load_user_arpu_data_after_april(uploaded_file_content):
+    """【修复版】加载用户上传的5月及之后的ARPU数据（与默认数据的合并由前缀索引的upsert完成）"""
     try:
         # 读取用户上传的Excel文件
         user_df = pd.read_excel(io.BytesIO(uploaded_file_content), engine='openpyxl')
@@ -1522,7 +3396,7 @@ def load_user_arpu_data_after_april(uploaded_file_content, builtin_df):
             return None, f"文件缺少必需列: {', '.join(missing_cols)}"
         
         # 数据清理和格式化
-        user_df['pid'] = user_df['pid'].astype(str).str.replace('.0', '', regex=False)
+        user_df['pid'] = PidDictionary.canonical(user_df['pid'])
         
         # 筛选5月及之后的数据 - 增强日期处理
         user_df_filtered = None
@@ -1575,31 +3449,11 @@ def load_user_arpu_data_after_april(uploaded_file_content, builtin_df):
         if len(user_df_filtered) == 0:
             return None, "数据清理后无有效记录"
         
-        # 合并内置数据和用户数据
-        # 确保列格式一致
         if 'month_standard' in user_df_filtered.columns:
             user_df_filtered = user_df_filtered.drop('month_standard', axis=1)
         
-        # 确保两个DataFrame有相同的列
-        builtin_cols = set(builtin_df.columns)
-        user_cols = set(user_df_filtered.columns)
-        
-        # 只保留公共列
-        common_cols = list(builtin_cols & user_cols)
-        if not common_cols:
-            return None, "内置数据与用户数据无公共列"
-        
-        builtin_subset = builtin_df[common_cols].copy()
-        user_subset = user_df_filtered[common_cols].copy()
-        
-        # 合并数据
-        combined_df = pd.concat([builtin_subset, user_subset], ignore_index=True)
-        
-        # 去重处理（如果有重复的月份+pid组合，保留用户数据）
-        if '月份' in combined_df.columns and 'pid' in combined_df.columns:
-            combined_df = combined_df.drop_duplicates(subset=['月份', 'pid'], keep='last')
-        
-        return combined_df, f"数据合并成功，新增 {len(user_df_filtered)} 条记录"
+        # 与默认数据的合并改为按 (月份, pid) 组覆盖前缀索引（ArpuPrefixIndex.upsert_frame），不再拼接全量数据
+        return user_df_filtered.reset_index(drop=True), f"数据读取成功，新增 {len(user_df_filtered)} 条记录"
         
     except Exception as e:
         return None, f"处理文件时出错：{str(e)}"
@@ -1709,6 +3563,1026 @@ def calculate_arpu_optimized(filtered_arpu_df, channel_mapping, batch_size=1000)
     except Exception as e:
         return None, f"ARPU计算失败：{str(e)}"
 
+def _valid_arpu_rows(arpu_df):
+    """ARPU口径的有效行：用户数>0且收入>=0（无法解析为数值的行一并剔除）"""
+    users = pd.to_numeric(arpu_df['instl_user_cnt'], errors='coerce')
+    revenue = pd.to_numeric(arpu_df['ad_all_rven_1d_m'], errors='coerce')
+    # NaN比较结果为False，一并过滤
+    valid = ((users > 0) & (revenue >= 0)).to_numpy()
+    return users.to_numpy()[valid], revenue.to_numpy()[valid], valid
+
+def _pid_channel_codes(pid_codes, channel_mapping, pid_dictionary, present=None):
+    """pid编码→渠道编号；渠道按各自最小pid的字符串顺序编号，与原实现groupby('pid')后逐个追加的顺序一致
+
+    pid_codes为pid_dictionary中的编码（互不重复），present为可选的布尔数组，只有为True的pid参与排序与映射。
+    返回 (渠道名数组, 每个pid的渠道编号，未映射为-1)
+    """
+    slots, slot_names = pid_dictionary.channel_slots(channel_mapping)
+    pid_slots = slots[pid_codes]
+    mapped_pids = pid_slots >= 0
+    if present is not None:
+        mapped_pids = mapped_pids & present
+    if not mapped_pids.any():
+        return np.empty(0, dtype=object), np.full(len(pid_codes), -1, dtype=np.int64)
+
+    # 每个渠道槽位内最小pid的名次决定渠道顺序
+    first_rank = np.full(len(slot_names), np.iinfo(np.int64).max)
+    np.minimum.at(first_rank, pid_slots[mapped_pids], pid_dictionary.sort_ranks()[pid_codes[mapped_pids]])
+    used_slots = np.flatnonzero(first_rank < np.iinfo(np.int64).max)
+    ordered_slots = used_slots[np.argsort(first_rank[used_slots], kind='stable')]
+    slot_to_channel = np.full(len(slot_names), -1, dtype=np.int64)
+    slot_to_channel[ordered_slots] = np.arange(len(ordered_slots))
+    pid_to_channel = np.where(mapped_pids, slot_to_channel[np.maximum(pid_slots, 0)], -1)
+    return np.asarray(slot_names, dtype=object)[ordered_slots], pid_to_channel
+
+def summarize_channel_arpu(channel_names, channel_users, channel_revenue, channel_counts):
+    """由各渠道汇总数组生成ARPU结果表，并推导总体与安卓（总体减去iPhone），行顺序为渠道、总体、安卓"""
+    final_arpu = {
+        channel: {'total_users': channel_user_sum, 'total_revenue': channel_revenue_sum, 'record_count': int(channel_records)}
+        for channel, channel_user_sum, channel_revenue_sum, channel_records in zip(
+            channel_names, channel_users, channel_revenue, channel_counts)
+    }
+
+    total_users_sum = channel_users.sum()
+    total_revenue_sum = channel_revenue.sum()
+    total_record_count = int(channel_counts.sum())
+    iphone_data = final_arpu.get('iPhone', {'total_users': 0, 'total_revenue': 0, 'record_count': 0})
+
+    if total_users_sum > 0:
+        final_arpu['总体'] = {
+            'total_users': total_users_sum,
+            'total_revenue': total_revenue_sum,
+            'record_count': total_record_count
+        }
+
+    android_users = total_users_sum - iphone_data['total_users']
+    if android_users > 0:
+        final_arpu['安卓'] = {
+            'total_users': android_users,
+            'total_revenue': total_revenue_sum - iphone_data['total_revenue'],
+            'record_count': total_record_count - iphone_data['record_count']
+        }
+
+    return pd.DataFrame([
+        {
+            'data_source': channel,
+            'arpu_value': data['total_revenue'] / data['total_users'] if data['total_users'] > 0 else 0,
+            'record_count': data['record_count'],
+            'total_users': data['total_users'],
+            'total_revenue': data['total_revenue']
+        }
+        for channel, data in final_arpu.items()
+    ])
+
+def calculate_arpu_vectorized(filtered_arpu_df, channel_mapping):
+    """calculate_arpu_optimized的单趟向量化版本，输出结构、行顺序与口径相同，不修改传入的DataFrame
+
+    pid先编码为pid字典中的整数，pid→渠道映射只在编码上查表，所有行按渠道编码做一次分组求和；
+    总体与安卓由同一组渠道汇总数组推导。渠道顺序与原实现一致：按渠道内最小pid（字符串序）排列。
+    """
+    try:
+        users, revenue, valid = _valid_arpu_rows(filtered_arpu_df)
+        if not valid.any():
+            return None, "数据清理后无有效记录"
+
+        # 单次计算使用独立的字典，不把临时数据的pid登记到共享字典
+        pid_dictionary = PidDictionary()
+        pid_codes = pid_dictionary.encode(filtered_arpu_df['pid'][valid])
+        channel_names, pid_to_channel = _pid_channel_codes(np.arange(len(pid_dictionary)), channel_mapping,
+                                                           pid_dictionary)
+        if len(channel_names) == 0:
+            return None, "未找到匹配的渠道数据，请检查渠道映射配置"
+
+        row_channels = pid_to_channel[pid_codes]
+        in_channel = row_channels >= 0
+        aggregated = pd.DataFrame({
+            'channel': row_channels[in_channel],
+            'total_users': users[in_channel],
+            'total_revenue': revenue[in_channel]
+        }).groupby('channel', sort=True).agg(
+            total_users=('total_users', 'sum'),
+            total_revenue=('total_revenue', 'sum'),
+            record_count=('total_users', 'size')
+        ).reindex(np.arange(len(channel_names)))
+
+        arpu_summary_df = summarize_channel_arpu(
+            channel_names, aggregated['total_users'].to_numpy(), aggregated['total_revenue'].to_numpy(),
+            aggregated['record_count'].to_numpy()
+        )
+        return arpu_summary_df, "ARPU计算完成"
+
+    except Exception as e:
+        return None, f"ARPU计算失败：{str(e)}"
+
+# ==================== ARPU前缀聚合索引 ====================
+def arpu_month_labels(arpu_df):
+    """每行的月份标签（YYYY-MM）：优先月份列，其次stat_date列，都没有时为空串，口径与ARPU页面的月份筛选一致"""
+    if '月份' in arpu_df.columns:
+        labels = arpu_df['月份'].astype(str).str[:7]
+    elif 'stat_date' in arpu_df.columns:
+        labels = pd.to_datetime(arpu_df['stat_date'], errors='coerce').dt.to_period('M').astype(str)
+    else:
+        return pd.Series('', index=arpu_df.index)
+    # 缺失月份统一记为'nan'，不会落入任何有界的月份区间
+    return labels.fillna('nan')
+
+class ArpuPrefixIndex:
+    """按 (月份, pid) 预聚合用户数、收入与记录数，并沿月份方向做累计和
+
+    任意 [开始月份, 结束月份] 区间的各pid汇总都是两行累计和之差，再按渠道映射折叠为渠道、总体与安卓，
+    不再接触逐行数据。索引按pid而不是渠道存储，修改渠道映射无需重建。
+    pid列以pid字典编码保存，合并与查询都在编码上进行，pids只在展示与落盘时还原为字符串。
+    每个索引持有自己的pid字典：管理员存储的索引使用共享字典（get_pid_dictionary），其余索引缺省新建独立字典。
+    """
+
+    def __init__(self, months, pids, users_cum, revenue_cum, count_cum, pid_codes=None, pid_dictionary=None):
+        self.months = np.asarray(months, dtype=str)
+        self.pid_dictionary = PidDictionary() if pid_dictionary is None else pid_dictionary
+        self.pid_codes = self.pid_dictionary.encode_strings(pids) if pid_codes is None else np.asarray(pid_codes)
+        self.users_cum = users_cum
+        self.revenue_cum = revenue_cum
+        self.count_cum = count_cum
+
+    @property
+    def pids(self):
+        return self.pid_dictionary.decode(self.pid_codes)
+
+    @classmethod
+    def _from_codes(cls, months, pid_codes, users_cum, revenue_cum, count_cum, pid_dictionary):
+        return cls(months, None, users_cum, revenue_cum, count_cum, pid_codes=pid_codes, pid_dictionary=pid_dictionary)
+
+    def recoded(self, pid_dictionary):
+        """同一索引在另一个pid字典中的编码形式（pid列按新编码重新升序排列），字典相同时返回自身"""
+        if pid_dictionary is self.pid_dictionary:
+            return self
+        pid_codes = pid_dictionary.encode_strings(self.pids)
+        order = np.argsort(pid_codes, kind='stable')
+        return ArpuPrefixIndex._from_codes(self.months, pid_codes[order], self.users_cum[:, order],
+                                           self.revenue_cum[:, order], self.count_cum[:, order], pid_dictionary)
+
+    @classmethod
+    def from_frame(cls, arpu_df, pid_dictionary=None):
+        """由逐行ARPU数据构建索引，有效行口径与calculate_arpu_vectorized一致；pid_dictionary缺省时新建独立字典"""
+        pid_dictionary = PidDictionary() if pid_dictionary is None else pid_dictionary
+        users, revenue, valid = _valid_arpu_rows(arpu_df)
+        month_codes, months = pd.factorize(arpu_month_labels(arpu_df).to_numpy()[valid], sort=True)
+        # 网格的pid列按编码升序排列，合并时可直接对编码做searchsorted
+        pid_codes, pid_columns = np.unique(pid_dictionary.encode(arpu_df['pid'][valid]), return_inverse=True)
+
+        shape = (len(months), len(pid_codes))
+        cells = month_codes * len(pid_codes) + pid_columns
+        size = shape[0] * shape[1]
+        def grid_sum(values):
+            # bincount按float64累加，整数列转回原类型，使结果类型与逐行求和一致
+            grid = np.bincount(cells, weights=values, minlength=size).reshape(shape)
+            return grid.astype(values.dtype) if np.issubdtype(values.dtype, np.integer) else grid
+
+        users_grid = grid_sum(users)
+        revenue_grid = grid_sum(revenue)
+        count_grid = np.bincount(cells, minlength=size).reshape(shape)
+
+        def cumulative(grid):
+            return np.vstack([np.zeros((1, shape[1]), dtype=grid.dtype), np.cumsum(grid, axis=0)])
+
+        return cls._from_codes(months, pid_codes, cumulative(users_grid), cumulative(revenue_grid), cumulative(count_grid),
+                               pid_dictionary)
+
+    def _grid(self, cumulative, months, pid_codes):
+        """把累计和还原为逐月网格，并对齐到给定的月份与pid编码（均已排序）"""
+        grid = np.zeros((len(months), len(pid_codes)), dtype=cumulative.dtype)
+        grid[np.ix_(np.searchsorted(months, self.months), np.searchsorted(pid_codes, self.pid_codes))] = np.diff(cumulative, axis=0)
+        return grid
+
+    def upsert_frame(self, new_df, pid_dictionary=None):
+        """以新数据按 (月份, pid) 组覆盖索引，返回新索引
+
+        新数据中出现过的每个 (月份, pid) 组（即使该组全为无效行）整体替换旧聚合，其余单元保持不变；
+        成本与新数据行数及 月份×pid 网格大小成正比，不需要旧的逐行数据。
+        新索引使用pid_dictionary（缺省沿用本索引的字典）；把用户数据合并进管理员索引时应传入独立字典。
+        """
+        base = self.recoded(self.pid_dictionary if pid_dictionary is None else pid_dictionary)
+        return base._upsert_frame(new_df)
+
+    def _upsert_frame(self, new_df):
+        incoming = ArpuPrefixIndex.from_frame(new_df, pid_dictionary=self.pid_dictionary)
+        key_months = arpu_month_labels(new_df).to_numpy(dtype=str)
+        key_pids = self.pid_dictionary.encode(new_df['pid'])
+
+        months = np.union1d(np.union1d(self.months, incoming.months), key_months)
+        pids = np.union1d(np.union1d(self.pid_codes, incoming.pid_codes), key_pids)
+        replaced = np.zeros((len(months), len(pids)), dtype=bool)
+        replaced[np.searchsorted(months, key_months), np.searchsorted(pids, key_pids)] = True
+
+        def merged_cumulative(name):
+            old_cumulative, new_cumulative = getattr(self, name), getattr(incoming, name)
+            dtype = np.result_type(old_cumulative.dtype, new_cumulative.dtype)
+            grid = np.where(replaced, incoming._grid(new_cumulative.astype(dtype), months, pids),
+                            self._grid(old_cumulative.astype(dtype), months, pids))
+            return np.vstack([np.zeros((1, len(pids)), dtype=dtype), np.cumsum(grid, axis=0)])
+
+        return ArpuPrefixIndex._from_codes(months, pids, merged_cumulative('users_cum'),
+                                           merged_cumulative('revenue_cum'), merged_cumulative('count_cum'),
+                                           self.pid_dictionary)
+
+    def add(self, other):
+        """两份索引逐单元相加（用于按块累加同一数据源的各个分块），结果沿用本索引的字典"""
+        other = other.recoded(self.pid_dictionary)
+        months = np.union1d(self.months, other.months)
+        pids = np.union1d(self.pid_codes, other.pid_codes)
+
+        def summed_cumulative(name):
+            dtype = np.result_type(getattr(self, name).dtype, getattr(other, name).dtype)
+            grid = (self._grid(getattr(self, name).astype(dtype), months, pids)
+                    + other._grid(getattr(other, name).astype(dtype), months, pids))
+            return np.vstack([np.zeros((1, len(pids)), dtype=dtype), np.cumsum(grid, axis=0)])
+
+        return ArpuPrefixIndex._from_codes(months, pids, summed_cumulative('users_cum'),
+                                           summed_cumulative('revenue_cum'), summed_cumulative('count_cum'),
+                                           self.pid_dictionary)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """逐块构建索引：每块先折叠为 (月份, pid) 网格再累加，内存只与块大小和网格大小有关；各块共用一个独立字典"""
+        pid_dictionary = PidDictionary()
+        combined = None
+        for chunk in chunks:
+            part = cls.from_frame(chunk, pid_dictionary=pid_dictionary)
+            combined = part if combined is None else combined.add(part)
+        return combined
+
+    def to_arrays(self):
+        """索引的数组形式（用于缓存与落盘，缓存中不直接存放本类实例）"""
+        return {'months': self.months, 'pids': self.pids.astype(str), 'users_cum': self.users_cum,
+                'revenue_cum': self.revenue_cum, 'count_cum': self.count_cum}
+
+    def save(self, path):
+        arrays = self.to_arrays()
+        _atomic_write(path, lambda f: np.savez(f, **arrays))
+
+    @classmethod
+    def load(cls, path, pid_dictionary=None):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files}, pid_dictionary=pid_dictionary)
+
+    def _bounds(self, start_month, end_month):
+        lo = 0 if start_month is None else int(np.searchsorted(self.months, normalize_month_label(start_month), 'left'))
+        hi = len(self.months) if end_month is None else int(np.searchsorted(self.months, normalize_month_label(end_month), 'right'))
+        return lo, max(lo, hi)
+
+    def row_count(self, start_month=None, end_month=None):
+        """区间内的有效记录数"""
+        lo, hi = self._bounds(start_month, end_month)
+        return int((self.count_cum[hi] - self.count_cum[lo]).sum())
+
+    def window_pids(self, start_month=None, end_month=None):
+        """区间内出现过的pid"""
+        lo, hi = self._bounds(start_month, end_month)
+        return list(self.pid_dictionary.decode(self.pid_codes[(self.count_cum[hi] - self.count_cum[lo]) > 0]))
+
+    def window(self, start_month, end_month, channel_mapping):
+        """区间ARPU，结果与对区间内逐行数据调用calculate_arpu_vectorized相同（浮点求和顺序不同带来的末位误差除外）"""
+        try:
+            lo, hi = self._bounds(start_month, end_month)
+            counts = self.count_cum[hi] - self.count_cum[lo]
+            if counts.sum() == 0:
+                return None, "数据清理后无有效记录"
+
+            channel_names, pid_to_channel = _pid_channel_codes(self.pid_codes, channel_mapping, self.pid_dictionary,
+                                                               present=counts > 0)
+            if len(channel_names) == 0:
+                return None, "未找到匹配的渠道数据，请检查渠道映射配置"
+
+            in_channel = pid_to_channel >= 0
+            channel_codes = pid_to_channel[in_channel]
+
+            def fold(values):
+                folded = np.zeros(len(channel_names), dtype=values.dtype)
+                np.add.at(folded, channel_codes, values[in_channel])
+                return folded
+
+            arpu_summary_df = summarize_channel_arpu(
+                channel_names,
+                fold(self.users_cum[hi] - self.users_cum[lo]),
+                fold(self.revenue_cum[hi] - self.revenue_cum[lo]),
+                fold(counts)
+            )
+            return arpu_summary_df, "ARPU计算完成"
+
+        except Exception as e:
+            return None, f"ARPU计算失败：{str(e)}"
+
+    def window_matrix(self, windows, channel_mapping):
+        """多个月份区间的ARPU一次算出：累计和按各区间端点成批取差，再用同一份pid→渠道映射折叠
+
+        windows为 [(标签, 开始月份, 结束月份), ...]。每个区间的数值与window()相同，总体、安卓口径一致；
+        某区间没有某渠道（或不满足总体/安卓的出现条件）时为NaN。
+        返回 DataFrame：行为渠道（渠道、总体、安卓），列为区间标签
+        """
+        labels = [label for label, _, _ in windows]
+        bounds = np.array([self._bounds(start, end) for _, start, end in windows], dtype=np.int64).reshape(-1, 2)
+        lo, hi = bounds[:, 0], bounds[:, 1]
+        present = ((self.count_cum[hi] - self.count_cum[lo]) > 0).any(axis=0)
+        channel_names, pid_to_channel = _pid_channel_codes(self.pid_codes, channel_mapping, self.pid_dictionary,
+                                                           present=present)
+        in_channel = pid_to_channel >= 0
+
+        def fold(cumulative):
+            values = (cumulative[hi] - cumulative[lo])[:, in_channel]
+            folded = np.zeros((len(channel_names), len(windows)), dtype=values.dtype)
+            np.add.at(folded, pid_to_channel[in_channel], values.T)
+            return folded
+
+        users, revenue, counts = fold(self.users_cum), fold(self.revenue_cum), fold(self.count_cum)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            channel_arpu = np.where(users > 0, revenue / np.where(users > 0, users, 1), 0.0)
+            channel_arpu = np.where(counts > 0, channel_arpu, np.nan)
+
+            total_users, total_revenue = users.sum(axis=0), revenue.sum(axis=0)
+            iphone = np.flatnonzero(channel_names == 'iPhone')
+            iphone_users = users[iphone].sum(axis=0)
+            iphone_revenue = revenue[iphone].sum(axis=0)
+            android_users = total_users - iphone_users
+            total_arpu = np.where(total_users > 0, total_revenue / np.where(total_users > 0, total_users, 1), np.nan)
+            android_arpu = np.where(android_users > 0,
+                                    (total_revenue - iphone_revenue) / np.where(android_users > 0, android_users, 1), np.nan)
+
+        rows = np.vstack([channel_arpu, total_arpu[None, :], android_arpu[None, :]])
+        arpu_matrix = pd.DataFrame(rows, index=list(channel_names) + ['总体', '安卓'], columns=labels)
+        return arpu_matrix.dropna(how='all')
+
+def recent_arpu_windows(months, spans):
+    """以最后一个有效月份为终点的“最近N个月”区间列表 [(标签, 开始月份, 结束月份), ...]，span为None表示全部月份"""
+    valid_months = [str(month) for month in months if month not in ('', 'nan', 'NaT')]
+    if not valid_months:
+        return [("全部数据", None, None)]
+    last_month = valid_months[-1]
+    windows = []
+    for span in spans:
+        if span is None:
+            windows.append(("全部月份", valid_months[0], last_month))
+            continue
+        try:
+            start_month = (pd.Period(last_month, freq='M') - (span - 1)).strftime('%Y-%m')
+        except ValueError:
+            start_month = valid_months[0]
+        windows.append((f"最近{span}个月", start_month, last_month))
+    return windows
+
+# 流式读取时只保留ARPU计算需要的列
+ARPU_STREAM_COLUMNS = ['月份', 'stat_date', 'pid', 'instl_user_cnt', 'ad_all_rven_1d_m']
+ARPU_STREAM_CHUNK_ROWS = 200000
+
+def iter_arpu_file_chunks(file_name, file_content, chunk_size=ARPU_STREAM_CHUNK_ROWS):
+    """按块读取ARPU文件（CSV、xlsx/xls首个工作表），每块只保留ARPU_STREAM_COLUMNS中的列
+
+    至少产出一块（可能为空），以便调用方检查表头。
+    """
+    if file_name.lower().endswith('.csv'):
+        yield from pd.read_csv(io.BytesIO(file_content), chunksize=chunk_size,
+                               usecols=lambda column: column in ARPU_STREAM_COLUMNS)
+        return
+
+    if not file_name.lower().endswith('.xlsx'):
+        # 旧版xls无法用openpyxl流式读取，整表读入后再分块
+        full_df = pd.read_excel(io.BytesIO(file_content), usecols=lambda column: column in ARPU_STREAM_COLUMNS)
+        for start in range(0, max(len(full_df), 1), chunk_size):
+            yield full_df.iloc[start:start + chunk_size]
+        return
+
+    workbook = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        keep = [position for position, name in enumerate(header) if name in ARPU_STREAM_COLUMNS]
+        names = [header[position] for position in keep]
+        buffer = []
+        yielded = False
+        for row in rows:
+            buffer.append([row[position] if position < len(row) else None for position in keep])
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=names)
+                buffer = []
+                yielded = True
+        if buffer or not yielded:
+            yield pd.DataFrame(buffer, columns=names)
+    finally:
+        workbook.close()
+
+@instrumented_cache_data("ARPU流式读取", 'ingestion')
+def stream_arpu_file_index(file_name, file_content, chunk_size=ARPU_STREAM_CHUNK_ROWS):
+    """逐块读取上传的ARPU文件并直接折叠为 (月份, pid) 前缀索引，不在内存中保留完整数据
+
+    返回:
+        (索引数组字典或None, 读取的总行数, 首块预览DataFrame, 缺少的必需列列表)
+    """
+    required_cols = ['pid', 'instl_user_cnt', 'ad_all_rven_1d_m']
+    chunks = iter_arpu_file_chunks(file_name, file_content, chunk_size)
+    first_chunk = next(chunks)
+    missing_cols = [col for col in required_cols if col not in first_chunk.columns]
+    if missing_cols:
+        return None, 0, first_chunk.head(10), missing_cols
+
+    total_rows = 0
+
+    def counted(chunk_iter):
+        nonlocal total_rows
+        for chunk in chunk_iter:
+            total_rows += len(chunk)
+            yield chunk
+
+    index = ArpuPrefixIndex.from_chunks(counted(itertools.chain([first_chunk], chunks)))
+    return index.to_arrays(), total_rows, first_chunk.head(10), []
+
+@instrumented_cache_data("ARPU前缀索引", 'arpu-store')
+def build_arpu_prefix_index_arrays(arpu_df):
+    return ArpuPrefixIndex.from_frame(arpu_df).to_arrays()
+
+def build_arpu_prefix_index(arpu_df):
+    """上传数据的前缀索引（按数据内容缓存，只在数据变化时重建）"""
+    return ArpuPrefixIndex(**build_arpu_prefix_index_arrays(arpu_df))
+
+@instrumented_cache_data("管理员ARPU索引读取", 'arpu-store')
+def load_admin_arpu_index_arrays(store_identity, _manifest):
+    """以清单文件身份为缓存键（_manifest不参与哈希），存储被任何进程替换后自然失效"""
+    return load_store_arpu_index(ADMIN_DATA_STORE_DIR, _manifest).to_arrays()
+
+def load_admin_arpu_index():
+    """管理员列式存储对应的前缀索引（写入存储时预先计算），无存储时返回None"""
+    try:
+        migrate_admin_csv_to_store()
+        manifest, identity = read_admin_store_snapshot()
+        if manifest is not None:
+            return ArpuPrefixIndex(**load_admin_arpu_index_arrays(identity, manifest), pid_dictionary=get_pid_dictionary())
+    except Exception as e:
+        st.error(f"加载管理员ARPU索引失败：{str(e)}")
+    return None
+
+def get_builtin_arpu_index():
+    """默认数据（管理员数据优先，否则为示例数据）的前缀索引"""
+    admin_index = load_admin_arpu_index()
+    return admin_index if admin_index is not None else build_arpu_prefix_index(get_sample_arpu_data())
+
+# ==================== LTV结果组装 ====================
+def _stage1_params(fit_params):
+    """报告中单独展示的第一阶段非幂函数模型参数 {模型: 参数}，幂函数参数已由power_params展示"""
+    stage1 = fit_params.get('stage1')
+    if not stage1 or stage1['model'] == "power":
+        return {}
+    return {stage1['model']: stage1['params']}
+
+def assemble_ltv_results(lt_results_2y, lt_results_5y, arpu_data):
+    """按渠道合并2年/5年LT与ARPU，计算LTV = LT × ARPU
+
+    返回:
+        (LTV结果列表, 未找到ARPU数据的渠道列表)，缺少ARPU的渠道按0计
+    """
+    ltv_results = []
+    missing_arpu_sources = []
+
+    for lt_result_5y in lt_results_5y:
+        source = lt_result_5y['data_source']
+
+        # 查找对应的2年LT数据
+        lt_result_2y = next((r for r in lt_results_2y if r['data_source'] == source), None)
+
+        # 查找ARPU数据
+        arpu_row = arpu_data[arpu_data['data_source'] == source]
+        if not arpu_row.empty:
+            arpu_value = arpu_row.iloc[0]['arpu_value']
+        else:
+            arpu_value = 0
+            missing_arpu_sources.append(source)
+
+        ltv_5y = lt_result_5y['lt_value'] * arpu_value
+        ltv_2y = lt_result_2y['lt_value'] * arpu_value if lt_result_2y else 0
+
+        ltv_results.append({
+            'data_source': source,
+            'lt_2y': lt_result_2y['lt_value'] if lt_result_2y else 0,
+            'lt_5y': lt_result_5y['lt_value'],
+            'arpu_value': arpu_value,
+            'ltv_2y': ltv_2y,
+            'ltv_5y': ltv_5y,
+            'fit_success': lt_result_5y['fit_success'],
+            'model_used': lt_result_5y.get('model_used', 'unknown'),
+            'power_params': lt_result_5y.get('fit_params', {}).get('power', {}),
+            'exp_params': lt_result_5y.get('fit_params', {}).get('exponential', {}),
+            'stage1_params': _stage1_params(lt_result_5y.get('fit_params', {}))
+        })
+    return ltv_results, missing_arpu_sources
+
+def build_result_table(results, key='data_source'):
+    """把结果列表（或结果DataFrame）整理为按渠道索引的列式结果表，同一渠道重复时保留第一条（与逐个查找的口径一致）"""
+    table = results if isinstance(results, pd.DataFrame) else pd.DataFrame(list(results or []))
+    if key not in table.columns:
+        return pd.DataFrame(index=pd.Index([], name=key))
+    return table.drop_duplicates(key, keep='first').set_index(key)
+
+def lookup_result_values(results, keys, field='lt_value', key='data_source'):
+    """按keys顺序取结果表中某列的值，缺失的渠道（或结果中没有该列）为None，供图表网格逐个展示"""
+    table = build_result_table(results, key)
+    if field not in table.columns:
+        return [None] * len(keys)
+    return [None if pd.isna(value) else value for value in table[field].reindex(list(keys))]
+
+def format_lt_value(value, digits=2):
+    """LT展示文本，缺失值显示为占位符“—”"""
+    return "—" if value is None or pd.isna(value) else f"{value:.{digits}f}"
+
+def assemble_ltv_table(lt_results_2y, lt_results_5y, arpu_data):
+    """assemble_ltv_results的列式版本：2年LT、ARPU按渠道各做一次连接，LTV为整列相乘
+
+    返回:
+        (LTV结果表，行顺序与lt_results_5y一致, 未找到ARPU数据的渠道列表)，缺少ARPU的渠道按0计
+    """
+    lt_5y_table = pd.DataFrame(list(lt_results_5y or []))
+    if lt_5y_table.empty:
+        return pd.DataFrame(columns=['data_source', 'lt_2y', 'lt_5y', 'arpu_value', 'ltv_2y', 'ltv_5y']), []
+    sources = pd.Index(lt_5y_table['data_source'])
+
+    lt_2y_table = build_result_table(lt_results_2y)
+    has_lt_2y = sources.isin(lt_2y_table.index)
+    lt_2y = lt_2y_table['lt_value'].reindex(sources).to_numpy() if 'lt_value' in lt_2y_table.columns \
+        else np.zeros(len(sources))
+
+    arpu_table = build_result_table(arpu_data)
+    has_arpu = sources.isin(arpu_table.index)
+    arpu_value = np.where(has_arpu, arpu_table['arpu_value'].reindex(sources).to_numpy(), 0) if 'arpu_value' in arpu_table.columns \
+        else np.zeros(len(sources))
+
+    lt_5y = lt_5y_table['lt_value'].to_numpy()
+    ltv_table = pd.DataFrame({
+        'data_source': sources,
+        'lt_2y': np.where(has_lt_2y, lt_2y, 0),
+        'lt_5y': lt_5y,
+        'arpu_value': arpu_value,
+        'ltv_2y': np.where(has_lt_2y, lt_2y * arpu_value, 0),
+        'ltv_5y': lt_5y * arpu_value
+    })
+    return ltv_table, list(sources[~has_arpu])
+
+def assemble_ltv_results_vectorized(lt_results_2y, lt_results_5y, arpu_data):
+    """与assemble_ltv_results输出相同的LTV结果列表，数值列由assemble_ltv_table整列计算"""
+    ltv_table, missing_arpu_sources = assemble_ltv_table(lt_results_2y, lt_results_5y, arpu_data)
+    ltv_results = []
+    for record, lt_result_5y in zip(ltv_table.to_dict('records'), lt_results_5y or []):
+        fit_params = lt_result_5y.get('fit_params', {})
+        record.update({
+            'fit_success': lt_result_5y['fit_success'],
+            'model_used': lt_result_5y.get('model_used', 'unknown'),
+            'power_params': fit_params.get('power', {}),
+            'exp_params': fit_params.get('exponential', {}),
+            'stage1_params': _stage1_params(fit_params)
+        })
+        ltv_results.append(record)
+    return ltv_results, missing_arpu_sources
+
+def compute_ltv_cube(lt_results_by_horizon, arpu_matrix):
+    """渠道 × ARPU区间 × LT年限 的LTV：LT（渠道×年限）与ARPU（渠道×区间）按渠道各连接一次后广播相乘
+
+    lt_results_by_horizon为 {年限: LT结果列表}，渠道取各年限结果中出现的全部渠道（按首次出现顺序）；
+    arpu_matrix为ArpuPrefixIndex.window_matrix的结果。缺少LT或ARPU的组合为NaN（不按0计，便于区分）。
+    返回 DataFrame：行为渠道，列为 (年限, 区间标签) 两级索引；.to_numpy().reshape(渠道数, 年限数, 区间数)即为立方体
+    """
+    horizons = list(lt_results_by_horizon)
+    lt_tables = [build_result_table(lt_results_by_horizon[horizon]) for horizon in horizons]
+    channels = pd.unique(pd.Index([source for table in lt_tables for source in table.index]))
+    lt_values = np.column_stack([
+        table['lt_value'].reindex(channels).to_numpy(dtype=float) if 'lt_value' in table.columns
+        else np.full(len(channels), np.nan)
+        for table in lt_tables
+    ]) if horizons else np.empty((len(channels), 0))
+    arpu_values = arpu_matrix.reindex(channels).to_numpy(dtype=float)
+
+    cube = lt_values[:, :, None] * arpu_values[:, None, :]
+    return pd.DataFrame(
+        cube.reshape(len(channels), -1), index=pd.Index(channels, name='data_source'),
+        columns=pd.MultiIndex.from_product([horizons, list(arpu_matrix.columns)], names=['lt_years', 'arpu_window'])
+    )
+
+# ==================== 数值等价校验 ====================
+def generate_synthetic_corpus(n_cases=5, seed=0):
+    """生成等价校验用的合成输入：逐日留存数据与ARPU明细，包含缺失天数、字符串数值、空值、负值等真实数据中的异常形态
+
+    返回:
+        用例列表，每个用例为 {'name', 'merged_data', 'arpu_df', 'channel_mapping'}
+    """
+    rng = np.random.default_rng(seed)
+    channel_pool = ["华为", "小米", "OPPO", "vivo", "iPhone", "应用宝", "酷派"]
+    reverse_mapping = create_reverse_mapping(DEFAULT_CHANNEL_MAPPING)
+    known_pids = list(reverse_mapping)
+    corpus = []
+    for case_index in range(n_cases):
+        with_quirks = case_index % 2 == 1
+        rows = []
+        for channel in channel_pool[:int(rng.integers(3, len(channel_pool) + 1))]:
+            a, b = rng.uniform(0.2, 0.6), rng.uniform(-0.9, -0.2)
+            missing_days = set(rng.choice(np.arange(2, 31), size=int(rng.integers(0, 6)), replace=False)) if with_quirks else set()
+            for day_of_month in range(1, int(rng.integers(15, 29)) + 1):
+                new_users = int(rng.integers(50, 5000))
+                row = {'数据来源': channel, 'date': f"2025-05-{day_of_month:02d}", '回传新增数': new_users}
+                for day in range(1, 31):
+                    row[str(day)] = np.nan if day in missing_days else int(new_users * a * day ** b * rng.uniform(0.85, 1.15))
+                rows.append(row)
+        merged_data = pd.DataFrame(rows)
+        if with_quirks:
+            merged_data = merged_data.astype({'回传新增数': object, '2': object, '7': object})
+            quirk_rows = rng.choice(len(merged_data), size=min(6, len(merged_data)), replace=False)
+            merged_data.loc[quirk_rows[0], '2'] = f" {merged_data.loc[quirk_rows[0], '2']} "
+            merged_data.loc[quirk_rows[1], '7'] = ''
+            merged_data.loc[quirk_rows[2], '7'] = None
+            merged_data.loc[quirk_rows[3], '回传新增数'] = 0
+            merged_data.loc[quirk_rows[4], '回传新增数'] = 'nan'
+            merged_data.loc[quirk_rows[5], '3'] = -1
+
+        n_arpu = int(rng.integers(200, 2000))
+        pids = rng.choice(known_pids + ['999999', '123456'], size=n_arpu)
+        arpu_df = pd.DataFrame({
+            'pid': pids,
+            'stat_datetime': rng.choice(pd.date_range('2024-01-01', '2025-06-30', freq='MS'), size=n_arpu),
+            'instl_user_cnt': rng.integers(0, 5000, size=n_arpu).astype(float),
+            'ad_all_rven_1d_m': rng.uniform(0, 2000, size=n_arpu)
+        })
+        if with_quirks:
+            arpu_df = arpu_df.astype({'pid': object, 'instl_user_cnt': object})
+            numeric_pids = [i for i, pid in enumerate(pids) if pid.isdigit()][:3]
+            for i in numeric_pids:
+                arpu_df.loc[i, 'pid'] = float(arpu_df.loc[i, 'pid'])
+            arpu_df.loc[3, 'instl_user_cnt'] = 'abc'
+            arpu_df.loc[4, 'ad_all_rven_1d_m'] = -5.0
+        corpus.append({
+            'name': f"synthetic-{seed}-{case_index}{'-quirks' if with_quirks else ''}",
+            'merged_data': merged_data,
+            'arpu_df': arpu_df,
+            'channel_mapping': DEFAULT_CHANNEL_MAPPING
+        })
+    return corpus
+
+def anonymize_merged_data(merged_data, salt="ltv"):
+    """把真实逐日数据脱敏为校验用例：渠道名称替换为哈希标识（保留渠道规则关键字），各渠道计数统一乘以随机系数
+
+    同一渠道内所有计数乘以同一系数，留存率口径不变。
+    """
+    rule_prefix = {"华为": "华为", "小米": "小米", "oppo": "oppo", "vivo": "vivo", "iphone": "iPhone", "其他": "渠道"}
+    anonymized = merged_data.copy()
+    count_cols = [col for col in ['回传新增数'] + [str(day) for day in range(1, 31)] if col in anonymized.columns]
+    names, scales = {}, {}
+    for source in anonymized['数据来源'].unique():
+        digest = hashlib.sha256(f"{salt}|{source}".encode('utf-8')).hexdigest()
+        names[source] = f"{rule_prefix[resolve_channel_rule(str(source))[0]]}-{digest[:8]}"
+        scales[source] = 0.5 + int(digest[8:12], 16) / 0xFFFF
+    row_scale = anonymized['数据来源'].map(scales).to_numpy(dtype=float)
+    for col in count_cols:
+        anonymized[col] = _numeric_column(anonymized[col]) * row_scale
+    anonymized['数据来源'] = anonymized['数据来源'].map(names)
+    return anonymized[['数据来源'] + [col for col in ['date'] + count_cols if col in anonymized.columns]]
+
+def _legacy_lt_records(case):
+    records = []
+    for retention_result in calculate_retention_rates_new_method(case['merged_data']):
+        channel_name = retention_result['data_source']
+        lt_2y = calculate_lt(retention_result, channel_name, 2)
+        lt_5y = calculate_lt(retention_result, channel_name, 5)
+        power = lt_5y['fit_params'].get('power', {})
+        records.append({
+            'data_source': channel_name, 'lt_2y': lt_2y['lt_value'], 'lt_5y': lt_5y['lt_value'],
+            'a': power.get('a', np.nan), 'b': power.get('b', np.nan), 'r2': lt_5y['power_r2']
+        })
+    return records
+
+def _batched_lt_records(case):
+    retention_data = calculate_retention_rates_vectorized(case['merged_data'])
+    if not retention_data:
+        return []
+    _, rates, mask = pad_retention_results(retention_data)
+    rule_names = [resolve_channel_rule(r['data_source'])[0] for r in retention_data]
+    power_params, r2, lt = batch_power_lt(rates, mask, rule_names)
+    return [
+        {'data_source': r['data_source'], 'lt_2y': lt[i, 0], 'lt_5y': lt[i, 1],
+         'a': power_params[i, 0], 'b': power_params[i, 1], 'r2': r2[i]}
+        for i, r in enumerate(retention_data)
+    ]
+
+def _legacy_arpu_records(case):
+    arpu_df, _ = calculate_arpu_optimized(case['arpu_df'].copy(), case['channel_mapping'])
+    return [] if arpu_df is None else arpu_df.to_dict('records')
+
+def _vectorized_arpu_records(case):
+    arpu_df, _ = calculate_arpu_vectorized(case['arpu_df'], case['channel_mapping'])
+    return [] if arpu_df is None else arpu_df.to_dict('records')
+
+def _ltv_inputs(case):
+    """LTV组装校验的输入：每个用例的LT与ARPU结果，隔一个渠道去掉2年LT以覆盖缺失分支"""
+    lt_records = _batched_lt_records(case)
+    lt_results_5y = [
+        {'data_source': r['data_source'], 'lt_value': r['lt_5y'], 'fit_success': True,
+         'fit_params': {'power': {'a': r['a'], 'b': r['b']}}, 'model_used': 'power'}
+        for r in lt_records
+    ]
+    lt_results_2y = [{'data_source': r['data_source'], 'lt_value': r['lt_2y']} for r in lt_records[::2]]
+    arpu_data, _ = calculate_arpu_vectorized(case['arpu_df'], case['channel_mapping'])
+    if arpu_data is None:
+        arpu_data = pd.DataFrame(columns=['data_source', 'arpu_value'])
+    return {'lt_results_2y': lt_results_2y, 'lt_results_5y': lt_results_5y, 'arpu_data': arpu_data}
+
+def _legacy_ltv_records(inputs):
+    return assemble_ltv_results(inputs['lt_results_2y'], inputs['lt_results_5y'], inputs['arpu_data'])[0]
+
+def _vectorized_ltv_records(inputs):
+    return assemble_ltv_results_vectorized(inputs['lt_results_2y'], inputs['lt_results_5y'], inputs['arpu_data'])[0]
+
+def _indexed_arpu_records(case):
+    arpu_df, _ = ArpuPrefixIndex.from_frame(case['arpu_df']).window(None, None, case['channel_mapping'])
+    return [] if arpu_df is None else arpu_df.to_dict('records')
+
+# 等价校验项：legacy为当前线上口径，candidate为加速实现；tolerances为各字段的 (相对容差, 绝对容差)
+# 可选的prepare在计时前把用例转换为两种实现共同的输入
+EQUIVALENCE_CHECKS = {
+    "retention": {
+        "legacy": lambda case: calculate_retention_rates_new_method(case['merged_data']),
+        "candidate": lambda case: calculate_retention_rates_vectorized(case['merged_data']),
+        "key": "data_source",
+        "tolerances": {'days': (0, 0), 'rates': (1e-12, 1e-15), 'avg_new_users': (1e-12, 0)}
+    },
+    "lt": {
+        "legacy": _legacy_lt_records,
+        "candidate": _batched_lt_records,
+        "key": "data_source",
+        "tolerances": {'lt_2y': (1e-6, 0), 'lt_5y': (1e-6, 0), 'a': (1e-5, 1e-9), 'b': (1e-5, 1e-9), 'r2': (0, 1e-8)}
+    },
+    "arpu": {
+        "legacy": _legacy_arpu_records,
+        "candidate": _vectorized_arpu_records,
+        "key": "data_source",
+        "tolerances": {'arpu_value': (1e-12, 0), 'record_count': (0, 0), 'total_users': (1e-12, 0),
+                       'total_revenue': (1e-12, 0)}
+    },
+    "arpu_index": {
+        "legacy": _legacy_arpu_records,
+        "candidate": _indexed_arpu_records,
+        "key": "data_source",
+        "tolerances": {'arpu_value': (1e-12, 0), 'record_count': (0, 0), 'total_users': (1e-12, 0),
+                       'total_revenue': (1e-12, 0)}
+    },
+    "ltv": {
+        "prepare": _ltv_inputs,
+        "legacy": _legacy_ltv_records,
+        "candidate": _vectorized_ltv_records,
+        "key": "data_source",
+        "tolerances": {'lt_2y': (0, 0), 'lt_5y': (0, 0), 'arpu_value': (0, 0), 'ltv_2y': (0, 0), 'ltv_5y': (0, 0)}
+    }
+}
+
+def compare_records(legacy_records, candidate_records, key, tolerances):
+    """逐键逐字段比较两组结果，返回超出容差的违例列表（数组字段逐元素比较，NaN与NaN视为相等）"""
+    legacy_by_key = {record[key]: record for record in legacy_records}
+    candidate_by_key = {record[key]: record for record in candidate_records}
+    violations = []
+    for record_key in sorted(set(legacy_by_key) | set(candidate_by_key), key=str):
+        if record_key not in legacy_by_key or record_key not in candidate_by_key:
+            violations.append({'key': record_key, 'field': key, 'legacy': record_key in legacy_by_key,
+                               'candidate': record_key in candidate_by_key, 'abs_diff': np.nan,
+                               'rel_diff': np.nan, 'tolerance': '键缺失'})
+            continue
+        for field, (rtol, atol) in tolerances.items():
+            legacy_value = np.asarray(legacy_by_key[record_key].get(field, np.nan), dtype=float)
+            candidate_value = np.asarray(candidate_by_key[record_key].get(field, np.nan), dtype=float)
+            if legacy_value.shape != candidate_value.shape:
+                violations.append({'key': record_key, 'field': field, 'legacy': legacy_value.shape,
+                                   'candidate': candidate_value.shape, 'abs_diff': np.nan,
+                                   'rel_diff': np.nan, 'tolerance': '形状不同'})
+                continue
+            with np.errstate(all='ignore'):
+                abs_diff = np.abs(candidate_value - legacy_value)
+                both_nan = np.isnan(legacy_value) & np.isnan(candidate_value)
+                bad = ~both_nan & ~(abs_diff <= atol + rtol * np.abs(legacy_value))
+                rel_diff = abs_diff / np.abs(legacy_value)
+            if bad.any():
+                worst = np.unravel_index(np.argmax(np.where(bad, np.nan_to_num(abs_diff, nan=np.inf), -1)), bad.shape)
+                violations.append({
+                    'key': record_key, 'field': field,
+                    'legacy': float(legacy_value[worst]), 'candidate': float(candidate_value[worst]),
+                    'abs_diff': float(abs_diff[worst]), 'rel_diff': float(rel_diff[worst]),
+                    'tolerance': f"rtol={rtol:g}, atol={atol:g}"
+                })
+    return violations
+
+def run_equivalence_harness(corpus, checks=None):
+    """在用例集上并排运行各校验项的legacy与candidate实现
+
+    返回:
+        (按校验项×用例汇总的DataFrame, 违例明细DataFrame)
+    """
+    checks = checks or [name for name, spec in EQUIVALENCE_CHECKS.items() if spec["candidate"] is not None]
+    summary_rows, violation_rows = [], []
+    for check_name in checks:
+        spec = EQUIVALENCE_CHECKS[check_name]
+        for case in corpus:
+            inputs = spec["prepare"](case) if "prepare" in spec else case
+            start = time.perf_counter()
+            legacy_records = spec["legacy"](inputs)
+            legacy_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            candidate_records = spec["candidate"](inputs)
+            candidate_elapsed = time.perf_counter() - start
+            violations = compare_records(legacy_records, candidate_records, spec["key"], spec["tolerances"])
+            for violation in violations:
+                violation_rows.append({'check': check_name, 'case': case['name'], **violation})
+            summary_rows.append({
+                'check': check_name,
+                'case': case['name'],
+                'records': len(legacy_records),
+                'violations': len(violations),
+                'legacy_ms': legacy_elapsed * 1000,
+                'candidate_ms': candidate_elapsed * 1000,
+                'speedup': legacy_elapsed / candidate_elapsed if candidate_elapsed > 0 else np.nan
+            })
+    violation_columns = ['check', 'case', 'key', 'field', 'legacy', 'candidate', 'abs_diff', 'rel_diff', 'tolerance']
+    return pd.DataFrame(summary_rows), pd.DataFrame(violation_rows, columns=violation_columns)
+
+# ==================== 性能基准 ====================
+BENCHMARK_BASELINE_FILE = "ltv_benchmark_baseline.json"
+
+def _synthetic_retention_counts(rng, dates, as_of):
+    """按幂函数衰减生成逐日新增与1-30天留存数，尚未到达的留存天数为空"""
+    a, b = rng.uniform(0.2, 0.6), rng.uniform(-0.9, -0.2)
+    new_users = rng.integers(200, 8000, size=len(dates))
+    day_numbers = np.arange(1, 31)
+    retain = new_users[:, None] * a * np.power(day_numbers, b)[None, :] * rng.uniform(0.85, 1.15, (len(dates), 30))
+    observed = (dates.values[:, None] + pd.to_timedelta(day_numbers, unit='D').values[None, :]) <= np.datetime64(as_of)
+    return new_users, np.where(observed, np.floor(retain), np.nan)
+
+def generate_ocpx_workbook(month, n_days, rng):
+    """生成OCPX分离式工作簿（监测渠道回传量 + ocpx监测留存数），覆盖截至目标月末的 n_days 天"""
+    month_end = pd.Period(month, freq='M').end_time.normalize()
+    dates = pd.date_range(end=month_end, periods=n_days, freq='D')
+    new_users, retain = _synthetic_retention_counts(rng, dates, month_end + pd.Timedelta(days=1))
+    new_users_sheet = pd.DataFrame({'日期': dates.strftime('%Y-%m-%d'), '回传新增数': new_users})
+    new_users_sheet = pd.concat([new_users_sheet, pd.DataFrame({'日期': ['合计'], '回传新增数': [new_users.sum()]})],
+                                ignore_index=True)
+    retention_sheet = pd.DataFrame(retain, columns=[str(day) for day in range(1, 31)])
+    retention_sheet.insert(0, '留存天数', dates.strftime('%Y-%m-%d'))
+    with io.BytesIO() as buffer:
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            new_users_sheet.to_excel(writer, sheet_name='监测渠道回传量', index=False)
+            retention_sheet.to_excel(writer, sheet_name='ocpx监测留存数', index=False)
+        return buffer.getvalue()
+
+def generate_hue_workbook(month, n_days, rng):
+    """生成hue导出格式工作簿（stat_date、new、new_retain_1...30），覆盖截至目标月末的 n_days 天"""
+    month_end = pd.Period(month, freq='M').end_time.normalize()
+    dates = pd.date_range(end=month_end, periods=n_days, freq='D')
+    new_users, retain = _synthetic_retention_counts(rng, dates, month_end + pd.Timedelta(days=1))
+    hue_sheet = pd.DataFrame(retain, columns=[f'new_retain_{day}' for day in range(1, 31)])
+    hue_sheet.insert(0, 'new', new_users)
+    hue_sheet.insert(0, 'stat_date', dates.strftime('%Y-%m-%d'))
+    with io.BytesIO() as buffer:
+        hue_sheet.to_excel(buffer, index=False, engine='openpyxl')
+        return buffer.getvalue()
+
+def generate_arpu_sheet(n_rows, rng, channel_mapping=None, months=None):
+    """生成ARPU明细（月份、pid、stat_date、instl_user_cnt、ad_all_rven_1d_m），pid取自渠道映射并混入未映射渠道号"""
+    channel_mapping = channel_mapping or DEFAULT_CHANNEL_MAPPING
+    pids = list(create_reverse_mapping(channel_mapping)) + ['999001', '999002']
+    months = months or [str(period) for period in pd.period_range('2024-01', '2025-06', freq='M')]
+    row_months = rng.choice(months, size=n_rows)
+    return pd.DataFrame({
+        '月份': row_months,
+        'pid': rng.choice(pids, size=n_rows),
+        'stat_date': [f"{m}-{day:02d}" for m, day in zip(row_months, rng.integers(1, 29, size=n_rows))],
+        'instl_user_cnt': rng.integers(0, 5000, size=n_rows),
+        'ad_all_rven_1d_m': rng.uniform(0, 3000, size=n_rows).round(2)
+    })
+
+def generate_benchmark_inputs(n_files=10, n_days=45, arpu_rows=20000, hue_fraction=0.5, month="2025-05", seed=0):
+    """按规模参数生成整套基准输入：留存工作簿（每个文件一个渠道，OCPX与hue按比例混合）与ARPU明细"""
+    rng = np.random.default_rng(seed)
+    channel_names = [name for name, pids in DEFAULT_CHANNEL_MAPPING.items() if pids]
+    file_names, file_contents = [], []
+    for i in range(n_files):
+        base_name = channel_names[i % len(channel_names)]
+        file_names.append(f"{base_name}{'' if i < len(channel_names) else i // len(channel_names)}.xlsx")
+        generator = generate_hue_workbook if i < round(n_files * hue_fraction) else generate_ocpx_workbook
+        file_contents.append(generator(month, n_days, rng))
+    return {
+        'config': {'n_files': n_files, 'n_days': n_days, 'arpu_rows': arpu_rows,
+                   'hue_fraction': hue_fraction, 'month': month, 'seed': seed},
+        'file_names': file_names,
+        'file_contents': file_contents,
+        'arpu_df': generate_arpu_sheet(arpu_rows, rng),
+        'month': month
+    }
+
+def _measure_stage(func, repeats, measure_memory):
+    """执行一个阶段：计时取 repeats 次中的最小值，内存峰值在单独一次tracemalloc运行中测量（避免影响计时）"""
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed.append(time.perf_counter() - start)
+    peak_bytes = np.nan
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, min(elapsed), peak_bytes
+
+def run_pipeline_benchmark(inputs, repeats=1, measure_memory=True):
+    """分阶段计时整条流水线：文件整合、留存率、LT拟合、ARPU、LTV组装（均绕过缓存，测量真实计算成本）
+
+    返回:
+        DataFrame，每个阶段一行：耗时、内存峰值、处理行数
+    """
+    rows = []
+
+    def record(stage, func, count_rows):
+        result, elapsed, peak_bytes = _measure_stage(func, repeats, measure_memory)
+        rows.append({'stage': stage, 'elapsed_s': elapsed, 'peak_mb': peak_bytes / 1024 ** 2,
+                     'rows': count_rows(result)})
+        return result
+
+    merged_data = record("ingestion", lambda: integrate_excel_files_cached_with_mapping.__wrapped__(
+        inputs['file_names'], inputs['file_contents'], inputs['month'], DEFAULT_CHANNEL_MAPPING, {}
+    )[0], len)
+    retention_data = record("retention", lambda: calculate_retention_rates_new_method(merged_data), len)
+
+    def fit_all():
+        lt_results = {2: [], 5: []}
+        for retention_result in retention_data:
+            for lt_years in (2, 5):
+                result = calculate_lt(retention_result, retention_result['data_source'], lt_years)
+                lt_results[lt_years].append({
+                    'data_source': retention_result['data_source'], 'lt_value': result['lt_value'],
+                    'fit_success': result['success'], 'fit_params': result['fit_params'],
+                    'power_r2': result['power_r2'], 'stage1_r2': result['stage1_r2'],
+                    'model_used': result['model_used']
+                })
+        return lt_results
+    lt_results = record("lt_fitting", fit_all, lambda result: len(result[5]))
+    arpu_data = record("arpu", lambda: calculate_arpu_vectorized(inputs['arpu_df'], DEFAULT_CHANNEL_MAPPING)[0],
+                       lambda result: 0 if result is None else len(result))
+    record("ltv_assembly", lambda: assemble_ltv_results_vectorized(
+        lt_results[2], lt_results[5], arpu_data if arpu_data is not None else pd.DataFrame(columns=['data_source', 'arpu_value'])
+    )[0], len)
+    return pd.DataFrame(rows)
+
+def _benchmark_config_key(config):
+    return json.dumps(config, sort_keys=True, ensure_ascii=False)
+
+def load_benchmark_baseline():
+    """读取已保存的基准基线 {配置键: {'config', 'stages', 'recorded_at'}}"""
+    try:
+        if os.path.exists(BENCHMARK_BASELINE_FILE):
+            with open(BENCHMARK_BASELINE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        st.warning(f"读取基准基线失败：{str(e)}")
+    return {}
+
+def save_benchmark_baseline(config, result_df):
+    """把本次基准结果保存为该规模配置的基线"""
+    baseline = load_benchmark_baseline()
+    baseline[_benchmark_config_key(config)] = {
+        'config': config,
+        'stages': {row['stage']: {'elapsed_s': row['elapsed_s'], 'peak_mb': row['peak_mb']}
+                   for row in result_df.to_dict('records')},
+        'recorded_at': datetime.datetime.now().isoformat(timespec='seconds')
+    }
+    try:
+        with open(BENCHMARK_BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        return True
+    except Exception as e:
+        st.error(f"保存基准基线失败：{str(e)}")
+        return False
+
+def compare_benchmark_to_baseline(result_df, config, time_tolerance=0.2, memory_tolerance=0.2,
+                                  min_time_delta=0.05, min_memory_delta_mb=1.0):
+    """与同一规模配置的基线对比，耗时或内存峰值超出容差比例的阶段标记为回退
+
+    增量同时需超过 min_time_delta 秒 / min_memory_delta_mb MB，避免毫秒级阶段的计时噪声被误报。
+
+    返回:
+        (带对比列的DataFrame, 基线记录时间)，无基线时返回原结果与None
+    """
+    entry = load_benchmark_baseline().get(_benchmark_config_key(config))
+    if entry is None:
+        return result_df, None
+    compared = result_df.copy()
+    compared['baseline_s'] = compared['stage'].map(lambda stage: entry['stages'].get(stage, {}).get('elapsed_s', np.nan))
+    compared['baseline_mb'] = compared['stage'].map(lambda stage: entry['stages'].get(stage, {}).get('peak_mb', np.nan))
+    compared['time_change'] = compared['elapsed_s'] / compared['baseline_s'] - 1
+    compared['memory_change'] = compared['peak_mb'] / compared['baseline_mb'] - 1
+    time_regression = (compared['time_change'] > time_tolerance) & \
+        (compared['elapsed_s'] - compared['baseline_s'] > min_time_delta)
+    memory_regression = (compared['memory_change'] > memory_tolerance) & \
+        (compared['peak_mb'] - compared['baseline_mb'] > min_memory_delta_mb)
+    compared['regression'] = time_regression | memory_regression
+    return compared, entry['recorded_at']
+
 # ==================== 主应用程序 ====================
 
 # 主标题
@@ -1725,7 +4599,9 @@ session_keys = [
     'lt_results_2y', 'lt_results_5y', 'arpu_data', 'ltv_results', 'current_step',
     'excluded_data', 'excluded_dates_info', 'show_exclusion', 'show_manual_arpu',
     'visualization_data_5y', 'original_data', 'show_custom_mapping',
-    'file_channel_confirmations'
+    'file_channel_confirmations', 'fit_traces', 'stage_sensitivity', 'bootstrap_ci',
+    'cohort_lt', 'backtest_results', 'equivalence_results',
+    'benchmark_results', 'last_stage_timings', 'arpu_index_arrays', 'ltv_cube'
 ]
 for key in session_keys:
     if key not in st.session_state:
@@ -1743,6 +4619,9 @@ if st.session_state.show_manual_arpu is None:
 if st.session_state.show_custom_mapping is None:
     st.session_state.show_custom_mapping = False
 
+# 性能面板的内存峰值开关需在各阶段执行前生效
+pipeline_timer.track_memory = bool(st.session_state.get('timing_track_memory', False))
+
 # ==================== 分析步骤定义 ====================
 ANALYSIS_STEPS = [
     {
@@ -1750,7 +4629,8 @@ ANALYSIS_STEPS = [
         "sub_steps": ["数据上传汇总", "异常剔除", "留存率计算", "LT拟合分析"]
     },
     {"name": "ARPU计算"},
-    {"name": "LTV结果报告"}
+    {"name": "LTV结果报告"},
+    {"name": "性能与校验"}
 ]
 
 # ==================== 侧边栏导航 ====================
@@ -1947,9 +4827,12 @@ if current_page == "LT模型构建":
         if st.button("开始处理数据", type="primary", use_container_width=True, key=process_button_key):
             with st.spinner("正在处理数据文件..."):
                 try:
-                    result = integrate_excel_files_streamlit(
-                        uploaded_files, target_month, st.session_state.channel_mapping, confirmed_mappings
-                    )
+                    with pipeline_timer.stage("数据整合", rows=0) as timing:
+                        result = integrate_excel_files_streamlit(
+                            uploaded_files, target_month, st.session_state.channel_mapping, confirmed_mappings
+                        )
+                        if result[0] is not None:
+                            timing['rows'] = len(result[0])
                     
                     if len(result) == 5:
                         merged_data, processed_count, mapping_warnings, ocpx_success_count, hue_success_count = result
@@ -2037,6 +4920,60 @@ if current_page == "LT模型构建":
                         st.error("未找到有效数据")
                 except Exception as e:
                     st.error(f"处理过程中出现错误：{str(e)}")
+
+        # 多月份回测：同一批文件按历史月份分别整合，只用前若干天拟合并与之后的实际留存对比
+        with st.expander("多月份回测", expanded=False):
+            try:
+                default_backtest_months = ", ".join(
+                    str(period) for period in pd.period_range(end=pd.Period(target_month.strip(), freq='M') - 1,
+                                                              periods=3, freq='M')
+                )
+            except ValueError:
+                default_backtest_months = ""
+            backtest_months_text = st.text_input("回测月份（YYYY-MM，逗号分隔）", value=default_backtest_months,
+                                                 key="backtest_months_input")
+            backtest_fit_days = st.slider("训练窗口（天）", min_value=7, max_value=28, value=14, key="backtest_fit_days",
+                                          help="只用前N天留存拟合，N天之后实际观测到的留存用于评估")
+            backtest_month_list = [m for m in re.split(r'[,，\s]+', backtest_months_text.strip())
+                                   if re.fullmatch(r'\d{4}-\d{2}', m)]
+
+            if st.button("运行回测", key="run_backtest", use_container_width=True):
+                if not backtest_month_list:
+                    st.warning("请输入至少一个 YYYY-MM 格式的月份")
+                else:
+                    with st.spinner("正在整合历史月份并批量拟合..."):
+                        backtest_start = time.perf_counter()
+                        month_data = integrate_excel_files_for_months(
+                            uploaded_files, backtest_month_list, st.session_state.channel_mapping, confirmed_mappings
+                        )
+                        detail_df, rule_df = backtest_months(month_data, fit_days=backtest_fit_days)
+                        st.session_state.backtest_results = {
+                            'detail': detail_df, 'rules': rule_df, 'months': sorted(month_data),
+                            'elapsed': time.perf_counter() - backtest_start
+                        }
+
+            backtest_results = st.session_state.backtest_results
+            if backtest_results is not None:
+                if backtest_results['detail'].empty:
+                    st.info("所选月份没有可回测的渠道数据（训练窗口之后需要有观测天数）")
+                else:
+                    cache_stats = get_lt_fit_cache().stats()
+                    st.caption(f"回测月份：{', '.join(backtest_results['months'])}，耗时 {backtest_results['elapsed']:.2f} 秒；"
+                               f"拟合缓存命中 {cache_stats['hits']} 次")
+                    st.markdown("#### 按渠道规则汇总的误差")
+                    rule_display = backtest_results['rules'].copy()
+                    for col in ['平均MAPE', '末日最大绝对误差']:
+                        rule_display[col] = rule_display[col].map(lambda x: f"{x:.2%}")
+                    for col in ['末日误差中位数', '末日平均偏差']:
+                        rule_display[col] = rule_display[col].map(lambda x: f"{x:+.2%}")
+                    st.dataframe(rule_display, use_container_width=True)
+                    st.download_button(
+                        label="下载回测明细 (CSV)",
+                        data=backtest_results['detail'].to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig'),
+                        file_name=f"LT_Backtest_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                        mime="text/csv",
+                        key="download_backtest"
+                    )
     else:
         st.info("请选择Excel文件开始数据处理")
 
@@ -2078,27 +5015,28 @@ if current_page == "LT模型构建":
                 excluded_dates = []
 
         # 计算剔除结果
-        try:
-            exclusion_mask = pd.Series([True] * len(merged_data), index=merged_data.index)
+        with pipeline_timer.stage("异常数据剔除", rows=len(merged_data)):
+            try:
+                exclusion_mask = pd.Series([True] * len(merged_data), index=merged_data.index)
 
-            if excluded_sources:
-                source_mask = merged_data['数据来源'].isin(excluded_sources)
-                exclusion_mask &= source_mask
+                if excluded_sources:
+                    source_mask = merged_data['数据来源'].isin(excluded_sources)
+                    exclusion_mask &= source_mask
 
-            if 'date' in merged_data.columns and excluded_dates:
-                date_mask = merged_data['date'].isin(excluded_dates)
-                exclusion_mask &= date_mask
+                if 'date' in merged_data.columns and excluded_dates:
+                    date_mask = merged_data['date'].isin(excluded_dates)
+                    exclusion_mask &= date_mask
 
-            if not excluded_sources and not excluded_dates:
-                exclusion_mask = pd.Series([False] * len(merged_data), index=merged_data.index)
+                if not excluded_sources and not excluded_dates:
+                    exclusion_mask = pd.Series([False] * len(merged_data), index=merged_data.index)
 
-            to_exclude = merged_data[exclusion_mask]
-            to_keep = merged_data[~exclusion_mask]
+                to_exclude = merged_data[exclusion_mask]
+                to_keep = merged_data[~exclusion_mask]
 
-        except Exception as e:
-            st.error(f"计算剔除条件时出错: {str(e)}")
-            to_exclude = pd.DataFrame()
-            to_keep = merged_data.copy()
+            except Exception as e:
+                st.error(f"计算剔除条件时出错: {str(e)}")
+                to_exclude = pd.DataFrame()
+                to_keep = merged_data.copy()
 
         col1, col2 = st.columns(2)
         with col1:
@@ -2179,7 +5117,8 @@ if current_page == "LT模型构建":
             if selected_sources:
                 with st.spinner("正在计算留存率..."):
                     filtered_data = working_data[working_data['数据来源'].isin(selected_sources)]
-                    retention_results = calculate_retention_rates_new_method(filtered_data)
+                    with pipeline_timer.stage("留存率计算", rows=len(filtered_data)):
+                        retention_results = calculate_retention_rates_new_method(filtered_data)
                     st.session_state.retention_data = retention_results
 
                     st.success("留存率计算完成！")
@@ -2245,26 +5184,134 @@ if current_page == "LT模型构建":
     if st.session_state.retention_data is not None:
         retention_data = st.session_state.retention_data
 
+        enable_fit_trace = st.checkbox(
+            "记录拟合追踪", value=False, key="enable_fit_trace",
+            help="记录每个渠道各拟合阶段的耗时、求解器评估次数、残差、R²和回退原因，便于排查慢速或失败的渠道"
+        )
+        enable_warm_start = st.checkbox(
+            "使用历史参数热启动", value=False, key="enable_warm_start",
+            help="以该渠道在目标月份之前最近一个月的拟合参数作为求解器初值，并保存本月参数供后续月份使用；"
+                 "开启后拟合结果会受以往保存的参数影响"
+        )
+        solver_profile = st.selectbox(
+            "求解器配置", options=list(SOLVER_PROFILES.keys()), index=0, key="lt_solver_profile",
+            format_func=lambda name: {"default": "默认（scipy默认容差）", "fast": "快速（宽松容差）",
+                                      "accurate": "精确（严格容差）"}.get(name, name),
+            help="控制拟合的收敛容差与最大评估次数，两次拟合均使用解析雅可比"
+        )
+        stage1_selection_mode = st.radio(
+            "第一阶段模型", options=["power", "aic", "bic"], index=0, horizontal=True, key="stage1_selection_mode",
+            format_func=lambda mode: {"power": "幂函数（默认）", "aic": "模型库自动选择（AIC）",
+                                      "bic": "模型库自动选择（BIC）"}[mode],
+            help="模型库包含幂函数、指数、Weibull、对数正态与sBG模型，按信息准则为每个渠道选择1-30天拟合模型"
+        )
+        progressive_lt = st.checkbox(
+            "渐进式显示结果", value=False, key="progressive_lt",
+            help="先用双对数回归与等比数列求和即时给出各渠道近似LT，精确拟合完成后逐个替换并标注状态"
+        )
+        valid_target_month = bool(re.fullmatch(r'\d{4}-\d{2}', str(target_month).strip()))
+
         if st.button("开始LT拟合分析", type="primary", use_container_width=True, key="start_lt_fitting"):
             with st.spinner("正在进行拟合计算..."):
                 lt_results_2y = []
                 lt_results_5y = []
-                visualization_data_2y = {}
                 visualization_data_5y = {}
                 original_data = {}
+                fit_traces = []
+                fit_param_records = []
+                warm_start_summary = {'channels': 0, 'cold_nfev': 0, 'warm_nfev': 0, 'cached': 0, 'other_model': 0}
+                use_warm_start = enable_warm_start and valid_target_month
+                fit_params_store = load_fit_params_store() if use_warm_start else None
                 
                 key_days = [1, 7, 30, 60, 90, 100, 150, 200, 300]
 
-                for retention_result in retention_data:
+                # 模型库：每个候选模型对全部渠道批量拟合一次，再向量化比较信息准则
+                stage1_selection, stage1_scores = {}, None
+                if stage1_selection_mode != "power":
+                    stage1_selection, stage1_scores = select_stage1_models(retention_data,
+                                                                           criterion=stage1_selection_mode)
+
+                fit_cache = get_lt_fit_cache()
+                warm_infos = {
+                    r['data_source']: find_warm_start(fit_params_store, r['data_source'], target_month)
+                    if use_warm_start else None
+                    for r in retention_data
+                }
+
+                def fit_channel(retention_result):
+                    """单个渠道的2年与5年拟合，不调用st.*，可在线程池中执行"""
                     channel_name = retention_result['data_source']
-                    
+                    trace_2y = FitTrace(channel_name, 2) if enable_fit_trace else None
+                    trace_5y = FitTrace(channel_name, 5) if enable_fit_trace else None
+                    warm_info = warm_infos[channel_name]
+                    warm_params = warm_info['params'] if warm_info else None
+
                     # 计算2年LT
-                    lt_result_2y = calculate_lt(retention_result, channel_name, 2, 
-                                                       return_curve_data=True, key_days=key_days)
-                    
+                    lt_result_2y = calculate_lt_cached(retention_result, channel_name, 2,
+                                                       return_curve_data=True, key_days=key_days, trace=trace_2y,
+                                                       warm_start=warm_params, solver_profile=solver_profile,
+                                                       stage1_fit=stage1_selection.get(channel_name), cache=fit_cache)
+
                     # 计算5年LT
-                    lt_result_5y = calculate_lt(retention_result, channel_name, 5, 
-                                                       return_curve_data=True, key_days=key_days)
+                    lt_result_5y = calculate_lt_cached(retention_result, channel_name, 5,
+                                                       return_curve_data=True, key_days=key_days, trace=trace_5y,
+                                                       warm_start=warm_params, solver_profile=solver_profile,
+                                                       stage1_fit=stage1_selection.get(channel_name), cache=fit_cache)
+                    return lt_result_2y, lt_result_5y, trace_2y, trace_5y
+
+                with pipeline_timer.stage("LT拟合", rows=len(retention_data)):
+                    channel_fits = {}
+                    if progressive_lt:
+                        # 渐进模式：先显示闭式近似值，精确拟合在线程池中完成后逐个替换
+                        approximations = approximate_lt(retention_data, stage1_selection=stage1_selection)
+                        progress_placeholder = st.empty()
+
+                        def render_progress():
+                            progress_rows = []
+                            for r in retention_data:
+                                channel_name = r['data_source']
+                                if channel_name in channel_fits:
+                                    lt_2y, lt_5y = channel_fits[channel_name][0]['lt_value'], channel_fits[channel_name][1]['lt_value']
+                                else:
+                                    lt_2y, lt_5y = approximations.get(channel_name, {}).get(2), approximations.get(channel_name, {}).get(5)
+                                progress_rows.append({
+                                    '渠道名称': channel_name,
+                                    '2年LT': round(lt_2y, 2) if lt_2y is not None else None,
+                                    '5年LT': round(lt_5y, 2) if lt_5y is not None else None,
+                                    '状态': '精确' if channel_name in channel_fits else '近似（拟合中）'
+                                })
+                            progress_placeholder.dataframe(pd.DataFrame(progress_rows), use_container_width=True)
+
+                        render_progress()
+                        with ThreadPoolExecutor() as pool:
+                            bound_fit_channel = pipeline_timer.bind(fit_channel)
+                            futures = {pool.submit(bound_fit_channel, r): r['data_source'] for r in retention_data}
+                            for future in as_completed(futures):
+                                channel_fits[futures[future]] = future.result()
+                                render_progress()
+                        progress_placeholder.empty()
+                    else:
+                        for retention_result in retention_data:
+                            channel_fits[retention_result['data_source']] = fit_channel(retention_result)
+
+                for retention_result in retention_data:
+                    channel_name = retention_result['data_source']
+                    lt_result_2y, lt_result_5y, trace_2y, trace_5y = channel_fits[channel_name]
+                    warm_info = warm_infos[channel_name]
+                    if enable_fit_trace:
+                        fit_traces.extend([trace_2y, trace_5y])
+                    if use_warm_start:
+                        fit_param_records.append(build_fit_params_record(channel_name, target_month, lt_result_5y, warm_info))
+                        if warm_info and lt_result_5y.get('cache_hit'):
+                            # 命中缓存的渠道本次没有执行求解，不计入节省次数
+                            warm_start_summary['cached'] += 1
+                        elif warm_info and 'power' not in lt_result_5y['fit_params']:
+                            # 第一阶段采用其他模型的渠道没有执行幂函数求解，与冷启动参考不可比
+                            warm_start_summary['other_model'] += 1
+                        elif warm_info:
+                            warm_start_summary['channels'] += 1
+                            warm_start_summary['cold_nfev'] += warm_info['cold_nfev']
+                            warm_start_summary['warm_nfev'] += sum(n for n in lt_result_5y['nfev'].values() if n)
 
                     lt_results_2y.append({
                         'data_source': channel_name,
@@ -2272,6 +5319,7 @@ if current_page == "LT模型构建":
                         'fit_success': lt_result_2y['success'],
                         'fit_params': lt_result_2y['fit_params'],
                         'power_r2': lt_result_2y['power_r2'],
+                        'stage1_r2': lt_result_2y['stage1_r2'],
                         'model_used': lt_result_2y['model_used']
                     })
                     
@@ -2281,19 +5329,13 @@ if current_page == "LT模型构建":
                         'fit_success': lt_result_5y['success'],
                         'fit_params': lt_result_5y['fit_params'],
                         'power_r2': lt_result_5y['power_r2'],
+                        'stage1_r2': lt_result_5y['stage1_r2'],
                         'model_used': lt_result_5y['model_used']
                     })
 
-                    # 保存可视化数据
-                    visualization_data_2y[channel_name] = {
-                        "days": lt_result_2y['curve_days'],
-                        "rates": lt_result_2y['curve_rates'],
-                        "lt": lt_result_2y['lt_value']
-                    }
-                    
+                    # 保存可视化数据（惰性曲线对象，只保存拟合参数）
                     visualization_data_5y[channel_name] = {
-                        "days": lt_result_5y['curve_days'],
-                        "rates": lt_result_5y['curve_rates'],
+                        "curve": lt_result_5y['curve'],
                         "lt": lt_result_5y['lt_value']
                     }
 
@@ -2307,7 +5349,37 @@ if current_page == "LT模型构建":
                 st.session_state.lt_results_5y = lt_results_5y
                 st.session_state.visualization_data_5y = visualization_data_5y
                 st.session_state.original_data = original_data
+                st.session_state.fit_traces = fit_traces if enable_fit_trace else None
                 st.success("LT拟合分析完成！")
+                if use_warm_start:
+                    save_fit_params(fit_param_records, target_month)
+                    if warm_start_summary['channels'] > 0:
+                        saved_nfev = warm_start_summary['cold_nfev'] - warm_start_summary['warm_nfev']
+                        st.caption(f"热启动：{warm_start_summary['channels']} 个渠道使用历史参数，"
+                                   f"求解器评估 {warm_start_summary['warm_nfev']} 次（冷启动参考 {warm_start_summary['cold_nfev']} 次），"
+                                   f"节省 {saved_nfev} 次"
+                                   + (f"；另有 {warm_start_summary['cached']} 个渠道命中拟合缓存，未计入"
+                                      if warm_start_summary['cached'] > 0 else "")
+                                   + (f"；{warm_start_summary['other_model']} 个渠道第一阶段采用其他模型，未计入"
+                                      if warm_start_summary['other_model'] > 0 else ""))
+                    elif warm_start_summary['cached'] > 0 or warm_start_summary['other_model'] > 0:
+                        st.caption("热启动：" + "；".join(
+                            text for count, text in [
+                                (warm_start_summary['cached'], f"{warm_start_summary['cached']} 个渠道命中拟合缓存，本次未重新拟合"),
+                                (warm_start_summary['other_model'], f"{warm_start_summary['other_model']} 个渠道第一阶段采用其他模型，未使用幂函数历史参数")
+                            ] if count > 0
+                        ))
+                    else:
+                        st.caption(f"热启动：{target_month} 之前无历史参数，本次为冷启动，参数已保存供后续月份使用")
+                elif enable_warm_start:
+                    st.caption("目标月份格式不是 YYYY-MM，本次未使用热启动")
+                cache_stats = get_lt_fit_cache().stats()
+                st.caption(f"拟合缓存：命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，"
+                           f"命中率 {cache_stats['hit_rate']:.1%}，当前缓存 {cache_stats['size']}/{cache_stats['maxsize']} 条")
+                if stage1_scores is not None and not stage1_scores.empty:
+                    with st.expander(f"第一阶段模型选择（{stage1_selection_mode.upper()}，越小越好）", expanded=False):
+                        st.dataframe(stage1_scores.round(2), use_container_width=True)
+                        st.caption("最优模型为幂函数的渠道沿用原有幂函数拟合流程")
 
                 # 显示LT值表格
                 if lt_results_5y:
@@ -2321,7 +5393,7 @@ if current_page == "LT模型构建":
                             {
                                 '渠道名称': r['data_source'],
                                 '2年LT': round(r['lt_value'], 2),
-                                'R²得分': round(r['power_r2'], 3)
+                                'R²得分': round(r['stage1_r2'], 3)
                             }
                             for r in lt_results_2y
                         ])
@@ -2333,7 +5405,7 @@ if current_page == "LT模型构建":
                             {
                                 '渠道名称': r['data_source'],
                                 '5年LT': round(r['lt_value'], 2),
-                                'R²得分': round(r['power_r2'], 3)
+                                'R²得分': round(r['stage1_r2'], 3)
                             }
                             for r in lt_results_5y
                         ])
@@ -2345,6 +5417,8 @@ if current_page == "LT模型构建":
                     
                     # 按5年LT值排序
                     sorted_channels = sorted(visualization_data_5y.items(), key=lambda x: x[1]['lt'])
+                    # 对应的2年LT值按渠道一次性连接（缺失为None）
+                    lt_2y_values = lookup_result_values(lt_results_2y, [name for name, _ in sorted_channels])
                     
                     # 每行显示2个图表
                     for i in range(0, len(sorted_channels), 2):
@@ -2352,13 +5426,7 @@ if current_page == "LT模型构建":
                         for j, col in enumerate(cols):
                             if i + j < len(sorted_channels):
                                 channel_name, curve_data_5y = sorted_channels[i + j]
-                                
-                                # 找到对应的2年LT值
-                                lt_2y_value = None
-                                for result_2y in lt_results_2y:
-                                    if result_2y['data_source'] == channel_name:
-                                        lt_2y_value = result_2y['lt_value']
-                                        break
+                                lt_2y_value = lt_2y_values[i + j]
                                 
                                 with col:
                                     # 显示渠道名称
@@ -2372,12 +5440,13 @@ if current_page == "LT模型构建":
                                     """, unsafe_allow_html=True)
                                     
                                     # 显示图表
-                                    fig = create_individual_channel_chart(
-                                        channel_name, curve_data_5y, original_data, max_days=100,
-                                        lt_2y=lt_2y_value, lt_5y=curve_data_5y['lt']
-                                    )
-                                    st.pyplot(fig, use_container_width=True)
-                                    plt.close(fig)
+                                    with pipeline_timer.stage("图表渲染", rows=1):
+                                        fig = create_individual_channel_chart(
+                                            channel_name, curve_data_5y, original_data, max_days=100,
+                                            lt_2y=lt_2y_value, lt_5y=curve_data_5y['lt']
+                                        )
+                                        st.pyplot(fig, use_container_width=True)
+                                        plt.close(fig)
                                     
                                     # 显示2年和5年LT值
                                     col_2y, col_5y = st.columns(2)
@@ -2387,7 +5456,7 @@ if current_page == "LT模型构建":
                                                    background: rgba(34, 197, 94, 0.1);
                                                    border-radius: 4px; margin: 0.2rem 0;
                                                    color: #16a34a; font-size: 0.9rem; font-weight: 600;">
-                                            2年LT: {lt_2y_value:.2f}
+                                            2年LT: {format_lt_value(lt_2y_value)}
                                         </div>
                                         """, unsafe_allow_html=True)
                                     with col_5y:
@@ -2399,6 +5468,161 @@ if current_page == "LT模型构建":
                                             5年LT: {curve_data_5y['lt']:.2f}
                                         </div>
                                         """, unsafe_allow_html=True)
+
+        # 任意天数的累积LT表：基于各渠道5年曲线的前缀和索引一次性查询
+        if st.session_state.visualization_data_5y:
+            with st.expander("累积LT回本天数表", expanded=False):
+                payback_days_text = st.text_input(
+                    "查询天数（逗号分隔）", value="1, 7, 30, 60, 90, 100, 150, 200, 300",
+                    key="payback_days_input"
+                )
+                try:
+                    payback_days = [int(day) for day in re.split(r'[,，\s]+', payback_days_text.strip()) if day]
+                except ValueError:
+                    payback_days = []
+                    st.error("请输入整数天数，例如：7, 30, 90")
+
+                if payback_days:
+                    curves = {
+                        channel: vis['curve'] for channel, vis in st.session_state.visualization_data_5y.items()
+                    }
+                    cumulative_df = cumulative_lt_matrix(curves, payback_days).round(4)
+                    cumulative_df.columns = [f"第{day}天" for day in cumulative_df.columns]
+                    cumulative_df.index.name = '渠道名称'
+                    st.dataframe(cumulative_df, use_container_width=True)
+
+        # 阶段划分敏感性：一次批量计算整个网格，滑块只在结果立方体中取值
+        if st.session_state.lt_results_5y:
+            with st.expander("阶段划分敏感性分析", expanded=False):
+                col1, col2 = st.columns(2)
+                with col1:
+                    stage_2_end_range = st.slider("第二阶段终点范围（天）", min_value=60, max_value=360,
+                                                  value=(60, 300), step=10, key="sensitivity_stage_2_range")
+                    stage_2_end_step = st.number_input("终点步长（天）", min_value=5, max_value=60, value=10,
+                                                       step=5, key="sensitivity_stage_2_step")
+                with col2:
+                    base_window_options = st.multiselect("第三阶段基准窗口长度（天）", options=[30, 60, 100, 150, 200],
+                                                         default=[60, 100, 150], key="sensitivity_base_windows")
+
+                if st.button("计算敏感性网格", key="calc_stage_sensitivity", use_container_width=True):
+                    stage1_params = {
+                        r['data_source']: (r['fit_params']['stage1']['model'],
+                                           tuple(r['fit_params']['stage1']['params'].values()))
+                        for r in st.session_state.lt_results_5y
+                        if r['fit_success'] and 'stage1' in r['fit_params']
+                    }
+                    stage_2_ends = list(range(stage_2_end_range[0], stage_2_end_range[1] + 1, int(stage_2_end_step)))
+                    # 当前各渠道规则的终点也放入网格，便于对照
+                    stage_2_ends += [rule['stage_2'][1] for rule in CHANNEL_RULES.values()]
+                    if stage1_params and base_window_options:
+                        with st.spinner("正在批量计算敏感性网格..."):
+                            st.session_state.stage_sensitivity = compute_stage_sensitivity_cube(
+                                stage1_params, sorted(set(stage_2_ends)), base_window_options
+                            )
+                    else:
+                        st.warning("没有可用的第一阶段拟合结果或未选择基准窗口")
+
+                cube = st.session_state.stage_sensitivity
+                if cube is not None:
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        selected_end = st.select_slider("第二阶段终点", options=cube['stage_2_ends'],
+                                                        value=cube['stage_2_ends'][len(cube['stage_2_ends']) // 2],
+                                                        key="sensitivity_selected_end")
+                    with col2:
+                        selected_window = st.select_slider("第三阶段基准窗口", options=cube['base_windows'],
+                                                           key="sensitivity_selected_window")
+                    with col3:
+                        selected_horizon = st.radio("LT年限", options=cube['horizons'], index=len(cube['horizons']) - 1,
+                                                    format_func=lambda y: f"{y}年", horizontal=True,
+                                                    key="sensitivity_selected_horizon")
+
+                    end_idx = cube['stage_2_ends'].index(selected_end)
+                    window_idx = cube['base_windows'].index(selected_window)
+                    horizon_idx = cube['horizons'].index(selected_horizon)
+                    current_results = st.session_state.lt_results_5y if selected_horizon == 5 else st.session_state.lt_results_2y
+                    current_lt = {r['data_source']: r['lt_value'] for r in current_results}
+
+                    sensitivity_df = pd.DataFrame({
+                        '渠道名称': cube['channels'],
+                        '当前规则LT': [current_lt.get(ch, np.nan) for ch in cube['channels']],
+                        '网格LT': cube['lt'][:, end_idx, window_idx, horizon_idx]
+                    })
+                    sensitivity_df['差异'] = (sensitivity_df['网格LT'] / sensitivity_df['当前规则LT'] - 1).map(
+                        lambda x: f"{x:+.2%}" if pd.notna(x) else "-"
+                    )
+                    sensitivity_df['当前规则LT'] = sensitivity_df['当前规则LT'].round(2)
+                    sensitivity_df['网格LT'] = sensitivity_df['网格LT'].round(2)
+                    st.dataframe(sensitivity_df, use_container_width=True)
+
+        # 求解器配置基准：各配置在所有渠道规则下的评估次数与耗时
+        with st.expander("求解器配置基准", expanded=False):
+            st.caption("对当前留存数据按每条渠道规则分别拟合，比较各求解器配置的评估次数、耗时和相对精确配置的LT偏差")
+            if st.button("运行求解器基准", key="run_solver_benchmark", use_container_width=True):
+                with st.spinner("正在运行求解器基准..."):
+                    _, benchmark_summary = benchmark_solver_profiles(retention_data)
+                if benchmark_summary.empty:
+                    st.info("无可用的留存数据")
+                else:
+                    benchmark_summary['平均耗时(ms)'] = benchmark_summary['平均耗时(ms)'].round(3)
+                    benchmark_summary['最大LT偏差'] = benchmark_summary['最大LT偏差'].map(lambda x: f"{x:.2e}")
+                    st.dataframe(benchmark_summary, use_container_width=True)
+
+        # 按安装日期分组拟合：每个 (渠道, 日期) 队列单独拟合，观察月内LT漂移
+        with st.expander("按安装日期分组的LT分布", expanded=False):
+            working_data = st.session_state.cleaned_data if st.session_state.cleaned_data is not None \
+                else st.session_state.merged_data
+            if working_data is None or 'date' not in working_data.columns:
+                st.info("需要包含日期字段的逐日数据")
+            else:
+                if st.button("按日期分组拟合", key="run_cohort_lt", use_container_width=True):
+                    retention_sources = [r['data_source'] for r in retention_data]
+                    with st.spinner("正在批量拟合各日期队列..."):
+                        cohort_start = time.perf_counter()
+                        cohort_df, distribution_df = fit_cohort_lt(
+                            working_data[working_data['数据来源'].isin(retention_sources)]
+                        )
+                        st.session_state.cohort_lt = {
+                            'cohorts': cohort_df, 'distribution': distribution_df,
+                            'elapsed': time.perf_counter() - cohort_start
+                        }
+
+                cohort_lt = st.session_state.cohort_lt
+                if cohort_lt is not None:
+                    st.caption(f"共 {len(cohort_lt['cohorts'])} 个日期队列，耗时 {cohort_lt['elapsed']:.2f} 秒；"
+                               f"下表为各渠道5年LT分布")
+                    st.dataframe(cohort_lt['distribution'].round(2), use_container_width=True)
+                    st.download_button(
+                        label="下载各日期队列拟合结果 (CSV)",
+                        data=cohort_lt['cohorts'].to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig'),
+                        file_name=f"LT_Cohorts_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                        mime="text/csv",
+                        key="download_cohort_lt"
+                    )
+
+        # 拟合追踪：展示慢速或失败的渠道，并支持导出JSON Lines
+        if st.session_state.fit_traces:
+            fit_traces = st.session_state.fit_traces
+            with st.expander("拟合追踪（慢速或失败渠道）", expanded=False):
+                slow_threshold_ms = st.number_input(
+                    "慢速阈值（毫秒）", min_value=0.0, value=50.0, step=10.0, key="fit_trace_slow_ms"
+                )
+                show_all_traces = st.checkbox("显示全部渠道", value=False, key="fit_trace_show_all")
+                trace_df = summarize_fit_traces(
+                    fit_traces, slow_threshold=slow_threshold_ms / 1000, only_problems=not show_all_traces
+                )
+                if trace_df.empty:
+                    st.success("所有渠道拟合均未超过慢速阈值且无回退")
+                else:
+                    st.dataframe(trace_df, use_container_width=True)
+
+                st.download_button(
+                    label="下载拟合追踪 (JSONL)",
+                    data=fit_traces_to_jsonl(fit_traces).encode('utf-8'),
+                    file_name=f"LT_Fit_Trace_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.jsonl",
+                    mime="application/json",
+                    key="download_fit_trace"
+                )
     else:
         st.info("请先完成留存率计算")
         st.markdown("""
@@ -2446,6 +5670,9 @@ elif current_page == "ARPU计算":
     if 'data_source_option' not in locals():
         data_source_option = "使用默认数据 + 上传新数据(2025.5+)"
 
+    # 默认数据直接使用存储中预先计算的前缀索引；上传数据在下方按内容构建索引
+    arpu_index = None
+
     if data_source_option == "管理员模式：管理默认ARPU数据":
         # 管理员模式：管理默认ARPU数据
         st.markdown("""
@@ -2466,9 +5693,8 @@ elif current_page == "ARPU计算":
         uploaded_admin_data = load_admin_default_arpu_data()
         
         # 管理员模式下的ARPU计算
-        admin_data = load_admin_data_from_file()
-        if admin_data is not None:
-            arpu_df = admin_data
+        if read_admin_store_manifest() is not None:
+            arpu_index = load_admin_arpu_index()
             process_arpu_calculation = True
             st.info("将使用管理员上传的默认ARPU数据进行计算")
         else:
@@ -2491,19 +5717,23 @@ elif current_page == "ARPU计算":
         </div>
         """, unsafe_allow_html=True)
         
-        # 显示默认数据信息
-        builtin_df = get_builtin_arpu_data()
-        
-        admin_data = load_admin_data_from_file()
-        if admin_data is not None:
-            st.info(f"使用管理员设置的默认数据：{len(builtin_df):,} 条记录，覆盖 {builtin_df['月份'].nunique()} 个月份")
+        # 显示默认数据信息（管理员数据的统计取自存储清单）
+        migrate_admin_csv_to_store()
+        store_manifest = read_admin_store_manifest()
+        if store_manifest is not None:
+            builtin_months = [partition['month'] for partition in store_manifest['partitions']]
+            st.info(f"使用管理员设置的默认数据：{store_manifest['total_rows']:,} 条记录，覆盖 {len(builtin_months)} 个月份")
         else:
-            st.info(f"使用系统示例数据：{len(builtin_df):,} 条记录，覆盖 {builtin_df['月份'].nunique()} 个月份")
+            sample_df = get_sample_arpu_data()
+            builtin_months = sorted(sample_df['月份'].astype(str).map(normalize_month_label).unique())
+            st.info(f"使用系统示例数据：{len(sample_df):,} 条记录，覆盖 {sample_df['月份'].nunique()} 个月份")
         
-        # 显示默认数据预览
+        # 显示默认数据预览（只读取最早一个月份）
         with st.expander("查看默认数据预览", expanded=False):
-            preview_builtin = optimize_dataframe_for_preview(builtin_df, max_rows=10)
-            st.dataframe(preview_builtin, use_container_width=True)
+            if builtin_months:
+                preview_builtin = optimize_dataframe_for_preview(
+                    get_builtin_arpu_data(builtin_months[0], builtin_months[0]), max_rows=10)
+                st.dataframe(preview_builtin, use_container_width=True)
         
         # 上传新数据文件
         new_arpu_file = st.file_uploader(
@@ -2515,17 +5745,19 @@ elif current_page == "ARPU计算":
         if new_arpu_file:
             try:
                 file_content = new_arpu_file.read()
-                combined_df, message = load_user_arpu_data_after_april(file_content, builtin_df)
-                if combined_df is not None:
+                user_arpu_df, message = load_user_arpu_data_after_april(file_content)
+                if user_arpu_df is not None:
                     st.success(message)
-                    st.info(f"合并后数据包含 {len(combined_df):,} 条记录")
                     
-                    # 显示合并后数据预览
-                    preview_combined = optimize_dataframe_for_preview(combined_df, max_rows=10)
-                    st.dataframe(preview_combined, use_container_width=True)
+                    # 按 (月份, pid) 组覆盖默认数据的前缀索引，成本只与新数据行数有关
+                    with pipeline_timer.stage("ARPU增量合并", rows=len(user_arpu_df)):
+                        arpu_index = get_builtin_arpu_index().upsert_frame(user_arpu_df, pid_dictionary=PidDictionary())
+                    st.info(f"合并后数据包含 {arpu_index.row_count():,} 条有效记录")
+                    
+                    # 显示新数据预览
+                    preview_user = optimize_dataframe_for_preview(user_arpu_df, max_rows=10)
+                    st.dataframe(preview_user, use_container_width=True)
                     
-                    # 使用合并后的数据进行ARPU计算
-                    arpu_df = combined_df
                     process_arpu_calculation = True
                 else:
                     st.error(message)
@@ -2536,7 +5768,7 @@ elif current_page == "ARPU计算":
         else:
             # 只使用默认数据
             st.info("未上传新数据，将仅使用默认数据计算ARPU")
-            arpu_df = builtin_df
+            arpu_index = get_builtin_arpu_index()
             process_arpu_calculation = True
     
     else:
@@ -2561,26 +5793,23 @@ elif current_page == "ARPU计算":
 
         if arpu_file:
             try:
+                # 分块读取并直接折叠为 (月份, pid) 聚合，峰值内存由块大小决定
                 with st.spinner("正在读取ARPU文件..."):
-                    if arpu_file.name.endswith('.csv'):
-                        arpu_df = pd.read_csv(arpu_file)
-                    else:
-                        file_content = arpu_file.read()
-                        arpu_df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
+                    index_arrays, total_rows, preview_arpu, missing_cols = stream_arpu_file_index(
+                        arpu_file.name, arpu_file.getvalue()
+                    )
                 st.success("ARPU文件上传成功！")
                 
                 # 检查必需列
-                required_cols = ['pid', 'instl_user_cnt', 'ad_all_rven_1d_m']
-                missing_cols = [col for col in required_cols if col not in arpu_df.columns]
-                
                 if missing_cols:
                     st.error(f"文件缺少必需列: {', '.join(missing_cols)}")
-                    st.info("可用列: " + ", ".join(arpu_df.columns.tolist()))
+                    st.info("可用列: " + ", ".join(str(col) for col in preview_arpu.columns))
                     process_arpu_calculation = False
                 else:
-                    # 显示数据预览
-                    preview_arpu = optimize_dataframe_for_preview(arpu_df, max_rows=10)
+                    # 显示数据预览（首个数据块的前几行）
+                    st.caption(f"共读取 {total_rows:,} 行")
                     st.dataframe(preview_arpu, use_container_width=True)
+                    arpu_index = ArpuPrefixIndex(**index_arrays)
                     process_arpu_calculation = True
                     
             except Exception as e:
@@ -2590,54 +5819,25 @@ elif current_page == "ARPU计算":
             st.info("请上传ARPU数据文件")
             process_arpu_calculation = False
 
-    # 统一的ARPU计算处理 - 优化版本
-    if process_arpu_calculation and 'arpu_df' in locals():
-        # 月份筛选 - 优先使用月份列，其次使用stat_date列
+    # 统一的ARPU计算处理 - 基于前缀聚合索引，任意月份区间都只需两行累计和相减
+    if process_arpu_calculation and arpu_index is None and 'arpu_df' in locals():
+        with pipeline_timer.stage("ARPU索引构建", rows=len(arpu_df)):
+            arpu_index = build_arpu_prefix_index(arpu_df)
+
+    if process_arpu_calculation and arpu_index is not None:
+        # 月份筛选 - 月份取自索引（优先月份列，其次stat_date列）
         st.subheader("月份筛选")
         
-        if '月份' in arpu_df.columns:
-            # 使用月份列
-            try:
-                available_months = sorted(arpu_df['月份'].dropna().unique())
-                available_months = [str(m) for m in available_months]
-                
-                if available_months:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        start_month = st.selectbox("开始月份", options=available_months)
-                    with col2:
-                        end_month = st.selectbox("结束月份", options=available_months, 
-                                               index=len(available_months)-1)
-                else:
-                    st.warning("月份列无有效数据，将使用所有数据")
-                    start_month = end_month = None
-            except Exception as e:
-                st.warning(f"处理月份列时出错：{str(e)}，将使用所有数据")
-                start_month = end_month = None
-                
-        elif 'stat_date' in arpu_df.columns:
-            # 使用stat_date列
-            try:
-                arpu_df['stat_date'] = pd.to_datetime(arpu_df['stat_date'], errors='coerce')
-                arpu_df['month'] = arpu_df['stat_date'].dt.to_period('M')
-                available_months = arpu_df['month'].dropna().unique()
-                available_months = sorted([str(m) for m in available_months])
-                
-                if available_months:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        start_month = st.selectbox("开始月份", options=available_months)
-                    with col2:
-                        end_month = st.selectbox("结束月份", options=available_months, 
-                                               index=len(available_months)-1)
-                else:
-                    st.warning("无法解析stat_date数据，将使用所有数据")
-                    start_month = end_month = None
-            except Exception as e:
-                st.warning(f"处理stat_date列时出错：{str(e)}，将使用所有数据")
-                start_month = end_month = None
+        available_months = [m for m in arpu_index.months if m not in ('', 'nan', 'NaT')]
+        if available_months:
+            col1, col2 = st.columns(2)
+            with col1:
+                start_month = st.selectbox("开始月份", options=available_months)
+            with col2:
+                end_month = st.selectbox("结束月份", options=available_months, 
+                                       index=len(available_months)-1)
         else:
-            st.info("未找到月份或stat_date列，将使用所有数据")
+            st.info("未找到月份或stat_date信息，将使用所有数据")
             start_month = end_month = None
 
         if st.button("计算ARPU", type="primary", use_container_width=True):
@@ -2645,30 +5845,26 @@ elif current_page == "ARPU计算":
                 try:
                     # 月份筛选
                     if start_month and end_month:
-                        if '月份' in arpu_df.columns:
-                            # 确保月份格式一致
-                            arpu_df['月份_std'] = arpu_df['月份'].astype(str).apply(lambda x: x[:7] if len(str(x)) >= 7 else str(x))
-                            mask = (arpu_df['月份_std'] >= start_month) & (arpu_df['月份_std'] <= end_month)
-                        else:
-                            mask = (arpu_df['month'].astype(str) >= start_month) & (arpu_df['month'].astype(str) <= end_month)
-                        filtered_arpu_df = arpu_df[mask].copy()
                         st.info(f"筛选月份: {start_month} 至 {end_month}")
                     else:
-                        filtered_arpu_df = arpu_df.copy()
                         st.info("使用全部数据")
 
-                    if len(filtered_arpu_df) == 0:
+                    window_rows = arpu_index.row_count(start_month, end_month)
+                    if window_rows == 0:
                         st.error("筛选后无数据，请检查月份筛选条件")
                     else:
-                        # 使用优化的ARPU计算函数
-                        result_df, message = calculate_arpu_optimized(
-                            filtered_arpu_df, 
-                            st.session_state.channel_mapping, 
-                            batch_size=1000
-                        )
+                        # 区间ARPU直接由索引得到，不再筛选逐行数据
+                        with pipeline_timer.stage("ARPU计算", rows=window_rows):
+                            result_df, message = arpu_index.window(
+                                start_month, end_month,
+                                st.session_state.channel_mapping
+                            )
                         
                         if result_df is not None:
                             st.session_state.arpu_data = result_df
+                            # 保留索引供LTV报告做多区间对比
+                            st.session_state.arpu_index_arrays = arpu_index.to_arrays()
+                            st.session_state.ltv_cube = None
                             st.success(message)
                             
                             # 显示结果 - 增强显示信息
@@ -2694,7 +5890,7 @@ elif current_page == "ARPU计算":
                             st.error(message)
                             
                             # 显示未匹配的pid
-                            unmatched_pids = sorted(filtered_arpu_df['pid'].unique())
+                            unmatched_pids = sorted(arpu_index.window_pids(start_month, end_month))
                             st.info(f"数据中的渠道号：{', '.join(unmatched_pids[:10])}{'...' if len(unmatched_pids) > 10 else ''}")
 
                 except Exception as e:
@@ -2729,6 +5925,9 @@ elif current_page == "ARPU计算":
                     for source, value in arpu_inputs.items()
                 ])
                 st.session_state.arpu_data = arpu_df_manual
+                # 手动ARPU没有月份明细，之前按月份计算的索引与多区间结果不再对应当前ARPU
+                st.session_state.arpu_index_arrays = None
+                st.session_state.ltv_cube = None
                 st.success("ARPU设置已保存！")
                 st.dataframe(arpu_df_manual[['data_source', 'arpu_value']], use_container_width=True)
             
@@ -2754,37 +5953,10 @@ elif current_page == "LTV结果报告":
         arpu_data = st.session_state.arpu_data
 
         # 计算LTV结果
-        ltv_results = []
-        
-        for lt_result_5y in lt_results_5y:
-            source = lt_result_5y['data_source']
-            
-            # 查找对应的2年LT数据
-            lt_result_2y = next((r for r in lt_results_2y if r['data_source'] == source), None)
-            
-            # 查找ARPU数据
-            arpu_row = arpu_data[arpu_data['data_source'] == source]
-            if not arpu_row.empty:
-                arpu_value = arpu_row.iloc[0]['arpu_value']
-            else:
-                arpu_value = 0
-                st.warning(f"渠道 '{source}' 未找到ARPU数据")
-
-            ltv_5y = lt_result_5y['lt_value'] * arpu_value
-            ltv_2y = lt_result_2y['lt_value'] * arpu_value if lt_result_2y else 0
-
-            ltv_results.append({
-                'data_source': source,
-                'lt_2y': lt_result_2y['lt_value'] if lt_result_2y else 0,
-                'lt_5y': lt_result_5y['lt_value'],
-                'arpu_value': arpu_value,
-                'ltv_2y': ltv_2y,
-                'ltv_5y': ltv_5y,
-                'fit_success': lt_result_5y['fit_success'],
-                'model_used': lt_result_5y.get('model_used', 'unknown'),
-                'power_params': lt_result_5y.get('fit_params', {}).get('power', {}),
-                'exp_params': lt_result_5y.get('fit_params', {}).get('exponential', {})
-            })
+        with pipeline_timer.stage("LTV组装", rows=len(lt_results_5y)):
+            ltv_results, missing_arpu_sources = assemble_ltv_results_vectorized(lt_results_2y, lt_results_5y, arpu_data)
+        for source in missing_arpu_sources:
+            st.warning(f"渠道 '{source}' 未找到ARPU数据")
 
         st.session_state.ltv_results = ltv_results
 
@@ -2802,6 +5974,9 @@ elif current_page == "LTV结果报告":
             if power_params:
                 power_func = f"Power: y = {power_params.get('a', 0):.4f} * x^{power_params.get('b', 0):.4f}"
                 备注_parts.append(power_func)
+
+            for model, params in result.get('stage1_params', {}).items():
+                备注_parts.append(f"Stage1 {model}: " + ", ".join(f"{k}={v:.4f}" for k, v in params.items()))
             
             if exp_params:
                 exp_func = f"Exp: y = {exp_params.get('c', 0):.4f} * exp({exp_params.get('d', 0):.4f} * x)"
@@ -2835,6 +6010,72 @@ elif current_page == "LTV结果报告":
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+        # 多ARPU区间对比：同一组LT拟合结果，在多个ARPU月份区间下一次算出LTV
+        with st.expander("多ARPU区间LTV对比", expanded=False):
+            if st.session_state.arpu_index_arrays is None:
+                st.info("需要在ARPU计算步骤按月份数据计算ARPU（手动设置的ARPU没有月份明细）")
+            else:
+                cube_index = ArpuPrefixIndex(**st.session_state.arpu_index_arrays)
+                span_options = {"最近1个月": 1, "最近3个月": 3, "最近6个月": 6, "最近12个月": 12, "全部月份": None}
+                selected_spans = st.multiselect("ARPU区间（以数据中最后一个月为终点）", list(span_options),
+                                                default=["最近1个月", "最近3个月", "最近6个月"], key="ltv_cube_windows")
+                if selected_spans and st.button("计算多区间LTV", key="run_ltv_cube"):
+                    arpu_windows = recent_arpu_windows(cube_index.months, [span_options[name] for name in selected_spans])
+                    with pipeline_timer.stage("多区间LTV", rows=len(lt_results_5y) * len(arpu_windows)):
+                        arpu_matrix = cube_index.window_matrix(arpu_windows, st.session_state.channel_mapping)
+                        ltv_cube = compute_ltv_cube({2: lt_results_2y, 5: lt_results_5y}, arpu_matrix)
+                    st.session_state.ltv_cube = {'windows': arpu_windows, 'arpu': arpu_matrix, 'ltv': ltv_cube}
+
+                ltv_cube_state = st.session_state.ltv_cube
+                if ltv_cube_state is not None:
+                    st.caption("；".join(f"{label}：{start or '全部'} 至 {end or '全部'}"
+                                        for label, start, end in ltv_cube_state['windows']))
+                    st.markdown("**各区间ARPU**")
+                    st.dataframe(ltv_cube_state['arpu'].round(4), use_container_width=True)
+                    st.markdown("**各区间LTV**（缺少LT或ARPU的组合留空）")
+                    ltv_display = ltv_cube_state['ltv'].round(2)
+                    ltv_display.columns = [f"{lt_years}年LTV·{window}" for lt_years, window in ltv_display.columns]
+                    st.dataframe(ltv_display, use_container_width=True)
+                    st.download_button(
+                        "下载多区间LTV", ltv_display.to_csv().encode('utf-8-sig'),
+                        file_name="ltv_by_arpu_window.csv", mime="text/csv", key="download_ltv_cube"
+                    )
+
+        # 自助法置信区间：重抽样各渠道逐日数据，批量重新拟合
+        with st.expander("LT/LTV置信区间（自助法）", expanded=False):
+            working_data = st.session_state.cleaned_data if st.session_state.cleaned_data is not None \
+                else st.session_state.merged_data
+            col_n, col_conf = st.columns(2)
+            with col_n:
+                n_resamples = st.number_input("重抽样次数", min_value=100, max_value=5000, value=1000, step=100,
+                                              key="bootstrap_resamples")
+            with col_conf:
+                confidence = st.select_slider("置信水平", options=[0.8, 0.9, 0.95, 0.99], value=0.95,
+                                              key="bootstrap_confidence")
+            if working_data is None or st.session_state.retention_data is None:
+                st.info("需要留存率计算所用的逐日数据")
+            elif st.button("计算置信区间", key="run_bootstrap_ci"):
+                with st.spinner("正在重抽样并批量拟合..."):
+                    bootstrap_start = time.perf_counter()
+                    ci_df, _ = bootstrap_lt_intervals(
+                        working_data, st.session_state.retention_data,
+                        {r['data_source']: r['arpu_value'] for r in ltv_results},
+                        n_resamples=int(n_resamples), confidence=confidence,
+                        stage1_models={
+                            r['data_source']: r['fit_params']['stage1']['model']
+                            for r in st.session_state.lt_results_5y or [] if 'stage1' in r.get('fit_params', {})
+                        }
+                    )
+                    st.session_state.bootstrap_ci = {
+                        'table': ci_df, 'n_resamples': int(n_resamples), 'confidence': confidence,
+                        'elapsed': time.perf_counter() - bootstrap_start
+                    }
+            bootstrap_ci = st.session_state.bootstrap_ci
+            if bootstrap_ci is not None and not bootstrap_ci['table'].empty:
+                st.caption(f"{bootstrap_ci['confidence']:.0%} 百分位区间，每渠道 {bootstrap_ci['n_resamples']} 次重抽样，"
+                           f"耗时 {bootstrap_ci['elapsed']:.2f} 秒（ARPU按点估计计入）")
+                st.dataframe(bootstrap_ci['table'].round(2), use_container_width=True)
+
         # 显示所有拟合曲线 - 一行三个
         if st.session_state.visualization_data_5y and st.session_state.original_data:
             st.markdown('<div class="glass-card">', unsafe_allow_html=True)
@@ -2845,6 +6086,8 @@ elif current_page == "LTV结果报告":
             
             # 按5年LT值排序
             sorted_channels = sorted(visualization_data_5y.items(), key=lambda x: x[1]['lt'])
+            # 对应的2年LT值按渠道一次性连接（缺失为None）
+            lt_2y_values = lookup_result_values(lt_results_2y, [name for name, _ in sorted_channels])
             
             # 每行显示3个图表
             for i in range(0, len(sorted_channels), 3):
@@ -2852,13 +6095,7 @@ elif current_page == "LTV结果报告":
                 for j, col in enumerate(cols):
                     if i + j < len(sorted_channels):
                         channel_name, curve_data_5y = sorted_channels[i + j]
-                        
-                        # 找到对应的2年LT值
-                        lt_2y_value = None
-                        for result_2y in lt_results_2y:
-                            if result_2y['data_source'] == channel_name:
-                                lt_2y_value = result_2y['lt_value']
-                                break
+                        lt_2y_value = lt_2y_values[i + j]
                         
                         with col:
                             # 显示渠道名称
@@ -2872,11 +6109,12 @@ elif current_page == "LTV结果报告":
                             """, unsafe_allow_html=True)
                             
                             # 显示图表
-                            fig = create_individual_channel_chart(
-                                channel_name, curve_data_5y, original_data, max_days=100
-                            )
-                            st.pyplot(fig, use_container_width=True)
-                            plt.close(fig)
+                            with pipeline_timer.stage("图表渲染", rows=1):
+                                fig = create_individual_channel_chart(
+                                    channel_name, curve_data_5y, original_data, max_days=100
+                                )
+                                st.pyplot(fig, use_container_width=True)
+                                plt.close(fig)
                             
                             # 显示2年和5年LT值
                             col_2y, col_5y = st.columns(2)
@@ -2886,7 +6124,7 @@ elif current_page == "LTV结果报告":
                                            background: rgba(34, 197, 94, 0.1);
                                            border-radius: 3px; margin: 0.1rem 0;
                                            color: #16a34a; font-size: 0.8rem; font-weight: 600;">
-                                    2年: {lt_2y_value:.2f}
+                                    2年: {format_lt_value(lt_2y_value)}
                                 </div>
                                 """, unsafe_allow_html=True)
                             with col_5y:
@@ -2985,6 +6223,115 @@ LTV用户生命周期价值分析报告
         st.info(f"请先完成：{', '.join(missing_components)}")
         st.markdown('</div>', unsafe_allow_html=True)
 
+elif current_page == "性能与校验":
+    st.markdown("""
+    <div class="principle-box">
+        <div class="principle-title">性能与校验</div>
+        <div class="principle-content">
+        所有加速实现（留存率、拟合、ARPU）都必须复现现有口径的数值结果。
+        等价校验在合成用例与脱敏的当前数据上并排运行现有实现与加速实现，逐字段报告超出容差的差异。
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+    st.subheader("数值等价校验")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        n_synthetic_cases = st.number_input("合成用例数", min_value=1, max_value=50, value=6, key="equivalence_cases")
+    with col2:
+        equivalence_seed = st.number_input("随机种子", min_value=0, value=0, key="equivalence_seed")
+    with col3:
+        include_session_data = st.checkbox("包含当前数据（脱敏）", value=True, key="equivalence_include_session",
+                                           disabled=st.session_state.merged_data is None)
+    available_checks = [name for name, spec in EQUIVALENCE_CHECKS.items() if spec["candidate"] is not None]
+    selected_checks = st.multiselect("校验项", options=available_checks, default=available_checks,
+                                     key="equivalence_checks")
+
+    if st.button("运行等价校验", type="primary", use_container_width=True, key="run_equivalence"):
+        with st.spinner("正在并排运行现有实现与加速实现..."):
+            corpus = generate_synthetic_corpus(int(n_synthetic_cases), seed=int(equivalence_seed))
+            if include_session_data and st.session_state.merged_data is not None:
+                corpus.append({
+                    'name': 'session-anonymized',
+                    'merged_data': anonymize_merged_data(st.session_state.merged_data),
+                    'arpu_df': corpus[0]['arpu_df'],
+                    'channel_mapping': DEFAULT_CHANNEL_MAPPING
+                })
+            summary_df, violations_df = run_equivalence_harness(corpus, selected_checks)
+            st.session_state.equivalence_results = {'summary': summary_df, 'violations': violations_df}
+
+    equivalence_results = st.session_state.equivalence_results
+    if equivalence_results is not None:
+        violations_df = equivalence_results['violations']
+        if violations_df.empty:
+            st.success(f"全部 {len(equivalence_results['summary'])} 组校验均在容差范围内")
+        else:
+            st.error(f"发现 {len(violations_df)} 处超出容差的差异")
+            st.dataframe(violations_df, use_container_width=True)
+        st.dataframe(equivalence_results['summary'].round(3), use_container_width=True)
+        st.download_button(
+            label="下载校验报告 (JSON)",
+            data=json.dumps({
+                'summary': equivalence_results['summary'].to_dict('records'),
+                'violations': violations_df.to_dict('records')
+            }, ensure_ascii=False, indent=2, default=str).encode('utf-8'),
+            file_name=f"Equivalence_Report_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.json",
+            mime="application/json",
+            key="download_equivalence"
+        )
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+    st.subheader("流水线性能基准")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        benchmark_files = st.number_input("留存文件数（渠道数）", min_value=1, max_value=200, value=10, key="benchmark_files")
+    with col2:
+        benchmark_days = st.number_input("每文件天数", min_value=7, max_value=120, value=45, key="benchmark_days")
+    with col3:
+        benchmark_arpu_rows = st.number_input("ARPU明细行数", min_value=100, max_value=2000000, value=20000,
+                                              step=1000, key="benchmark_arpu_rows")
+    with col4:
+        benchmark_hue_fraction = st.slider("hue格式占比", min_value=0.0, max_value=1.0, value=0.5, step=0.1,
+                                           key="benchmark_hue_fraction")
+    col1, col2 = st.columns(2)
+    with col1:
+        benchmark_repeats = st.number_input("计时重复次数", min_value=1, max_value=10, value=1, key="benchmark_repeats")
+    with col2:
+        benchmark_memory = st.checkbox("测量内存峰值（tracemalloc，单独运行一次）", value=True, key="benchmark_memory")
+
+    if st.button("运行性能基准", type="primary", use_container_width=True, key="run_benchmark"):
+        with st.spinner("正在生成合成工作簿并分阶段计时..."):
+            benchmark_inputs = generate_benchmark_inputs(
+                n_files=int(benchmark_files), n_days=int(benchmark_days), arpu_rows=int(benchmark_arpu_rows),
+                hue_fraction=benchmark_hue_fraction
+            )
+            # 文件整合过程中的提示信息只在运行期间显示
+            ingestion_messages = st.empty()
+            with ingestion_messages.container():
+                benchmark_df = run_pipeline_benchmark(benchmark_inputs, repeats=int(benchmark_repeats),
+                                                      measure_memory=benchmark_memory)
+            ingestion_messages.empty()
+            st.session_state.benchmark_results = {'config': benchmark_inputs['config'], 'result': benchmark_df}
+
+    benchmark_results = st.session_state.benchmark_results
+    if benchmark_results is not None:
+        compared_df, baseline_time = compare_benchmark_to_baseline(benchmark_results['result'], benchmark_results['config'])
+        if baseline_time is None:
+            st.info("该规模配置尚无基线，可将本次结果保存为基线")
+        elif compared_df['regression'].any():
+            st.error(f"相对 {baseline_time} 的基线，以下阶段出现性能回退："
+                     f"{', '.join(compared_df.loc[compared_df['regression'], 'stage'])}")
+        else:
+            st.success(f"各阶段均未超出 {baseline_time} 基线的容差（20%）")
+        st.dataframe(compared_df.round(4), use_container_width=True)
+        if st.button("保存为基线", key="save_benchmark_baseline"):
+            if save_benchmark_baseline(benchmark_results['config'], benchmark_results['result']):
+                st.success("基线已保存")
+                st.rerun()
+    st.markdown('</div>', unsafe_allow_html=True)
+
 # ==================== 底部信息 ====================
 with st.sidebar:
     st.markdown("---")
@@ -3007,3 +6354,41 @@ with st.sidebar:
         </p>
     </div>
     """, unsafe_allow_html=True)
+
+# ==================== 性能面板 ====================
+# 只在本次运行产生了记录时覆盖，纯界面交互的重跑不会清空上次的计时
+if pipeline_timer.records:
+    st.session_state.last_stage_timings = pipeline_timer.to_dataframe()
+
+with st.sidebar:
+    with st.expander("性能面板（上次运行）", expanded=False):
+        st.checkbox("记录内存峰值（tracemalloc）", key="timing_track_memory",
+                    help="开启后每个最外层阶段都会统计Python内存分配峰值，计算会明显变慢")
+        stage_timings = st.session_state.last_stage_timings
+        if stage_timings is None or stage_timings.empty:
+            st.caption("暂无计时记录")
+        else:
+            top_level = stage_timings[stage_timings['depth'] == 0]
+            st.caption(f"最外层阶段合计 {top_level['elapsed_ms'].sum():.1f} ms，共 {len(stage_timings)} 条记录")
+            breakdown = stage_timings.groupby('stage', sort=False).agg(
+                调用次数=('stage', 'size'),
+                耗时_ms=('elapsed_ms', 'sum'),
+                命中=('cache', lambda x: int((x == 'hit').sum())),
+                未命中=('cache', lambda x: int((x == 'miss').sum())),
+                行数=('rows', lambda x: x.dropna().sum() if x.notna().any() else None),
+                内存峰值_MB=('peak_mb', 'max')
+            ).reset_index().rename(columns={'stage': '阶段'})
+            breakdown['耗时_ms'] = breakdown['耗时_ms'].round(1)
+            breakdown['内存峰值_MB'] = breakdown['内存峰值_MB'].round(2)
+            st.dataframe(breakdown, use_container_width=True, hide_index=True)
+            st.download_button(
+                "下载原始计时", stage_timings.to_csv(index=False).encode('utf-8-sig'),
+                file_name="stage_timings.csv", mime="text/csv", key="download_stage_timings"
+            )
+        st.caption("缓存命名空间（本进程）")
+        cache_stats = cache_registry.stats()
+        cache_stats['hit_rate'] = (cache_stats['hit_rate'] * 100).round(1)
+        st.dataframe(cache_stats.rename(columns={
+            'namespace': '命名空间', 'description': '内容', 'version': '版本', 'writes': '写入(自上次失效)',
+            'hits': '命中', 'misses': '未命中', 'hit_rate': '命中率_%'
+        }), use_container_width=True, hide_index=True)